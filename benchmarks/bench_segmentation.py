@@ -0,0 +1,59 @@
+import re
+import sys
+import time
+import argparse
+import fitz  # PyMuPDF
+
+from pdf_scripts.segmentation import segment_text, get_profile
+
+# Times the single-pass segmenter on the full Canada act and on copies of it
+# joined end to end. Linear scaling shows up as a flat time per MB; the lazy
+# regex that pdf_classifier.py used before is timed alongside for comparison.
+#
+#   python -m benchmarks.bench_segmentation [pdf] [--profile canada_en] [--max-copies 8]
+
+# The Canada pattern pdf_classifier.py matched against the whole document
+OLD_PATTERN = re.compile(r"\n((\d{1,3}(\s*\(\d{0,2}\))?))\s+(.*?)(?=\n\d{1,3}(\s*\(\d{0,2}\))?\s+|PART\s|\Z)", re.DOTALL)
+
+def best_of(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that section segmentation scales linearly.")
+    parser.add_argument("pdf_path", nargs="?", default="inputs/CanadaCorporationsAct.pdf")
+    parser.add_argument("--profile", default="canada_en")
+    parser.add_argument("--max-copies", type=int, default=8, help="Largest document, in copies of the act")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per size (the fastest is reported)")
+    args = parser.parse_args()
+
+    with fitz.open(args.pdf_path) as doc:
+        text = "".join(page.get_text() for page in doc)
+        page_count = doc.page_count
+    profile = get_profile(args.profile)
+    print(f"{args.pdf_path}: {page_count} pages, {len(text):,} characters, profile {profile.name}\n")
+
+    print(f"{'copies':>6} {'MB':>7} {'sections':>9} {'segmenter s':>12} {'s/MB':>7} {'old regex s':>12} {'s/MB':>7}")
+    rates = []
+    copies = 1
+    while copies <= args.max_copies:
+        document = text * copies
+        mb = len(document.encode("utf-8")) / 1e6
+        new_time, sections = best_of(lambda: segment_text(document, profile), args.repeat)
+        old_time, _ = best_of(lambda: OLD_PATTERN.findall(document), args.repeat)
+        rates.append(new_time / mb)
+        print(f"{copies:>6} {mb:>7.2f} {len(sections):>9} {new_time:>12.3f} {new_time / mb:>7.3f} "
+              f"{old_time:>12.3f} {old_time / mb:>7.3f}")
+        copies *= 2
+
+    # Time per MB at the largest size relative to the smallest; ~1.0 is linear
+    ratio = rates[-1] / rates[0]
+    print(f"\nSegmenter time per MB, largest vs smallest document: {ratio:.2f}x")
+    return 0 if ratio < 2 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+from benchmarks.fake_llm import start_fake_llm
+
+# Checks that openai_batch.run_batch re-queues what a batch didn't finish,
+# against the Batch API stand-in in fake_llm.py (files, batches and their
+# output and error files). The fake server fails a seeded share of the lines
+# of every batch, so each attempt after the first must hold exactly the
+# requests that had no result yet. A reply that parse() rejects is re-queued
+# the same way, and a request that never succeeds ends up in the errors.
+#
+#   python -m benchmarks.check_batch [--requests 40] [--error-rate 0.3]
+
+REJECTED = "always-invalid"  # custom ID whose reply the check's parse() rejects
+
+def batch_lines(fake, file_id):
+    if not file_id:
+        return []
+    return [json.loads(line) for line in fake.files[file_id].splitlines() if line.strip()]
+
+def attempts_of(fake):
+    # [(submitted custom IDs, failed custom IDs)] per batch, in submission order
+    attempts = []
+    for batch in fake.batches.values():
+        submitted = {line["custom_id"] for line in batch_lines(fake, batch["input_file_id"])}
+        failed = {line["custom_id"] for line in batch_lines(fake, batch["error_file_id"])}
+        attempts.append((submitted, failed))
+    return attempts
+
+def check(fake, requests, outputs, errors, max_attempts):
+    # Returns a list of problems, empty if run_batch behaved
+    problems = []
+    attempts = attempts_of(fake)
+    if not attempts or attempts[0][0] != set(requests):
+        problems.append("the first batch doesn't hold every request")
+    for n in range(1, len(attempts)):
+        submitted, failed = attempts[n - 1]
+        # Failed lines, plus replies parse() rejected, go into the next batch
+        expected = failed | ({REJECTED} & submitted)
+        if attempts[n][0] != expected:
+            problems.append(f"attempt {n + 1} re-submitted {sorted(attempts[n][0])}, expected {sorted(expected)}")
+    if len(attempts) > max_attempts:
+        problems.append(f"{len(attempts)} batches for max_attempts={max_attempts}")
+    if set(outputs) | set(errors) != set(requests) or set(outputs) & set(errors):
+        problems.append("every request must end in exactly one of outputs and errors")
+    # Its last error is "invalid output" or, if that attempt's line failed, the server's error
+    if REJECTED not in errors:
+        problems.append("the reply parse() always rejects must end in the errors")
+    for custom_id in errors:
+        if custom_id != REJECTED and any(custom_id not in failed for _, failed in attempts):
+            problems.append(f"{custom_id} is in the errors but succeeded in some attempt")
+    return problems
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that run_batch re-queues failed batch requests.")
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--error-rate", type=float, default=0.3, help="Share of batch lines the fake server fails")
+    parser.add_argument("--max-attempts", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    server, fake, base_url = start_fake_llm(latency=0, error_rate=args.error_rate, seed=args.seed)
+    os.environ.update(OPENAI_BASE_URL=base_url, api_key="fake")
+    from openai_client import get_client
+    from openai_batch import run_batch
+
+    def parse(output):
+        if "reject me" in output:
+            raise ValueError("rejected by the check")
+        return output
+
+    requests = {f"req-{i}": {"model": "gpt-4o", "input": f"provision {i}"} for i in range(args.requests)}
+    requests[REJECTED] = {"model": "gpt-4o", "input": "reject me"}
+    with tempfile.TemporaryDirectory() as work_dir:
+        outputs, errors = run_batch(get_client(), requests, work_dir, "check", max_attempts=args.max_attempts,
+                                    poll_interval=0, parse=parse)
+    server.shutdown()
+
+    attempts = attempts_of(fake)
+    print(f"\n{len(requests)} requests, {len(attempts)} batches: "
+          + ", ".join(f"{len(submitted)} sent / {len(failed)} failed" for submitted, failed in attempts))
+    print(f"{len(outputs)} outputs, {len(errors)} errors")
+    problems = check(fake, requests, outputs, errors, args.max_attempts)
+    for problem in problems:
+        print(f"FAILED: {problem}")
+    if not problems:
+        print("OK: every attempt re-queued exactly the requests without a result")
+    return 1 if problems else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
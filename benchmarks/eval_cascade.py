@@ -0,0 +1,142 @@
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import contextlib
+
+# Compares a model cascade (cascade.py) with the single large model on
+# provisions that already have labels: the filter labels in a
+# provision_filter_llm.py CSV, or the subgroup and type in a classifier output.
+# For each run it prints how often the answers agree with the saved ones, the
+# time, the cost and how many calls each model handled, so the throughput gain
+# can be checked against any loss in accuracy.
+#
+#   python -m benchmarks.eval_cascade filter --cascade gpt-4o-mini:0.9,gpt-4o
+#   python -m benchmarks.eval_cascade classify --cascade gpt-4o-mini:0.9,gpt-4o --top-k 5
+#
+# With --fake the calls go to the fake server in fake_llm.py, which checks the
+# plumbing but says nothing about accuracy.
+
+FILTER_CSV = "outputs/filtered_provisions_KenyaPBO.csv"
+CLASSIFIED_JSON = "outputs/classified_provisions_KenyaPublicOrder.json"
+JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+def load_filter_sample(path, limit):
+    import pandas as pd
+    df = pd.read_csv(path)
+    df = df[df["label"].isin(["provision", "not_provision"])].head(limit)
+    return df["text"].tolist(), df["label"].tolist()
+
+def load_classify_sample(path, limit):
+    # Saved outputs are either objects or (older runs) JSON in a fenced string
+    with open(path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    texts, references = [], []
+    for record in records:
+        output = record.get("output")
+        if isinstance(output, str):
+            match = JSON_OBJECT.search(output)
+            try:
+                output = json.loads(match.group(0)) if match else None
+            except json.JSONDecodeError:
+                output = None
+        if isinstance(output, dict) and output.get("subgroup") and output.get("type"):
+            texts.append(record["provision"])
+            references.append((output["subgroup"], output["type"]))
+    return texts[:limit], references[:limit]
+
+def evaluate(name, spec, task, texts, references, args):
+    from cascade import Cascade
+    from engine import run_concurrently, estimate_tokens
+    from telemetry import telemetry
+
+    cascade = Cascade(spec, name)
+    if task == "filter":
+        from pdf_scripts.provision_filter_llm import filter_paragraph_cascade
+        work = lambda text: filter_paragraph_cascade(text, cascade, delay=0)["label"]
+    else:
+        from classifier import classify_provision_cascade
+
+        def work(text):
+            classification = classify_provision_cascade(text, cascade, args.top_k)
+            return classification.subgroup, classification.type
+
+    telemetry.reset()
+    start = time.perf_counter()
+    answers = run_concurrently(work, texts, max_workers=args.concurrency, requests_per_minute=args.rpm,
+                               tokens_per_minute=args.tpm, tokens_for=lambda text: estimate_tokens(text, 1500),
+                               on_error=lambda text, e: None, stage=task)
+    seconds = time.perf_counter() - start
+
+    summary = telemetry.summary()
+    answered = [(answer, reference) for answer, reference in zip(answers, references) if answer is not None]
+    agree = sum(answer == reference for answer, reference in answered)
+    return {
+        "run": name,
+        "cascade": spec,
+        "units": len(texts),
+        "errors": len(texts) - len(answered),
+        "seconds": round(seconds, 2),
+        "per_second": round(len(texts) / seconds, 2) if seconds else None,
+        "agreement": round(agree / len(answered), 3) if answered else None,
+        "cost_usd": summary["total_cost_usd"],
+        "calls": {model: totals["calls"] for model, totals in summary["models"].items()},
+        "tiers": cascade.summary(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare a model cascade with the single large model.")
+    parser.add_argument("task", choices=["filter", "classify"])
+    parser.add_argument("--cascade", default="gpt-4o-mini:0.9,gpt-4o", help="Tiers to evaluate (see cascade.py)")
+    parser.add_argument("--reference", help=f"Labelled file (default: {FILTER_CSV} or {CLASSIFIED_JSON})")
+    parser.add_argument("--limit", type=int, default=200, help="Labelled provisions to use")
+    parser.add_argument("--top-k", type=int, help="Classify with the K closest matrix entries in the prompt")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=int, default=500)
+    parser.add_argument("--tpm", type=int, default=200000)
+    parser.add_argument("--cache", action="store_true", help="Use the result cache (off by default, to time real calls)")
+    parser.add_argument("--fake", action="store_true", help="Send the calls to a local fake server")
+    parser.add_argument("--output", help="Also save the results as JSON here")
+    args = parser.parse_args()
+
+    from result_cache import cache
+    cache.enabled = args.cache
+    if args.fake:
+        from benchmarks.fake_llm import start_fake_llm
+        server, _, base_url = start_fake_llm(latency=0.05)
+        os.environ.update(OPENAI_BASE_URL=base_url, api_key="fake")
+
+    if args.task == "filter":
+        texts, references = load_filter_sample(args.reference or FILTER_CSV, args.limit)
+    else:
+        texts, references = load_classify_sample(args.reference or CLASSIFIED_JSON, args.limit)
+    largest = args.cascade.split(",")[-1].strip()
+    print(f"{len(texts)} labelled provisions; comparing {args.cascade} with {largest} alone\n")
+
+    results = []
+    for name, spec in (("single", largest), ("cascade", args.cascade)):
+        # The scripts' per-call chatter is silenced
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            results.append(evaluate(name, spec, args.task, texts, references, args))
+
+    print(f"{'run':8} {'units':>6} {'errors':>6} {'seconds':>8} {'units/s':>8} {'agreement':>9} {'cost $':>8}  calls")
+    for r in results:
+        calls = ", ".join(f"{model} {n}" for model, n in r["calls"].items())
+        print(f"{r['run']:8} {r['units']:>6} {r['errors']:>6} {r['seconds']:>8} {r['per_second']:>8} "
+              f"{r['agreement'] if r['agreement'] is not None else '-':>9} {r['cost_usd']:>8.4f}  {calls}")
+    print("\nCascade tiers:")
+    for tier in results[-1]["tiers"]:
+        print(f"  {tier['model']:14} kept {tier['kept']} of {tier['asked']}, escalated "
+              f"{tier['escalated_low_confidence']} (low confidence) + {tier['escalated_disagreement']} "
+              f"(disagreement), mean confidence {tier['mean_confidence']}")
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+    if args.fake:
+        server.shutdown()
+
+if __name__ == "__main__":
+    sys.exit(main())
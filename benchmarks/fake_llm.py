@@ -0,0 +1,292 @@
+import re
+import sys
+import json
+import math
+import time
+import zlib
+import uuid
+import random
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in for the parts of the OpenAI API the scripts use: Responses,
+# files, vector stores and batches. Answers are a fixed function of the
+# request, so runs are repeatable and cost nothing; latency, the share of
+# requests that fail and the token counts it reports are configurable.
+# Point a script at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+
+# Stand-in for the chunks file_search adds to the prompt
+FILE_SEARCH_TOKENS = 2000
+DEONTIC = re.compile(r"\b(shall|must|may)\b", re.IGNORECASE)
+PACKED_ITEM = re.compile(r"^\[(\d+)\]", re.MULTILINE)
+# Fake tokens: every JSON string is one token, so a field's value has one logprob
+FAKE_TOKEN = re.compile(r'"[^"]*"|[^"]+')
+# Prompt caching like the API's: a prefix of 1024+ tokens seen before is
+# cached, in steps of 128 tokens (~4 characters per token)
+CACHE_MIN_CHARS = 1024 * 4
+CACHE_STEP_CHARS = 128 * 4
+
+class FakeLLM:
+    def __init__(self, latency=0.2, jitter=0.1, error_rate=0.0, output_tokens=150, input_tokens=None,
+                 retry_after=0.5, seed=0, low_confidence_rate=0.2):
+        self.latency = latency
+        self.jitter = jitter              # +/- share of latency
+        self.error_rate = error_rate      # share of requests answered with a 429 or 500
+        self.output_tokens = output_tokens
+        self.input_tokens = input_tokens  # None: ~4 characters per token of the request
+        self.retry_after = retry_after
+        self.low_confidence_rate = low_confidence_rate  # share of replies with logprobs below 0.9
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.files = {}
+        self.batches = {}
+        self.prefixes = set()  # hashes of the prompt prefixes seen so far
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"requests": 0, "errors": 0, "input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+
+    def cached_tokens(self, request):
+        # Tokens of the longest prompt prefix an earlier request already sent
+        # (instructions first, then input, as the API reads them)
+        prompt = json.dumps([request.get("model"), request.get("instructions"), request.get("input")])
+        cached = 0
+        with self.lock:
+            for end in range(CACHE_MIN_CHARS, len(prompt) + 1, CACHE_STEP_CHARS):
+                digest = zlib.crc32(prompt[:end].encode("utf-8"))
+                if digest in self.prefixes:
+                    cached = end
+                self.prefixes.add(digest)
+        return cached // 4
+
+    def draw(self):
+        # (delay, fail?) for one request, from the seeded generator
+        with self.lock:
+            delay = self.latency * (1 + self.jitter * (2 * self.random.random() - 1))
+            return max(delay, 0), self.random.random() < self.error_rate
+
+    def usage(self, request):
+        if self.input_tokens is not None:
+            input_tokens = self.input_tokens
+        else:
+            input_tokens = len(json.dumps(request)) // 4
+            if any(tool.get("type") == "file_search" for tool in request.get("tools") or []):
+                input_tokens += FILE_SEARCH_TOKENS
+        cached_tokens = min(self.cached_tokens(request), input_tokens)
+        with self.lock:
+            self.stats["input_tokens"] += input_tokens
+            self.stats["cached_tokens"] += cached_tokens
+            self.stats["output_tokens"] += self.output_tokens
+        return {"input_tokens": input_tokens, "output_tokens": self.output_tokens,
+                "total_tokens": input_tokens + self.output_tokens,
+                "input_tokens_details": {"cached_tokens": cached_tokens},
+                "output_tokens_details": {"reasoning_tokens": 0}}
+
+    def answer(self, request):
+        # Output text for a responses.create() request, shaped by its schema
+        text_format = (request.get("text") or {}).get("format") or {}
+        text = request.get("input")
+        text = text if isinstance(text, str) else json.dumps(text)
+        if text_format.get("name") == "provision_filter":
+            label = "provision" if DEONTIC.search(text) else "not_provision"
+            return json.dumps({"label": label, "explanation": "fake"})
+        classification = {"subgroup": "Operations", "type": "Restrictive", "explanation": "fake"}
+        schema = text_format.get("schema") or {}
+        if text_format.get("name") == "classification":
+            return json.dumps(entry_classification(schema["properties"]["matrix_entry"]["enum"], text))
+        if text_format.get("name") == "packed_classification":
+            ids = schema["properties"]["classifications"]["items"]["properties"]["matrix_entry"]["enum"]
+            items = [dict(entry_classification(ids, text + n), index=int(n)) for n in PACKED_ITEM.findall(text)]
+            return json.dumps({"classifications": items})
+        return json.dumps(dict(classification, matched_matrix_provision="fake", provision=text[:200]))
+
+    def logprobs(self, text):
+        # Requested with include=["message.output_text.logprobs"] (see cascade.py)
+        with self.lock:
+            low = self.random.random() < self.low_confidence_rate
+            probability = self.random.uniform(0.3, 0.85) if low else self.random.uniform(0.95, 1.0)
+        return [{"token": token, "logprob": math.log(probability), "bytes": list(token.encode("utf-8")),
+                 "top_logprobs": []} for token in FAKE_TOKEN.findall(text)]
+
+    def response(self, request):
+        text = self.answer(request)
+        content = {"type": "output_text", "text": text, "annotations": []}
+        if "message.output_text.logprobs" in (request.get("include") or []):
+            content["logprobs"] = self.logprobs(text)
+        return {
+            "id": "resp_" + uuid.uuid4().hex, "object": "response", "created_at": int(time.time()),
+            "model": request.get("model", "gpt-4o"), "status": "completed",
+            "output": [{"type": "message", "id": "msg_" + uuid.uuid4().hex, "role": "assistant",
+                        "status": "completed",
+                        "content": [content]}],
+            "parallel_tool_calls": True, "tool_choice": "auto", "tools": [],
+            "usage": self.usage(request),
+        }
+
+    def create_batch(self, input_file_id):
+        # Batches complete at once; injected errors show up in the error file
+        lines = [json.loads(line) for line in self.files[input_file_id].splitlines() if line.strip()]
+        output, errors = [], []
+        for line in lines:
+            _, failed = self.draw()
+            if failed:
+                errors.append({"id": "batch_req_" + uuid.uuid4().hex, "custom_id": line["custom_id"],
+                               "response": {"status_code": 500, "body": {"error": {"message": "fake error"}}},
+                               "error": None})
+            else:
+                output.append({"id": "batch_req_" + uuid.uuid4().hex, "custom_id": line["custom_id"],
+                               "response": {"status_code": 200, "request_id": "req_fake",
+                                            "body": self.response(line["body"])},
+                               "error": None})
+        with self.lock:
+            self.stats["requests"] += len(lines)
+            self.stats["errors"] += len(errors)
+        batch_id = "batch_" + uuid.uuid4().hex[:12]
+        batch = {
+            "id": batch_id, "object": "batch", "endpoint": "/v1/responses", "input_file_id": input_file_id,
+            "completion_window": "24h", "status": "completed", "created_at": int(time.time()),
+            "output_file_id": self.add_file("\n".join(json.dumps(line) for line in output)),
+            "error_file_id": self.add_file("\n".join(json.dumps(line) for line in errors)) if errors else None,
+            "request_counts": {"total": len(lines), "completed": len(output), "failed": len(errors)},
+        }
+        self.batches[batch_id] = batch
+        return batch
+
+    def add_file(self, content):
+        file_id = "file-" + uuid.uuid4().hex[:12]
+        self.files[file_id] = content
+        return file_id
+
+def entry_classification(ids, text):
+    # A matrix entry ID allowed by the schema, picked from the text, with the
+    # subgroup and type that go with it ("GOVERNANCE-R1": Governance, Restrictive)
+    entry = ids[zlib.crc32(text.encode("utf-8")) % len(ids)]
+    category, number = entry.rsplit("-", 1)
+    return {"matrix_entry": entry, "subgroup": category.title(),
+            "type": "Restrictive" if number.startswith("R") else "Permissive", "explanation": "fake"}
+
+def vector_store(vector_store_id, name="fake"):
+    return {"id": vector_store_id, "object": "vector_store", "status": "completed", "created_at": 0,
+            "name": name, "usage_bytes": 0, "metadata": {}, "last_active_at": 0,
+            "file_counts": {"completed": 1, "failed": 0, "in_progress": 0, "cancelled": 0, "total": 1}}
+
+def file_batch(vector_store_id):
+    return {"id": "vsfb_" + uuid.uuid4().hex[:12], "object": "vector_store.file_batch", "status": "completed",
+            "vector_store_id": vector_store_id, "created_at": 0,
+            "file_counts": {"completed": 1, "failed": 0, "in_progress": 0, "cancelled": 0, "total": 1}}
+
+def make_handler(fake):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, obj, status=200, headers=None):
+            body = obj.encode("utf-8") if isinstance(obj, str) else json.dumps(obj).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", "application/json")
+            self.send_header("content-length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            parts = self.path.split("?")[0].strip("/").split("/")  # ["v1", "batches", id, ...]
+            if parts[1:] == ["stats"]:
+                return self.send(fake.stats)
+            if parts[1] == "batches" and len(parts) == 3:
+                return self.send(fake.batches[parts[2]])
+            if parts[1] == "files" and parts[-1] == "content":
+                return self.send(fake.files[parts[2]])
+            if parts[1] == "vector_stores" and len(parts) == 2:
+                return self.send({"object": "list", "data": [], "has_more": False})
+            if parts[1] == "vector_stores" and "file_batches" in parts:
+                return self.send(file_batch(parts[2]))
+            if parts[1] == "vector_stores":
+                return self.send(vector_store(parts[2]))
+            self.send({"error": {"message": f"not found: {self.path}"}}, 404)
+
+        def do_DELETE(self):
+            self.send({"id": self.path.rstrip("/").split("/")[-1], "object": "vector_store.deleted", "deleted": True})
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get("content-length", 0)))
+            path = self.path.split("?")[0].rstrip("/")
+            if path == "/v1/stats/reset":
+                fake.reset_stats()
+                return self.send({})
+            if path == "/v1/responses":
+                request = json.loads(body)
+                delay, failed = fake.draw()
+                time.sleep(delay)
+                with fake.lock:
+                    fake.stats["requests"] += 1
+                    fake.stats["errors"] += failed
+                if failed:
+                    # Alternate between the two retryable errors the scripts see in practice
+                    if fake.stats["errors"] % 2:
+                        return self.send({"error": {"message": "Rate limit reached (fake)", "type": "requests"}},
+                                         429, {"retry-after": str(fake.retry_after)})
+                    return self.send({"error": {"message": "Server error (fake)", "type": "server_error"}}, 500)
+                return self.send(fake.response(request))
+            if path == "/v1/files":
+                # Multipart upload: keep the content of batch input files
+                purpose = b'name="purpose"\r\n\r\nbatch' in body
+                content = ""
+                if purpose:
+                    start = body.index(b"\r\n\r\n", body.index(b'name="file"')) + 4
+                    end = body.index(b"\r\n--", start)
+                    content = body[start:end].decode("utf-8")
+                return self.send({"id": fake.add_file(content), "object": "file", "bytes": len(content),
+                                  "created_at": 0, "filename": "upload", "status": "processed",
+                                  "purpose": "batch" if purpose else "assistants"})
+            if path == "/v1/batches":
+                return self.send(fake.create_batch(json.loads(body)["input_file_id"]))
+            if path == "/v1/vector_stores":
+                return self.send(vector_store("vs_" + uuid.uuid4().hex[:12], json.loads(body or b"{}").get("name", "")))
+            if path.startswith("/v1/vector_stores/"):
+                return self.send(file_batch(path.split("/")[3]))
+            self.send({"error": {"message": f"not found: {self.path}"}}, 404)
+
+    return Handler
+
+def start_fake_llm(port=0, **options):
+    # Serves on a background thread; returns (server, fake, base_url)
+    fake = FakeLLM(**options)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(fake))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, fake, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+def add_fake_llm_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.2, help="Seconds per fake API call")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Random +/- share of the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of calls that fail with 429/500")
+    parser.add_argument("--output-tokens", type=int, default=150, help="Output tokens reported per call")
+    parser.add_argument("--input-tokens", type=int, help="Input tokens reported per call (default: from request size)")
+    parser.add_argument("--low-confidence-rate", type=float, default=0.2,
+                        help="Share of replies whose logprobs put them below 0.9 confidence")
+    parser.add_argument("--seed", type=int, default=0)
+
+def fake_llm_options(args):
+    return dict(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                output_tokens=args.output_tokens, input_tokens=args.input_tokens, seed=args.seed,
+                low_confidence_rate=args.low_confidence_rate)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the fake OpenAI server on its own.")
+    parser.add_argument("--port", type=int, default=8765)
+    add_fake_llm_arguments(parser)
+    args = parser.parse_args()
+
+    server, fake, base_url = start_fake_llm(args.port, **fake_llm_options(args))
+    print(f"Fake LLM listening; use OPENAI_BASE_URL={base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        sys.exit(0)
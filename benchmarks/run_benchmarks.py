@@ -0,0 +1,285 @@
+import os
+import sys
+import json
+import time
+import glob
+import resource
+import argparse
+import datetime
+import tempfile
+import contextlib
+import subprocess
+
+from benchmarks.fake_llm import start_fake_llm, add_fake_llm_arguments, fake_llm_options
+
+# Throughput benchmarks for the classifier, the filter loop, the batch
+# classifier and both PDF extractors, with every API call going to the local
+# fake server in fake_llm.py, so runs are free and repeatable. Each case runs
+# in its own process so its peak memory is its own. Results are saved to
+# benchmarks/results/ and can be compared with an earlier run:
+#
+#   python -m benchmarks.run_benchmarks
+#   python -m benchmarks.run_benchmarks --cases batch_classifier batch_packed --concurrency 16
+#   python -m benchmarks.run_benchmarks --compare benchmarks/results/20250610_120000.json
+
+# Paragraphs labelled by provision_filter_llm.py; the "provision" rows are the
+# input of the classification cases
+SAMPLE_CSV = "outputs/filtered_provisions_KenyaPBO.csv"
+RESULTS_DIR = "benchmarks/results"
+
+def load_sample(labelled_only):
+    import pandas as pd
+    df = pd.read_csv(SAMPLE_CSV)
+    if labelled_only:
+        df = df[df["label"] == "provision"]
+    return df["text"].tolist()
+
+@contextlib.contextmanager
+def timed(module, name, latencies):
+    # Inside the block, module.name is a wrapper that records how long each
+    # call takes; the original is put back afterwards, so runs don't stack
+    # wrappers
+    func = getattr(module, name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    setattr(module, name, wrapper)
+    try:
+        yield
+    finally:
+        setattr(module, name, func)
+
+def profile_for(pdf_path):
+    name = os.path.basename(pdf_path)
+    if "French" in name:
+        return "canada_fr"
+    return "kenya" if name.startswith("Kenya") else "canada_en"
+
+# Each case returns (units processed, per-call latencies in seconds)
+
+def case_extract_spacing(args):
+    from pdf_scripts.extract_generic_provisions import iter_provisions_by_spacing
+    count = 0
+    for pdf_path in sorted(glob.glob("inputs/*.pdf")):
+        count += sum(1 for _ in iter_provisions_by_spacing(pdf_path, workers=args.workers))
+    return count, []
+
+def case_extract_sections(args):
+    from pdf_scripts.segmentation import segment_pdf
+    count = 0
+    for pdf_path in sorted(glob.glob("inputs/*.pdf")):
+        count += sum(1 for _ in segment_pdf(pdf_path, profile_for(pdf_path), args.workers))
+    return count, []
+
+def case_classify_provision(args):
+    import classifier
+    from engine import call_with_backoff
+    provisions = load_sample(labelled_only=True)[:args.provisions]
+    latencies = []
+    with timed(classifier, "classify_provision", latencies):
+        for provision in provisions:
+            try:
+                # Retried like main.py does; the client itself doesn't retry
+                call_with_backoff(lambda text: classifier.classify_provision(text, top_k=args.top_k), provision,
+                                  stage="classify")
+            except Exception as e:
+                print(f" Error: {e}")
+    return len(provisions), latencies
+
+def case_filter_loop(args):
+    import pandas as pd
+    from pdf_scripts import provision_filter_llm
+    df = pd.DataFrame({"text": load_sample(labelled_only=False)[:args.provisions]})
+    latencies = []
+    with timed(provision_filter_llm, "filter_paragraph", latencies):
+        provision_filter_llm.filter_provisions(df, use_prefilter=not args.no_prefilter, delay=args.filter_delay)
+    return len(df), latencies
+
+def case_batch_classifier(args, pack=None):
+    from pdf_scripts import batch_classifier
+    import classifier
+    provisions = load_sample(labelled_only=True)[:args.provisions]
+    latencies = []
+    if pack:
+        target = classifier, "_classify_pack"
+    elif args.top_k:
+        target = batch_classifier, "classify_with_matrix_excerpt"
+    else:
+        target = batch_classifier, "classify_provision"
+    # Any vector store ID will do for the fake server; skipping the registry
+    # keeps fake IDs out of .cache/vector_stores.json
+    with timed(*target, latencies):
+        batch_classifier.classify_provisions(provisions, vector_store_id="vs_benchmark",
+                                             max_workers=args.concurrency, requests_per_minute=args.rpm,
+                                             tokens_per_minute=args.tpm, top_k=args.top_k, pack=pack)
+    return len(provisions), latencies
+
+def case_batch_packed(args):
+    return case_batch_classifier(args, pack=args.pack)
+
+def case_batch_api(args):
+    from pdf_scripts import batch_classifier
+    provisions = load_sample(labelled_only=True)[:args.provisions]
+    batch_classifier.classify_provisions_batch(provisions, vector_store_id="vs_benchmark", top_k=args.top_k,
+                                               poll_interval=0)
+    return len(provisions), []
+
+CASES = {
+    "extract_spacing": case_extract_spacing,
+    "extract_sections": case_extract_sections,
+    "classify_provision": case_classify_provision,
+    "filter_loop": case_filter_loop,
+    "batch_classifier": case_batch_classifier,
+    "batch_packed": case_batch_packed,
+    "batch_api": case_batch_api,
+}
+LLM_CASES = {"classify_provision", "filter_loop", "batch_classifier", "batch_packed", "batch_api"}
+# Cases that run under batch_classifier.py's rate limiter, and the limits its
+# command line uses by default. The benchmark's own --rpm/--tpm are far higher
+# so that cold runs measure the code, not the budget; with --cache these cases
+# are also run warm under the real defaults, where cache hits must not wait
+# for budget they don't use.
+LIMITED_CASES = {"batch_classifier", "batch_packed"}
+CLI_LIMITS = {"rpm": 500, "tpm": 30000}
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+def run_case(args):
+    # Child process: run one case with its chatter silenced and print one
+    # JSON line with the measurements
+    from result_cache import cache
+    cache.enabled = bool(args.cache_path)
+    if args.cache_path:
+        cache.path = args.cache_path
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        units, latencies = CASES[args.run_case](args)
+        seconds = time.perf_counter() - start
+
+    # ru_maxrss is in KB on Linux; process-pool workers count as children
+    peak_kb = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                  resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    print(json.dumps({"units": units, "seconds": seconds, "latencies": latencies, "peak_rss_mb": peak_kb / 1024}))
+
+def child_arguments(args):
+    # The options that cases read, passed on to the child process
+    options = ["--provisions", args.provisions, "--workers", args.workers, "--concurrency", args.concurrency,
+               "--rpm", args.rpm, "--tpm", args.tpm, "--pack", args.pack, "--filter-delay", args.filter_delay]
+    if args.top_k:
+        options += ["--top-k", args.top_k]
+    if args.no_prefilter:
+        options.append("--no-prefilter")
+    return [str(option) for option in options]
+
+def measure(name, args, fake, base_url, cache_path=None):
+    env = dict(os.environ, OPENAI_BASE_URL=base_url, api_key="fake", OPENAI_API_KEY="fake")
+    command = [sys.executable, "-m", "benchmarks.run_benchmarks", "--run-case", name] + child_arguments(args)
+    if cache_path:
+        command += ["--cache-path", cache_path]
+
+    fake.reset_stats()
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        print(completed.stderr)
+        raise RuntimeError(f"Benchmark case {name} failed")
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    stats = dict(fake.stats)
+
+    units = result["units"]
+    tokens = stats["input_tokens"] + stats["output_tokens"]
+    return {
+        "case": name,
+        "units": units,
+        "seconds": round(result["seconds"], 3),
+        "per_second": round(units / result["seconds"], 2) if result["seconds"] else None,
+        "p50_ms": round(1000 * percentile(result["latencies"], 0.50), 1) if result["latencies"] else None,
+        "p95_ms": round(1000 * percentile(result["latencies"], 0.95), 1) if result["latencies"] else None,
+        "peak_rss_mb": round(result["peak_rss_mb"], 1),
+        "requests": stats["requests"],
+        "errors": stats["errors"],
+        "tokens_per_unit": round(tokens / units, 1) if units and tokens else None,
+        # Share of input tokens the fake server served from its prompt cache
+        "cached_share": round(stats["cached_tokens"] / stats["input_tokens"], 3) if stats["input_tokens"] else None,
+    }
+
+def print_table(results, previous=None):
+    def show(value):
+        return "-" if value is None else value
+
+    print(f"\n{'case':42} {'units':>6} {'seconds':>8} {'units/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+          f"{'RSS MB':>7} {'requests':>8} {'errors':>6} {'tok/unit':>8} {'cached':>6}")
+    for r in results:
+        line = (f"{r['case']:42} {r['units']:>6} {r['seconds']:>8} {show(r['per_second']):>8} "
+                f"{show(r['p50_ms']):>8} {show(r['p95_ms']):>8} {r['peak_rss_mb']:>7} {r['requests']:>8} "
+                f"{r['errors']:>6} {show(r['tokens_per_unit']):>8} {show(r.get('cached_share')):>6}")
+        before = (previous or {}).get(r["case"])
+        if before and before.get("per_second") and r["per_second"]:
+            line += f"  ({r['per_second'] / before['per_second']:.2f}x units/s)"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the scripts against a fake LLM backend.")
+    parser.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    parser.add_argument("--provisions", type=int, default=100, help="Provisions (or paragraphs) per LLM case")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes for the PDF extractors")
+    parser.add_argument("--concurrency", type=int, default=8, help="Threads for the batch classifier")
+    parser.add_argument("--rpm", type=int, default=100000, help="Requests-per-minute budget of the batch classifier")
+    parser.add_argument("--tpm", type=int, default=100000000, help="Tokens-per-minute budget of the batch classifier")
+    parser.add_argument("--top-k", type=int, help="Classify with the K closest matrix entries instead of file search")
+    parser.add_argument("--pack", type=int, default=10, help="Provisions per request in batch_packed")
+    parser.add_argument("--filter-delay", type=float, default=1.2,
+                        help="Pause after each filter call, as in provision_filter_llm.py")
+    parser.add_argument("--no-prefilter", action="store_true", help="Send every paragraph to the fake LLM filter")
+    parser.add_argument("--cache", action="store_true",
+                        help="Turn the result cache on (fresh file) and run each LLM case again with it warm")
+    parser.add_argument("--compare", metavar="RESULTS_JSON", help="Earlier results file to compare against")
+    add_fake_llm_arguments(parser)
+    parser.add_argument("--run-case", choices=list(CASES), help=argparse.SUPPRESS)
+    parser.add_argument("--cache-path", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_case:
+        return run_case(args)
+
+    server, fake, base_url = start_fake_llm(**fake_llm_options(args))
+    print(f"Fake LLM at {base_url}: {args.latency}s latency, {args.error_rate:.0%} errors")
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in args.cases:
+            cache_path = os.path.join(tmp, f"{name}.sqlite") if args.cache and name in LLM_CASES else None
+            print(f" Running {name}...")
+            results.append(measure(name, args, fake, base_url, cache_path))
+            if cache_path:
+                results.append(dict(measure(name, args, fake, base_url, cache_path), case=f"{name} (warm cache)"))
+            if cache_path and name in LIMITED_CASES:
+                defaults = argparse.Namespace(**dict(vars(args), **CLI_LIMITS))
+                results.append(dict(measure(name, defaults, fake, base_url, cache_path),
+                                    case=f"{name} (warm cache, CLI limits)"))
+    server.shutdown()
+
+    previous = None
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            previous = {r["case"]: r for r in json.load(f)["results"]}
+    print_table(results, previous)
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    path = os.path.join(RESULTS_DIR, datetime.datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    settings = {key: value for key, value in vars(args).items() if key not in ("run_case", "cache_path")}
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"settings": settings, "results": results}, f, indent=2)
+    print(f"\nSaved results to {path}")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+import re
+import json
+import math
+import time
+import threading
+from dataclasses import dataclass
+
+from result_cache import cache
+from openai_client import get_client
+from telemetry import telemetry, field
+
+# Model cascade: a cheap model answers first, and only the answers it is
+# unsure of, or that contradict a local check, go on to the next (larger)
+# model. The confidence of an answer is the probability the model gave to the
+# values of its decision fields (e.g. "label"), read from the token logprobs of
+# the reply: for a strict json_schema reply those tokens are exactly the
+# chosen enum values.
+#
+# A cascade is written as "model:min_confidence,...,model", e.g.
+# "gpt-4o-mini:0.9,gpt-4o": gpt-4o-mini's answers with at least 0.9 confidence
+# are kept, the rest are asked again of gpt-4o. The last tier always answers.
+
+LOGPROBS = ["message.output_text.logprobs"]
+
+@dataclass
+class Tier:
+    model: str
+    min_confidence: float = 0.0  # below this, the answer goes to the next tier
+
+def parse_tiers(spec):
+    tiers = []
+    for part in spec.split(","):
+        model, _, threshold = part.strip().partition(":")
+        tiers.append(Tier(model, float(threshold) if threshold else 0.0))
+    if not tiers or not tiers[-1].model:
+        raise ValueError(f"Invalid cascade {spec!r}, expected e.g. gpt-4o-mini:0.9,gpt-4o")
+    return tiers
+
+def token_logprobs(response):
+    # [(token, logprob)] of the reply's output text, for an SDK response or a
+    # plain response body
+    tokens = []
+    for item in field(response, "output", []) or []:
+        if field(item, "type") != "message":
+            continue
+        for content in field(item, "content", []) or []:
+            for entry in field(content, "logprobs", []) or []:
+                tokens.append((field(entry, "token"), field(entry, "logprob")))
+    return tokens
+
+def confidence(response, fields):
+    # Lowest probability among the values of `fields` in the JSON reply, or
+    # None when the reply has no logprobs. Nested objects (packed replies)
+    # count every occurrence of a field.
+    tokens = token_logprobs(response)
+    if not tokens:
+        return None
+    text = "".join(token for token, _ in tokens)
+    starts = []
+    position = 0
+    for token, _ in tokens:
+        starts.append(position)
+        position += len(token)
+
+    lowest = None
+    for name in fields:
+        for match in re.finditer(rf'"{re.escape(name)}"\s*:\s*("?)([^",}}]*)\1', text):
+            start, end = match.span(2)
+            logprob = sum(lp for (token, lp), s in zip(tokens, starts) if s < end and s + len(token) > start)
+            probability = math.exp(logprob)
+            lowest = probability if lowest is None else min(lowest, probability)
+    return lowest
+
+class Cascade:
+    def __init__(self, tiers, name="cascade"):
+        self.tiers = parse_tiers(tiers) if isinstance(tiers, str) else tiers
+        self.name = name
+        self.lock = threading.Lock()
+        self.stats = [{"model": tier.model, "asked": 0, "kept": 0, "low_confidence": 0, "disagreement": 0,
+                       "errors": 0, "confidence_total": 0.0, "confidence_count": 0} for tier in self.tiers]
+
+    def run(self, ask, ask_last, check=None):
+        # ask(tier) -> (answer, confidence) for every tier but the last, which
+        # is answered by ask_last(tier). check(answer) returns False when a
+        # local check disagrees with the answer, which escalates it too, as
+        # does an error from ask(). An error from the last tier is raised.
+        for n, tier in enumerate(self.tiers):
+            stats = self.stats[n]
+            if n == len(self.tiers) - 1:
+                try:
+                    answer = ask_last(tier)
+                except Exception:
+                    with self.lock:
+                        stats["asked"] += 1
+                        stats["errors"] += 1
+                    raise
+                with self.lock:
+                    stats["asked"] += 1
+                    stats["kept"] += 1
+                return answer
+
+            try:
+                answer, score = ask(tier)
+            except Exception as e:
+                print(f" {tier.model} failed ({e}), asking the next model")
+                with self.lock:
+                    stats["asked"] += 1
+                    stats["errors"] += 1
+                continue
+            with self.lock:
+                stats["asked"] += 1
+                if score is not None:
+                    stats["confidence_total"] += score
+                    stats["confidence_count"] += 1
+                if score is None or score < tier.min_confidence:
+                    stats["low_confidence"] += 1
+                    continue
+                if check and not check(answer):
+                    stats["disagreement"] += 1
+                    continue
+                stats["kept"] += 1
+            return answer
+
+    def summary(self):
+        with self.lock:
+            total = self.stats[0]["asked"]
+            return [{
+                "model": s["model"],
+                "asked": s["asked"],
+                "kept": s["kept"],
+                "share_kept": round(s["kept"] / total, 3) if total else None,
+                "escalated_low_confidence": s["low_confidence"],
+                "escalated_disagreement": s["disagreement"],
+                "errors": s["errors"],
+                "mean_confidence": round(s["confidence_total"] / s["confidence_count"], 3)
+                if s["confidence_count"] else None,
+            } for s in self.stats]
+
+    def report(self):
+        print(f"\n {self.name}:")
+        for s in self.summary():
+            line = f"   {s['model']:14} asked {s['asked']}, kept {s['kept']}"
+            if s["share_kept"] is not None:
+                line += f" ({s['share_kept']:.0%} of all)"
+            if s["escalated_low_confidence"] or s["escalated_disagreement"]:
+                line += (f", escalated {s['escalated_low_confidence']} for low confidence and "
+                         f"{s['escalated_disagreement']} for disagreement")
+            if s["errors"]:
+                line += f", {s['errors']} errors"
+            if s["mean_confidence"] is not None:
+                line += f", mean confidence {s['mean_confidence']}"
+            print(line)
+
+def ask_with_confidence(request, fields, stage, parse=json.loads, attempts=2):
+    # One answer and its confidence from a lower tier. Cached like any other
+    # call; the confidence is stored with the reply.
+    def call():
+        for attempt in range(attempts):
+            start_time = time.time()
+            response = get_client().responses.create(include=LOGPROBS, **request)
+            telemetry.record_response(response, time.time() - start_time, stage=stage)
+            try:
+                parse(response.output_text)
+            except ValueError as e:
+                error = e
+                continue
+            return json.dumps({"output": response.output_text, "confidence": confidence(response, fields)})
+        raise error
+
+    stored = json.loads(cache.cached(call, function="cascade", include=LOGPROBS, **request))
+    return parse(stored["output"]), stored["confidence"]
+
+def add_cascade_arguments(parser):
+    parser.add_argument("--cascade", metavar="TIERS",
+                        help="Ask cheaper models first, e.g. gpt-4o-mini:0.9,gpt-4o: answers below 0.9 "
+                             "confidence go to the next model")
@@ -0,0 +1,114 @@
+import json
+from dataclasses import dataclass, asdict
+
+from matrix_index import load_matrix_index
+
+# Structured output shared by the classifiers. The model answers through a
+# strict json_schema (like provision_filter_llm.py does) and names the matched
+# matrix entry by its ID from matrix_index.py ("GOVERNANCE-R1") instead of
+# copying the entry's text, so every reply parses, is short, and points at
+# exactly one entry. Replies are parsed once here into a Classification;
+# results are saved as JSON objects, not as fenced strings.
+
+MATRIX_PATH = "data/cso-matrix.txt"
+SUBGROUPS = ["Formation", "Governance", "Operations", "Resources"]
+TYPES = ["Restrictive", "Permissive"]
+
+class InvalidOutput(ValueError):
+    pass
+
+@dataclass
+class Classification:
+    matrix_entry: str    # ID of the closest matrix entry, e.g. "GOVERNANCE-R1"
+    subgroup: str        # one of SUBGROUPS
+    type: str            # one of TYPES
+    explanation: str
+
+    def entry(self, matrix_path=MATRIX_PATH):
+        # The MatrixEntry itself, with the entry's text
+        return load_matrix_index(matrix_path).by_id[self.matrix_entry]
+
+    def agrees_with_entry(self, matrix_path=MATRIX_PATH):
+        # The matched entry's own category and polarity give a subgroup and
+        # type; an answer that contradicts them is inconsistent
+        entry = self.entry(matrix_path)
+        return entry.subgroup == self.subgroup and entry.type == self.type
+
+    def to_dict(self):
+        return asdict(self)
+
+def entry_ids(matrix_path=MATRIX_PATH):
+    return [entry.id for entry in load_matrix_index(matrix_path).entries]
+
+def classification_properties(matrix_path=MATRIX_PATH):
+    return {
+        "matrix_entry": {"type": "string", "enum": entry_ids(matrix_path)},
+        "subgroup": {"type": "string", "enum": SUBGROUPS},
+        "type": {"type": "string", "enum": TYPES},
+        "explanation": {"type": "string"}
+    }
+
+def classification_schema(matrix_path=MATRIX_PATH):
+    return {
+        "type": "object",
+        "properties": classification_properties(matrix_path),
+        "required": ["matrix_entry", "subgroup", "type", "explanation"],
+        "additionalProperties": False
+    }
+
+# The `text` argument of client.responses.create() for a single classification
+def classification_format(matrix_path=MATRIX_PATH):
+    return {
+        "format": {
+            "type": "json_schema",
+            "name": "classification",
+            "strict": True,
+            "schema": classification_schema(matrix_path)
+        }
+    }
+
+# Instruction line for prompts where the matrix is read through file_search,
+# whose chunks carry the matrix's own numbering rather than the IDs
+ENTRY_ID_INSTRUCTIONS = (
+    "Give the matched matrix entry as its ID: the category, then R for a RESTRICTIVE PROVISION or P for a "
+    "PERMISSIVE PROVISION, then its number. For example, RESTRICTIVE PROVISION 3 under "
+    "\"### CATEGORY: GOVERNANCE\" is GOVERNANCE-R3."
+)
+
+def parse_classification(output, matrix_path=MATRIX_PATH):
+    # `output` is the reply text or an already decoded dict. Raises
+    # InvalidOutput for anything the schema should have ruled out (refusals,
+    # truncated replies, unknown entry IDs).
+    if isinstance(output, str):
+        try:
+            output = json.loads(output)
+        except json.JSONDecodeError as e:
+            raise InvalidOutput(f"not JSON: {e}") from None
+    if not isinstance(output, dict):
+        raise InvalidOutput(f"expected an object, got {type(output).__name__}")
+    try:
+        classification = Classification(matrix_entry=output["matrix_entry"], subgroup=output["subgroup"],
+                                        type=output["type"], explanation=output["explanation"])
+    except KeyError as e:
+        raise InvalidOutput(f"missing field {e}") from None
+    if classification.matrix_entry not in load_matrix_index(matrix_path).by_id:
+        raise InvalidOutput(f"unknown matrix entry {classification.matrix_entry!r}")
+    if classification.subgroup not in SUBGROUPS or classification.type not in TYPES:
+        raise InvalidOutput(f"unknown subgroup or type: {classification.subgroup}, {classification.type}")
+    return classification
+
+def dumps(classification):
+    # Compact JSON, as stored in the result cache
+    return json.dumps(classification.to_dict(), ensure_ascii=False, separators=(",", ":"))
+
+def classify_with_retries(create, attempts=2, matrix_path=MATRIX_PATH):
+    # create() makes one API call and returns the reply text. A reply that
+    # doesn't parse is asked for again, up to `attempts` calls in all.
+    for attempt in range(1, attempts + 1):
+        try:
+            return parse_classification(create(), matrix_path)
+        except InvalidOutput as e:
+            error = e
+            if attempt < attempts:
+                print(f" Invalid classification ({e}), retrying")
+    raise error
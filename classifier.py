@@ -1,140 +1,285 @@
-import os
-from openai import OpenAI
-from dotenv import load_dotenv
+import json
+import threading
 import time
+from engine import run_concurrently, estimate_tokens
+from result_cache import cache, file_version, make_key
+from vector_store_registry import get_vector_store
+from matrix_index import load_matrix_index
+from classification import (
+    MATRIX_PATH, InvalidOutput, classification_format, classification_properties, parse_classification,
+    classify_with_retries, dumps
+)
+from openai_client import get_client
+from cascade import ask_with_confidence
+from telemetry import telemetry
+from prompts import (
+    classify_prompt, packed_prompt, BATCH_FILE_SEARCH_INSTRUCTIONS, PACKED_INSTRUCTIONS, CLASSIFY_CACHE_KEY,
+    PACKED_CACHE_KEY
+)
 
-# Load .env variables (to keep the API key secure)
-load_dotenv()
-client = OpenAI(api_key=os.getenv("api_key"))
+# Content hash of the matrix, part of every cache key
+def matrix_version():
+    return file_version(MATRIX_PATH)
 
-# Load the CSO Matrix typology from file
-with open("data/cso-matrix.txt", "r", encoding="utf-8") as f:
-    matrix_typology = f.read()
+def build_classify_request(provision_text, top_k=None, model="gpt-4o"):
+    # Arguments for client.responses.create(), also used to build Batch API files
+    # With top_k, only the k matrix entries closest to the provision (ranked
+    # locally, see matrix_index.py) go into the prompt instead of the whole typology.
+    # The layout (static prefix, provision last) is in prompts.py.
+    excerpt = None
+    if top_k:
+        with telemetry.stage("retrieval"):
+            excerpt = load_matrix_index(MATRIX_PATH).excerpt(provision_text, top_k, ids=True)
+    instructions, prompt = classify_prompt(provision_text, excerpt)
 
-def classify_provision(provision_text):
-    prompt = f"""
-    Classify the following provision using the CSO Regulatory Regime Matrix. Use the following typology as your reference:
-    {matrix_typology}
-    Find the closest matching concept. If no exact match exists, choose the conceptually closest category.
+    return dict(
+        model=model,
+        instructions=instructions,
+        input=prompt,
+        text=classification_format(MATRIX_PATH),
+        temperature=0.2,
+        prompt_cache_key=CLASSIFY_CACHE_KEY
+    )
 
-    Classify the provision as either:
-    - Restrictive: if it imposes barriers or burdens on CSO activity.
-    - Permissive: if it enables, supports, or simplifies CSO activity.
+# Result cache key of classify_provision's answer to a request (the parts it
+# passes to cache.cached)
+def classify_cache_key(request):
+    return make_key(matrix_version=matrix_version(), **request)
 
-    Assign the provision to one of the four CSO Matrix subgroups: Formation, Governance, Operations, Resources.
-    Once assigned, do not change the category.
+# Returns a Classification; replies that don't parse are requested again
+def classify_provision(provision_text, top_k=None, model="gpt-4o"):
+    with telemetry.stage("classify"):
+        request = build_classify_request(provision_text, top_k, model)
 
-    Return a JSON object like this:
+        def create():
+            start_time = time.time()
 
-    {{
-    "provision": "{provision_text}",
-    "matched_matrix_provision": "Closest concept from matrix, as it appears in the matrix.",
-    "subgroup": "Formation | Governance | Operations | Resources",
-    "type": "Restrictive | Permissive",
-    "explanation": "Brief legal reasoning and justification based on the matrix."
-    }}
-    """
+            response = get_client().responses.create(**request)
 
-    start_time = time.time()
+            end_time = time.time()
+            duration = round(end_time - start_time, 2)
+            telemetry.record_response(response, end_time - start_time)
 
-    response = client.responses.create(
-        model="gpt-4o",
-        instructions=(
-            "You are a legal classification assistant trained in civil society regulation. "
-            "Read the input prompt carefully and follow all formatting instructions. "
-            "Do not speculate beyond the matrix provided in the prompt."
-        ),
-        input= prompt,
-        temperature=0.2
-    )
+            usage = response.usage
+            print(f"Classified in {duration} seconds ({usage.input_tokens} input, "
+                  f"{usage.output_tokens} output tokens)")
 
-    end_time = time.time()
-    duration = round(end_time - start_time, 2)
-
-    usage = response.usage
-    print("\nToken Usage:")
-    print(f"Input tokens: {usage.input_tokens}")
-    print(f"Output tokens: {usage.output_tokens}")
-    print(f"Total tokens: {usage.total_tokens}")
-    print(f"Execution time: {duration} seconds\n")
-
-    return response.output_text
-
-def classify_provision_with_file_search(provision_text, matrix_path):
-    # Create vector store
-    vector_store = client.vector_stores.create(name="CSO_Matrix_Vector_Store")
-    vector_store_id = vector_store.id
-
-    # Upload the CSO matrix
-    print("Matrix uploaded")
-    with open(matrix_path, "rb") as f:
-        client.vector_stores.file_batches.upload_and_poll(
-            vector_store_id=vector_store_id,
-            files=[f]
-        )
-
-    # API
-    print("\nClassifying...\n")
-    start_time = time.time()
+            return response.output_text
+
+        output = cache.cached(lambda: dumps(classify_with_retries(create)),
+                              matrix_version=matrix_version(), **request)
+        return parse_classification(output)
+
+# Same, through a model cascade (see cascade.py). Besides low confidence, an
+# answer is escalated when its subgroup or type contradicts the matrix entry it
+# picked.
+def classify_provision_cascade(provision_text, cascade, top_k=None):
+    def ask(tier):
+        request = build_classify_request(provision_text, top_k, tier.model)
+        return ask_with_confidence(request, ["matrix_entry", "subgroup", "type"], "classify",
+                                   parse=parse_classification)
+
+    with telemetry.stage("classify"):
+        return cascade.run(ask, lambda tier: classify_provision(provision_text, top_k, tier.model),
+                           check=lambda classification: classification.agrees_with_entry())
 
-    response = client.responses.create(
-        model="gpt-4.1",
-        instructions=("""
-            You are a legal classification assistant trained in civil society regulation.
-            Read the input prompt carefully and follow all formatting instructions, do not speculate beyond the matrix provided.
-            
-            When prompted a legal provision, explain who has the duty to do what's stated in the provision, what has to be done and what are the consequences of not following said provision.
-            Think about the institutional grammar, these are the legal components to consider:
-                                  • Attribute (A) identifies to whom the institutional statement applies, and if no attributes
-                                    are named, then the default assumption is all members of the group;
-                                    • Deontic (D) denotes the expectation of behavior identified by the qualifiers ‘may’ (permit-
-                                    ted), ‘must’ (obliged), and ‘must not’ (forbidden);
-                                    • AIm (I) prescribes particular action or outcome, or specifies forbidden actions or outcomes;
-                                    • Condition (C) explains when and where the institutional statement applies, and if no
-                                    conditions exist, then the default assumption is that it applies to all persons, at all times and
-                                    all places, under all circumstances;
-                                    • Or Else (O) provides the institutionally assigned sanction for noncompliance. This com-
-                                    ponent must have three qualifications: (i) sanctioning provision is the result of an explicit
-                                    collective-choice decision that is separate from any internal or social penalty, (ii) be backed by
-                                    at least one other institutional statement that if noncompliance occurs changes the DEONTIC
-                                    assigned to some AIM for at least one actor, and (iii) affect the constraints and opportunities
-                                    of actors responsible for monitoring the conformance of offenders.
-                      
-            
-                      
-            Use the File Search tool to find the closest matching concept in the CSO Matrix.
-            Find the closest matching concept in the legal provision. If no exact match exists, choose the conceptually closest category.
-                      
-        I classify provisions as either restrictive or permissive using a two-step process. First, a provision is permissive if its reasonable and impartial enforcement improves trust, accountability, or resolves “voluntary failures”. Classification advances to the second stage if there is no clear demand-side prediction. Here, a provision is restrictive if its reasonable and impartial enforcement limits organizational autonomy or stifles organizational emergence.
-                      
-            Assign the provision to one of the four CSO Matrix subgroups: Formation, Governance, Operations, Resources.
-            Once assigned, do not change the category.
-                      
-            Always return only a JSON object like this:
-
-            {{
-            "provision": "the exact provision text provided",
-            "interpretation: "Who has the duty, what has to be done, and what are the consequences of not following said provision.",
-            "matched_matrix_provision": "Closest concept from matrix, exactly as it appears in the matrix.",
-            "subgroup": "Formation | Governance | Operations | Resources",
-            "type": "Restrictive | Permissive",
-            "explanation": "Brief legal reasoning and justification based on the matrix."
-            }}
-    
-            """
-        ),
+def build_file_search_request(provision_text, vector_store_id, matrix_path=MATRIX_PATH):
+    # Arguments for client.responses.create() with the matrix read through
+    # file_search, also used to build Batch API files
+    return dict(
+        model="gpt-4o",
+        instructions=BATCH_FILE_SEARCH_INSTRUCTIONS,
+        input=provision_text,
         tools=[{
             "type": "file_search",
             "vector_store_ids": [vector_store_id]
         }],
-        input=(
-            f"""
-            Classify the following provision using the CSO Matrix: {provision_text}
-            """
-        ),
+        text=classification_format(matrix_path),
         temperature=0.2
     )
 
-    end_time = time.time()
-    print(f"Completed in {round(end_time - start_time, 2)} seconds.")
-    return response.output_text
\ No newline at end of file
+def file_search_cache_parts(provision_text, matrix_path=MATRIX_PATH):
+    # Keyed on the matrix contents rather than the vector store ID, which
+    # changes from run to run. The function name is the one batch_classifier.py
+    # first cached these answers under.
+    return dict(
+        function="batch_classifier.classify_provision",
+        model="gpt-4o",
+        instructions=BATCH_FILE_SEARCH_INSTRUCTIONS,
+        matrix_version=file_version(matrix_path),
+        temperature=0.2,
+        input=provision_text
+    )
+
+# Returns a Classification, with the matrix read through file_search. Without
+# a vector_store_id the store holding this version of the matrix is looked up
+# (and uploaded on first use) only when the answer isn't cached.
+def classify_provision_with_file_search(provision_text, matrix_path=MATRIX_PATH, vector_store_id=None):
+    def create():
+        store_id = vector_store_id
+        if store_id is None:
+            with telemetry.stage("retrieval"):
+                store_id = get_vector_store(get_client(), [matrix_path], "CSO_Matrix_Store")
+        start_time = time.time()
+
+        response = get_client().responses.create(**build_file_search_request(provision_text, store_id, matrix_path))
+
+        end_time = time.time()
+        telemetry.record_response(response, end_time - start_time, stage="classify")
+        print(f" Classified in {round(end_time - start_time, 2)}s")
+        return response.output_text
+
+    output = cache.cached(lambda: dumps(classify_with_retries(create, matrix_path=matrix_path)),
+                          **file_search_cache_parts(provision_text, matrix_path))
+    return parse_classification(output, matrix_path)
+
+# Packed classification: several provisions per request. The matrix and the
+# instructions are the bulk of every prompt, so sending them once for a batch of
+# provisions instead of once per provision cuts input tokens several times over.
+def packed_schema():
+    return {
+        "type": "object",
+        "properties": {
+            "classifications": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": dict(index={"type": "integer"}, **classification_properties(MATRIX_PATH)),
+                    "required": ["index", "matrix_entry", "subgroup", "type", "explanation"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["classifications"],
+        "additionalProperties": False
+    }
+
+class PackError(Exception):
+    pass
+
+def _classify_pack(provisions, stats, attempts=2):
+    # One request for the whole pack. Returns one Classification per provision.
+    # Raises PackError when the reply is truncated or doesn't line up with the input.
+    instructions, numbered = packed_prompt(provisions)
+    request = dict(
+        model="gpt-4o",
+        instructions=instructions,
+        input=numbered,
+        text={
+            "format": {
+                "type": "json_schema",
+                "name": "packed_classification",
+                "strict": True,
+                "schema": packed_schema()
+            }
+        },
+        temperature=0.2,
+        prompt_cache_key=PACKED_CACHE_KEY
+    )
+
+    for attempt in range(attempts):
+        start_time = time.time()
+        response = get_client().responses.create(**request)
+        telemetry.record_response(response, time.time() - start_time, stage="classify")
+        with stats["lock"]:
+            stats["requests"] += 1
+            stats["input_tokens"] += response.usage.input_tokens
+            stats["output_tokens"] += response.usage.output_tokens
+
+        if response.status == "incomplete":
+            # Output hit the token limit; retrying the same pack won't help
+            raise PackError(f"truncated output ({response.incomplete_details})")
+        try:
+            items = json.loads(response.output_text)["classifications"]
+            by_index = {item["index"]: parse_classification(item) for item in items}
+        except (json.JSONDecodeError, KeyError, TypeError, InvalidOutput) as e:
+            error = PackError(f"unparseable output: {e}")
+            continue
+        if sorted(by_index) != list(range(1, len(provisions) + 1)):
+            error = PackError(f"expected {len(provisions)} classifications, got indices {sorted(by_index)}")
+            continue
+
+        return [by_index[i] for i in range(1, len(provisions) + 1)]
+    raise error
+
+def _classify_pack_or_split(provisions, stats):
+    # Halve a pack that fails until it goes through. A single provision that
+    # still fails falls back to the one-at-a-time classifier.
+    try:
+        return _classify_pack(provisions, stats)
+    except PackError as e:
+        if len(provisions) == 1:
+            print(f" Packed classification failed ({e}), classifying on its own")
+            with stats["lock"]:
+                stats["fallbacks"] += 1
+            return [classify_provision(provisions[0])]
+        print(f" Pack of {len(provisions)} failed ({e}), splitting")
+        with stats["lock"]:
+            stats["splits"] += 1
+        middle = len(provisions) // 2
+        return _classify_pack_or_split(provisions[:middle], stats) + _classify_pack_or_split(provisions[middle:], stats)
+
+# Result cache key of one provision classified in a pack; the same whichever
+# pack it was sent in
+def packed_cache_key(provision_text):
+    return make_key(function="classify_provisions_packed", model="gpt-4o", instructions=PACKED_INSTRUCTIONS,
+                    matrix_version=matrix_version(), temperature=0.2, input=provision_text)
+
+def classify_provisions_packed(provisions, batch_size=10, max_workers=4, on_result=None,
+                               requests_per_minute=None, tokens_per_minute=None, limiter=None, on_error=None):
+    # Classify a list of provisions batch_size at a time and return their
+    # Classifications in order. Cached provisions are not sent again.
+    # on_result(index, classification) is called as soon as each one is known.
+    # With on_error, a pack that still fails after its retries calls
+    # on_error(index, error) for each of its provisions, whose place in the
+    # result stays None, and the other packs go on; otherwise the error is raised.
+    # limiter: an engine.RateLimiter shared with the caller's other requests,
+    # instead of one built from requests_per_minute and tokens_per_minute.
+    stats = {"lock": threading.Lock(), "requests": 0, "input_tokens": 0, "output_tokens": 0,
+             "splits": 0, "fallbacks": 0}
+    outputs = [None] * len(provisions)
+    keys = {}
+    pending = []
+
+    for i, text in enumerate(provisions):
+        keys[i] = packed_cache_key(text)
+        cached = cache.get(keys[i])
+        if cached is None:
+            pending.append(i)
+            continue
+        outputs[i] = parse_classification(cached)
+        if on_result:
+            on_result(i, outputs[i])
+
+    packs = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+
+    def classify_pack(pack):
+        results = _classify_pack_or_split([provisions[i] for i in pack], stats)
+        for i, output in zip(pack, results):
+            outputs[i] = output
+            cache.put(keys[i], dumps(output))
+            if on_result:
+                on_result(i, output)
+        return results
+
+    def failed_pack(pack, error):
+        for i in pack:
+            on_error(i, error)
+
+    start_time = time.time()
+    matrix_tokens = estimate_tokens(packed_prompt([])[0])
+    run_concurrently(classify_pack, packs, max_workers=max_workers,
+                     requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute,
+                     tokens_for=lambda pack: sum(estimate_tokens(provisions[i], 80) for i in pack) + matrix_tokens,
+                     on_error=failed_pack if on_error else None, stage="classify", limiter=limiter)
+    duration = round(time.time() - start_time, 2)
+
+    if pending:
+        total_tokens = stats["input_tokens"] + stats["output_tokens"]
+        print(f"\nPacked {len(pending)} provisions into {stats['requests']} requests "
+              f"({stats['splits']} splits, {stats['fallbacks']} single fallbacks) in {duration} seconds")
+        print(f"Input tokens: {stats['input_tokens']}, output tokens: {stats['output_tokens']}")
+        print(f"Tokens per provision: {round(total_tokens / len(pending), 1)} "
+              f"({round(stats['input_tokens'] / len(pending), 1)} input, "
+              f"vs ~{matrix_tokens} input when classified one at a time)\n")
+    return outputs
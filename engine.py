@@ -0,0 +1,175 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from telemetry import telemetry
+
+# Errors worth retrying: rate limits, server errors and dropped connections.
+# Anything else (bad request, auth) is returned to the caller immediately.
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    # Classic token bucket: holds up to `capacity` units and refills at
+    # `capacity` per `period` seconds. Thread safe.
+    def __init__(self, capacity, period=60.0):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount):
+        # Take `amount` units and return how long the caller must wait before
+        # they are actually available. The balance may go negative, which keeps
+        # waiting callers in arrival order.
+        amount = min(float(amount), self.capacity)
+        with self.lock:
+            self._refill()
+            self.available -= amount
+            if self.available >= 0:
+                return 0.0
+            return -self.available / self.rate
+
+    def adjust(self, amount):
+        # Correct a reservation once the real cost is known (positive = debit
+        # more). A refund never fills the bucket beyond its capacity.
+        with self.lock:
+            self._refill()
+            self.available = min(self.capacity, self.available - amount)
+
+
+class RateLimiter:
+    # Requests-per-minute and tokens-per-minute budgets, plus a shared pause
+    # that every worker honours after the API pushes back with a 429/5xx.
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens=0):
+        wait = 0.0
+        if self.requests:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens and tokens:
+            wait = max(wait, self.tokens.reserve(tokens))
+        wait = max(wait, self.paused_until - time.monotonic())
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def record_usage(self, estimated, actual):
+        if self.tokens and actual is not None:
+            # reserve() took at most the bucket's capacity
+            self.tokens.adjust(actual - min(estimated, self.tokens.capacity))
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def estimate_tokens(text, overhead=0):
+    # Rough count (~4 characters per token) used to reserve TPM budget up front.
+    return overhead + len(text) // 4 + 1
+
+
+def is_retryable(error):
+    import openai  # loaded by the time an API call has failed
+    if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS
+    return False
+
+
+def retry_after(error):
+    # Honour the server's Retry-After header when it sends one.
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    try:
+        return float(response.headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    # Exponential backoff with full jitter.
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def call_with_backoff(func, item, limiter=None, tokens=0, max_retries=6, stage=None):
+    # `tokens` is reserved from the limiter's TPM budget before each attempt
+    # and settled afterwards with the tokens the replies of the attempt really
+    # used, as recorded in the run telemetry. With `stage`, waits, retries and
+    # the call itself are counted towards that stage in the run telemetry.
+    if stage:
+        with telemetry.stage(stage):
+            return call_with_backoff(func, item, limiter, tokens, max_retries)
+
+    attempt = 0
+    while True:
+        if limiter:
+            start = time.monotonic()
+            limiter.acquire(tokens)
+            telemetry.record_wait(time.monotonic() - start)
+        used = telemetry.thread_tokens()
+        try:
+            result = func(item)
+        except Exception as e:
+            if limiter:
+                limiter.record_usage(tokens, telemetry.thread_tokens() - used)
+            if not is_retryable(e) or attempt >= max_retries:
+                telemetry.record_error()
+                raise
+            telemetry.record_retry()
+            delay = retry_after(e) or backoff_delay(attempt)
+            print(f" Retrying in {round(delay, 2)}s after error: {e}")
+            # A 429 means the shared budget is exhausted: pause every worker,
+            # not just this one.
+            if limiter and getattr(e, "status_code", None) == 429:
+                limiter.pause(delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+            continue
+        if limiter:
+            limiter.record_usage(tokens, telemetry.thread_tokens() - used)
+        return result
+
+
+def run_concurrently(func, items, max_workers=8, requests_per_minute=None, tokens_per_minute=None,
+                     tokens_for=None, max_retries=6, on_error=None, stage=None, limiter=None):
+    # Apply `func` to every item on a thread pool and return the results in
+    # input order. `tokens_for(item)` estimates the TPM cost of an item, which
+    # is corrected with the real usage once the call returns (see
+    # call_with_backoff). If `on_error(item, exc)` is given its return value
+    # replaces the result of a failed item; otherwise the first failure is
+    # raised. A `limiter` shared with other callers replaces the one built
+    # from requests_per_minute and tokens_per_minute, so their waits, token
+    # budget and 429 pauses are common.
+    items = list(items)
+    limiter = limiter or RateLimiter(requests_per_minute, tokens_per_minute)
+
+    def work(item):
+        tokens = tokens_for(item) if tokens_for else 0
+        try:
+            return call_with_backoff(func, item, limiter, tokens, max_retries, stage)
+        except Exception as e:
+            if on_error is None:
+                raise
+            return on_error(item, e)
+
+    if max_workers == 1:
+        # In the calling thread, so its telemetry (and token usage) stays with
+        # the caller's own call_with_backoff
+        return [work(item) for item in items]
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return list(pool.map(work, items))
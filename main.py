@@ -1,18 +1,36 @@
-import sys
+import json
+import argparse
+from engine import call_with_backoff
 from classifier import classify_provision, classify_provision_with_file_search
+from result_cache import cache, add_cache_arguments, configure_from_args
+from telemetry import add_telemetry_arguments, write_from_args
 
 matrix_path = "data/cso-matrix.txt"
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python main.py \"Your provision text here\"")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Classify a single provision with the CSO Matrix.")
+    parser.add_argument("provision_text")
+    parser.add_argument("--top-k", type=int,
+                        help="Classify with only the K closest matrix entries in the prompt instead of file search")
+    add_cache_arguments(parser)
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
 
-    provision_text = sys.argv[1]
+    provision_text = args.provision_text
     #Uncomment this line with # to use the original classifier, which uses the matrix directly
     #result = classify_provision(provision_text)
 
-    #This new function uses the file search tool to classify the provision
-    result = classify_provision_with_file_search(provision_text, matrix_path)
+    if args.top_k:
+        #Ranks the matrix locally and sends only the closest entries, no file search round-trip
+        classification = call_with_backoff(lambda text: classify_provision(text, top_k=args.top_k), provision_text,
+                                           stage="classify")
+    else:
+        #This new function uses the file search tool to classify the provision
+        classification = call_with_backoff(lambda text: classify_provision_with_file_search(text, matrix_path),
+                                           provision_text, stage="classify")
+    result = json.dumps(classification.to_dict(), indent=2, ensure_ascii=False)
 
-    print("Classification Result:\n", result)
\ No newline at end of file
+    print("Classification Result:\n", result)
+    cache.report()
+    write_from_args(args)
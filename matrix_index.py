@@ -0,0 +1,197 @@
+import re
+import sys
+import math
+import difflib
+import functools
+from collections import Counter
+from dataclasses import dataclass
+
+# Local index over data/cso-matrix.txt. The matrix only has ~60 entries, so
+# ranking them in-process with BM25 is instant and lets the prompt carry the few
+# closest entries instead of the whole typology or a remote file_search call.
+
+CATEGORY_PATTERN = re.compile(r"^###\s*CATEGORY:\s*(\w+)")
+ENTRY_PATTERN = re.compile(r"^(RESTRICTIVE|PERMISSIVE) PROVISION (\d+)\.\s*(.*)$")
+BRACKET_PATTERN = re.compile(r"\[([^\]]*)\]")
+CITATION_PATTERN = re.compile(r"\((\d+)\)\s*[;.]?\s*$")
+WORD_PATTERN = re.compile(r"[a-z]+")
+
+STOPWORDS = {
+    "a", "an", "and", "any", "are", "as", "at", "be", "by", "for", "from", "has", "have", "in",
+    "is", "it", "its", "of", "on", "or", "such", "that", "the", "their", "this", "to", "under",
+    "which", "with", "who", "shall", "section", "act", "law", "else",
+}
+
+@dataclass
+class MatrixEntry:
+    id: str              # e.g. "GOVERNANCE-R1"
+    category: str        # GOVERNANCE | FORMATION | OPERATIONS | RESOURCES
+    polarity: str        # RESTRICTIVE | PERMISSIVE
+    number: int
+    attributes: str
+    deontic: str
+    aim: str
+    conditions: str
+    or_else: str
+    citations: int
+    text: str            # the entry exactly as it appears in the matrix
+
+    @property
+    def subgroup(self):
+        return self.category.title()
+
+    @property
+    def type(self):
+        return self.polarity.title()
+
+def tokenize(text):
+    # Lowercase words without stopwords, with a light plural strip so that
+    # "organisations" matches "organisation"
+    tokens = []
+    for word in WORD_PATTERN.findall(text.lower()):
+        if word in STOPWORDS or len(word) < 3:
+            continue
+        if word.endswith("s") and not word.endswith("ss") and len(word) > 4:
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+def parse_entry(category, polarity, number, body):
+    components = BRACKET_PATTERN.findall(body)
+    citation = CITATION_PATTERN.search(body)
+    # [ATTRIBUTES] [DEONTIC] [AIM] [CONDITIONS] [OR ELSE]; the conditions
+    # bracket is missing from a few entries
+    attributes, deontic, aim = (components + ["", "", ""])[:3]
+    or_else = components[-1] if len(components) > 3 and components[-1].startswith("or else") else ""
+    conditions = " ".join(components[3:-1] if or_else else components[3:])
+    return MatrixEntry(
+        id=f"{category}-{polarity[0]}{number}",
+        category=category,
+        polarity=polarity,
+        number=int(number),
+        attributes=attributes,
+        deontic=deontic,
+        aim=aim,
+        conditions=conditions,
+        or_else=or_else,
+        citations=int(citation.group(1)) if citation else 0,
+        text=body.strip()
+    )
+
+def parse_matrix(text):
+    # Returns (preamble, entries); the preamble explains the ADICO syntax
+    preamble_lines = []
+    entries = []
+    category = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        heading = CATEGORY_PATTERN.match(stripped)
+        if heading:
+            category = heading.group(1).upper()
+            continue
+        entry = ENTRY_PATTERN.match(stripped)
+        if entry and category:
+            entries.append(parse_entry(category, *entry.groups()))
+        elif category is None:
+            preamble_lines.append(line)
+    return "\n".join(preamble_lines).strip(), entries
+
+class MatrixIndex:
+    def __init__(self, preamble, entries, k1=1.5, b=0.75):
+        self.preamble = preamble
+        self.entries = entries
+        self.by_id = {entry.id: entry for entry in entries}
+        self.positions = {entry.id: position for position, entry in enumerate(entries)}
+        self.k1 = k1
+        self.b = b
+
+        # The aim and conditions carry most of the meaning; the category name is
+        # added so that e.g. "funding" also pulls in RESOURCES entries
+        docs = [tokenize(f"{e.attributes} {e.aim} {e.conditions} {e.text} {e.category}") for e in entries]
+        self.doc_lengths = [len(doc) for doc in docs]
+        self.avg_length = sum(self.doc_lengths) / max(len(docs), 1)
+
+        # Inverted index: term -> [(entry position, term frequency)]
+        self.postings = {}
+        for position, doc in enumerate(docs):
+            for term, tf in Counter(doc).items():
+                self.postings.setdefault(term, []).append((position, tf))
+
+        n = len(docs)
+        self.idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def scores(self, text):
+        scores = [0.0] * len(self.entries)
+        for term, qtf in Counter(tokenize(text)).items():
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for position, tf in postings:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[position] / self.avg_length)
+                scores[position] += qtf * idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, text, k=5):
+        # Top-k (entry, score) pairs. Ties fall back to the more cited entry.
+        scores = self.scores(text)
+        ranked = sorted(range(len(self.entries)),
+                        key=lambda i: (-scores[i], -self.entries[i].citations, i))
+        return [(self.entries[i], round(scores[i], 3)) for i in ranked[:k]]
+
+    def render(self, entries, include_preamble=True, ids=False):
+        # Matrix excerpt in the original file layout, grouped by category.
+        # With ids, each entry starts with its ID so the model can name it.
+        parts = [self.preamble] if include_preamble else []
+        category = None
+        for entry in sorted(entries, key=lambda e: self.positions[e.id]):
+            if entry.category != category:
+                category = entry.category
+                parts.append(f"### CATEGORY: {category}")
+            prefix = f"{entry.id}: " if ids else ""
+            parts.append(f"{prefix}{entry.polarity} PROVISION {entry.number}. {entry.text}")
+        return "\n\n".join(parts)
+
+    def excerpt(self, text, k=5, ids=False):
+        return self.render([entry for entry, _ in self.search(text, k)], ids=ids)
+
+    def find_by_text(self, text, min_ratio=0.9):
+        # The entry whose text a model copied out, for outputs from before
+        # entries were named by ID. Copies drop the citation count and fix or
+        # add typos, so the closest entry above min_ratio wins.
+        matcher = difflib.SequenceMatcher(None, b=normalize_entry_text(text), autojunk=False)
+        best, best_ratio = None, min_ratio
+        for entry in self.entries:
+            matcher.set_seq1(normalize_entry_text(entry.text))
+            # quick_ratio() is an upper bound of ratio() and much cheaper
+            if matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = entry, ratio
+        return best
+
+def normalize_entry_text(text):
+    text = CITATION_PATTERN.sub("", text).replace("’", "'")
+    return " ".join(text.split()).lower()
+
+@functools.lru_cache(maxsize=None)
+def load_matrix_text(path="data/cso-matrix.txt"):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+@functools.lru_cache(maxsize=None)
+def load_matrix_index(path="data/cso-matrix.txt"):
+    return MatrixIndex(*parse_matrix(load_matrix_text(path)))
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python matrix_index.py \"provision text\" [k]")
+        sys.exit(1)
+
+    k = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    for entry, score in load_matrix_index().search(sys.argv[1], k):
+        print(f"{score:7.3f}  {entry.id:15} {entry.aim}")
@@ -0,0 +1,223 @@
+import os
+import re
+import sys
+import json
+import zlib
+import sqlite3
+import hashlib
+import argparse
+import threading
+import unicodedata
+
+import numpy as np
+
+# Persistent MinHash/LSH index of provision texts. Acts repeat a lot of text
+# almost word for word (interpretation clauses, offence and penalty
+# boilerplate, amended versions of the same section), so provisions are
+# clustered before classification: only one representative per cluster goes
+# to the model and its result is reused for the others, with their estimated
+# similarity to it. The index lives in SQLite, so an act classified later is
+# matched against the representatives of every earlier run, and the result
+# cache then answers for them without another API call.
+#
+# Each provision is normalised (case, accents, numbering, digits), cut into
+# word shingles and summarised by NUM_PERM min-hashes. The signature is split
+# into BANDS bands; provisions sharing any band are candidates, and a
+# candidate is a near-duplicate if the share of equal min-hashes (an estimate
+# of the Jaccard similarity of their shingles) reaches the threshold. Only
+# representatives are indexed, so a cluster never drifts away from the text
+# it was classified with.
+
+DEFAULT_PATH = ".cache/near_duplicates.sqlite"
+DEFAULT_THRESHOLD = 0.8
+NUM_PERM = 128
+BANDS = 16                   # 16 bands of 8 rows: pairs above ~0.7 similarity almost always share a band
+SHINGLE_WORDS = 3
+SEED = 1
+
+PRIME = (1 << 31) - 1
+NUMBERING = re.compile(r"^\s*(?:\d+[A-Z]?\.?\s*)?(?:\(\w{1,4}\)\s*)*")
+NON_WORD = re.compile(r"[^\w]+")
+DIGITS = re.compile(r"\d+")
+
+_random = np.random.RandomState(SEED)
+PERM_A = _random.randint(1, PRIME, size=NUM_PERM, dtype=np.uint64)
+PERM_B = _random.randint(0, PRIME, size=NUM_PERM, dtype=np.uint64)
+
+def normalize(text):
+    # Lowercase words without accents, leading section numbering or
+    # punctuation; numbers become "0" so that amounts and cross-references
+    # don't split otherwise identical clauses
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = NUMBERING.sub("", text).lower()
+    text = DIGITS.sub("0", text)
+    return " ".join(NON_WORD.sub(" ", text).split())
+
+def shingles(normalized):
+    words = normalized.split()
+    if len(words) <= SHINGLE_WORDS:
+        return {normalized}
+    return {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def signature(normalized):
+    # crc32 rather than hash(), which changes from one Python process to the next
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles(normalized)), dtype=np.uint64)
+    hashes %= PRIME
+    return ((PERM_A[:, None] * hashes[None, :] + PERM_B[:, None]) % PRIME).min(axis=1).astype(np.uint32)
+
+def similarity(a, b):
+    return float(np.mean(a == b))
+
+def band_keys(sig):
+    rows = NUM_PERM // BANDS
+    return [(band, sig[band * rows:(band + 1) * rows].tobytes()) for band in range(BANDS)]
+
+class NearDuplicateIndex:
+    def __init__(self, path=DEFAULT_PATH, threshold=DEFAULT_THRESHOLD):
+        self.path = path
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS provisions ("
+                " id INTEGER PRIMARY KEY,"
+                " digest TEXT UNIQUE NOT NULL,"    # hash of the normalised text
+                " text TEXT NOT NULL,"
+                " source TEXT,"
+                " signature BLOB NOT NULL,"
+                " representative INTEGER NOT NULL,"
+                " similarity REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE TABLE IF NOT EXISTS bands (band INTEGER, bucket BLOB, provision INTEGER)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS bands_bucket ON bands (band, bucket)")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)")
+            settings = json.dumps({"num_perm": NUM_PERM, "bands": BANDS, "shingle_words": SHINGLE_WORDS,
+                                   "seed": SEED})
+            stored = self.conn.execute("SELECT value FROM settings WHERE name = 'minhash'").fetchone()
+            if stored is None:
+                self.conn.execute("INSERT INTO settings VALUES ('minhash', ?)", (settings,))
+                self.conn.commit()
+            elif stored[0] != settings:
+                raise ValueError(f"{self.path} was built with other MinHash settings ({stored[0]}); "
+                                 f"delete it to rebuild")
+        return self.conn
+
+    def _representative(self, conn, rep_id):
+        text, sig = conn.execute("SELECT text, signature FROM provisions WHERE id = ?", (rep_id,)).fetchone()
+        return text, np.frombuffer(sig, dtype=np.uint32)
+
+    def assign(self, text, source=None):
+        # Returns (representative text, similarity) for a provision, adding it
+        # to the index: to the cluster of the most similar representative
+        # above the threshold, or as the representative of a new cluster
+        normalized = normalize(text)
+        digest = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute("SELECT representative, similarity FROM provisions WHERE digest = ?",
+                               (digest,)).fetchone()
+            if row:
+                return self._representative(conn, row[0])[0], row[1]
+
+            sig = signature(normalized)
+            keys = band_keys(sig)
+            candidates = set()
+            for band, bucket in keys:
+                candidates.update(rep for (rep,) in conn.execute(
+                    "SELECT provision FROM bands WHERE band = ? AND bucket = ?", (band, bucket)))
+            best, best_text, best_score = None, None, 0.0
+            for rep_id in sorted(candidates):
+                rep_text, rep_sig = self._representative(conn, rep_id)
+                score = similarity(sig, rep_sig)
+                if score > best_score:
+                    best, best_text, best_score = rep_id, rep_text, score
+
+            cursor = conn.execute(
+                "INSERT INTO provisions (digest, text, source, signature, representative, similarity)"
+                " VALUES (?, ?, ?, ?, 0, 1.0)", (digest, text, source, sig.tobytes()))
+            provision_id = cursor.lastrowid
+            if best is not None and best_score >= self.threshold:
+                conn.execute("UPDATE provisions SET representative = ?, similarity = ? WHERE id = ?",
+                             (best, best_score, provision_id))
+                conn.commit()
+                return best_text, round(best_score, 3)
+            conn.execute("UPDATE provisions SET representative = id WHERE id = ?", (provision_id,))
+            conn.executemany("INSERT INTO bands VALUES (?, ?, ?)",
+                             [(band, bucket, provision_id) for band, bucket in keys])
+            conn.commit()
+            return text, 1.0
+
+    def group(self, texts, source=None):
+        # Clusters a list of provisions. Returns (representatives, assignments):
+        # the distinct representative texts in order of first use, and for each
+        # input text (index into representatives, similarity)
+        representatives = []
+        positions = {}
+        assignments = []
+        for text in texts:
+            rep_text, score = self.assign(text, source)
+            if rep_text not in positions:
+                positions[rep_text] = len(representatives)
+                representatives.append(rep_text)
+            assignments.append((positions[rep_text], score))
+        return representatives, assignments
+
+    def stats(self):
+        with self.lock:
+            conn = self._connect()
+            provisions, clusters = conn.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT representative) FROM provisions").fetchone()
+            sources = conn.execute("SELECT COUNT(DISTINCT source) FROM provisions").fetchone()[0]
+        return {"provisions": provisions, "clusters": clusters, "sources": sources}
+
+    def clusters(self, min_size=2):
+        # (representative text, [(member text, source, similarity)]) for clusters of min_size or more
+        with self.lock:
+            conn = self._connect()
+            rows = conn.execute(
+                "SELECT representative, text, source, similarity FROM provisions WHERE representative IN ("
+                " SELECT representative FROM provisions GROUP BY representative HAVING COUNT(*) >= ?)"
+                " ORDER BY representative, id", (min_size,)).fetchall()
+            result = {}
+            for rep_id, text, source, score in rows:
+                if rep_id not in result:
+                    result[rep_id] = (self._representative(conn, rep_id)[0], [])
+                result[rep_id][1].append((text, source, score))
+        return list(result.values())
+
+def add_near_duplicate_arguments(parser):
+    parser.add_argument("--dedup", action="store_true",
+                        help="Classify one provision per cluster of near-duplicates and reuse its result")
+    parser.add_argument("--dedup-index", default=DEFAULT_PATH, help="Near-duplicate index shared across runs")
+    parser.add_argument("--dedup-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Minimum estimated similarity (0-1) to count as a near-duplicate")
+
+def index_from_args(args):
+    return NearDuplicateIndex(args.dedup_index, args.dedup_threshold) if args.dedup else None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the near-duplicate provision index.")
+    parser.add_argument("command", choices=["stats", "clusters"])
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--min-size", type=int, default=2, help="Smallest cluster to list")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"No index found at {args.path}")
+        sys.exit(0)
+
+    index = NearDuplicateIndex(args.path)
+    if args.command == "stats":
+        print(json.dumps(index.stats(), indent=2))
+    else:
+        for rep_text, members in index.clusters(args.min_size):
+            print(f"\n{len(members)} x {rep_text[:100]}")
+            for text, source, score in members:
+                print(f"   {score:.2f} [{source}] {text[:90]}")
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+
+from telemetry import telemetry
+from engine import call_with_backoff
+
+# Offline submission through the OpenAI Batch API: half the price of interactive
+# calls and no rate-limit juggling, at the cost of results arriving within
+# hours instead of seconds. Used by the --batch-api mode of batch_classifier.py
+# and provision_filter_llm.py for large acts.
+
+ENDPOINT = "/v1/responses"
+FINAL_STATUSES = {"completed", "failed", "expired", "cancelled"}
+
+def build_batch_file(requests, path):
+    # requests: {custom_id: body}, where body is what responses.create() takes
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for custom_id, body in requests.items():
+            line = {"custom_id": str(custom_id), "method": "POST", "url": ENDPOINT, "body": body}
+            f.write(json.dumps(line, ensure_ascii=False) + "\n")
+    return path
+
+def upload_batch_file(client, path):
+    with open(path, "rb") as f:
+        return client.files.create(file=f, purpose="batch")
+
+def submit_batch(client, path, description=None):
+    # The calls here are few and not rate-limited, but a dropped connection
+    # or a 5xx is still retried (the shared client doesn't retry by itself)
+    batch_file = call_with_backoff(lambda path: upload_batch_file(client, path), path)
+    options = {"metadata": {"description": description}} if description else {}
+    batch = call_with_backoff(lambda file_id: client.batches.create(
+        input_file_id=file_id,
+        endpoint=ENDPOINT,
+        completion_window="24h",
+        **options
+    ), batch_file.id)
+    print(f" Submitted batch {batch.id} ({path})")
+    return batch
+
+def wait_for_batch(client, batch_id, poll_interval=30):
+    while True:
+        batch = call_with_backoff(client.batches.retrieve, batch_id)
+        counts = batch.request_counts
+        if counts:
+            print(f" Batch {batch_id}: {batch.status}, {counts.completed}/{counts.total} done, {counts.failed} failed")
+        else:
+            print(f" Batch {batch_id}: {batch.status}")
+        if batch.status in FINAL_STATUSES:
+            return batch
+        time.sleep(poll_interval)
+
+def read_jsonl(client, file_id):
+    if not file_id:
+        return []
+    text = call_with_backoff(client.files.content, file_id).text
+    return [json.loads(line) for line in text.splitlines() if line.strip()]
+
+def read_batch_results(client, batch):
+    # Returns ({custom_id: response body}, {custom_id: error message})
+    results = {}
+    errors = {}
+    for line in read_jsonl(client, batch.output_file_id) + read_jsonl(client, batch.error_file_id):
+        custom_id = line["custom_id"]
+        response = line.get("response") or {}
+        if response.get("status_code") == 200 and not line.get("error"):
+            results[custom_id] = response["body"]
+        else:
+            error = line.get("error") or response.get("body", {}).get("error") or response
+            errors[custom_id] = json.dumps(error) if not isinstance(error, str) else error
+    return results, errors
+
+def output_text(body):
+    # Same as Response.output_text, for a response body read from a batch file
+    texts = []
+    for item in body.get("output", []):
+        if item.get("type") != "message":
+            continue
+        for content in item.get("content", []):
+            if content.get("type") == "output_text":
+                texts.append(content["text"])
+    return "".join(texts)
+
+def run_batch(client, requests, work_dir, name, max_attempts=3, poll_interval=30, stage=None, parse=None):
+    # Submit every request, wait for the batch, and re-queue the ones that
+    # failed (or never came back) in a new batch, up to max_attempts.
+    # Returns ({custom_id: output text}, {custom_id: last error}).
+    # With parse, outputs are parse(output text) instead, and a reply that
+    # parse() rejects with a ValueError is re-queued like a failed request.
+    # Time and token usage are recorded in the run telemetry under `stage`.
+    with telemetry.stage(stage or telemetry.current_stage()):
+        return _run_batch(client, requests, work_dir, name, max_attempts, poll_interval, stage, parse)
+
+def _run_batch(client, requests, work_dir, name, max_attempts, poll_interval, stage, parse):
+    pending = {str(custom_id): body for custom_id, body in requests.items()}
+    outputs = {}
+    errors = {}
+
+    for attempt in range(1, max_attempts + 1):
+        if not pending:
+            break
+        print(f"\n Batch attempt {attempt}: {len(pending)} requests")
+        path = build_batch_file(pending, os.path.join(work_dir, f"{name}_attempt{attempt}.jsonl"))
+        batch = submit_batch(client, path, description=name)
+        batch = wait_for_batch(client, batch.id, poll_interval)
+
+        results, failed = read_batch_results(client, batch)
+        for custom_id, body in results.items():
+            if custom_id in pending:
+                telemetry.record_response(body, stage=stage, batch=True)
+                output = output_text(body)
+                if parse:
+                    try:
+                        output = parse(output)
+                    except ValueError as e:
+                        failed[custom_id] = f"invalid output: {e}"
+                        continue
+                outputs[custom_id] = output
+                errors.pop(custom_id, None)
+                del pending[custom_id]
+        for custom_id in pending:
+            errors[custom_id] = failed.get(custom_id, f"no result (batch {batch.status})")
+
+    return outputs, errors
+
+def add_batch_arguments(parser):
+    parser.add_argument("--batch-api", action="store_true",
+                        help="Submit all requests through the Batch API (cheaper, results within 24h)")
+    parser.add_argument("--poll-interval", type=int, default=30, help="Seconds between batch status checks")
@@ -0,0 +1,30 @@
+import os
+import threading
+
+# One OpenAI client per process, created on first use. Importing a module that
+# calls the API therefore costs nothing and needs no credentials until a
+# request is actually made, and every script running in the process shares
+# the client's HTTP connection pool instead of opening its own.
+#
+# The SDK's own retries are off (max_retries=0): engine.call_with_backoff is
+# the only retry layer, so a 429 reaches the shared limiter's pause at once
+# instead of after the SDK's hidden attempts. Calls made outside
+# run_concurrently go through call_with_backoff themselves.
+
+_client = None
+_lock = threading.Lock()
+
+def get_client():
+    global _client
+    if _client is None:
+        with _lock:
+            if _client is None:
+                # Imported here: the openai package alone takes most of a
+                # second to import
+                from dotenv import load_dotenv
+                from openai import OpenAI
+
+                # Load .env variables (to keep the API key secure)
+                load_dotenv()
+                _client = OpenAI(api_key=os.getenv("api_key"), max_retries=0)
+    return _client
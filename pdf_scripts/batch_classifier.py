@@ -1,96 +1,302 @@
 import os
 import json
-import time
 import datetime
+import argparse
 import pandas as pd
-from dotenv import load_dotenv
-from openai import OpenAI
 
-# API key
-load_dotenv()
-client = OpenAI(api_key=os.getenv("api_key"))
+from engine import run_concurrently, estimate_tokens
+from result_cache import cache, make_key, add_cache_arguments, configure_from_args
+from vector_store_registry import get_vector_store
+from classifier import classify_provision as classify_with_matrix_excerpt, build_classify_request
+from classifier import classify_provisions_packed, classify_provision_cascade
+from classifier import classify_provision_with_file_search, build_file_search_request, file_search_cache_parts
+from cascade import Cascade, add_cascade_arguments
+from classifier import matrix_version as classifier_matrix_version
+from classification import parse_classification, dumps
+from openai_client import get_client
+from openai_batch import run_batch, add_batch_arguments
+from run_journal import RunJournal, DONE, FAILED, add_resume_arguments
+from near_duplicates import add_near_duplicate_arguments, index_from_args
+from telemetry import telemetry, add_telemetry_arguments, write_from_args, metrics_path_for
+from result_store import act_name, add_store_arguments, store_from_args
 
 filtered_csv_path = "outputs/filtered_provisions_KenyaPublicOrder.csv"
 matrix_path = "data/cso-matrix.txt"
 
-# Filtered provisions from provision_filter_llm.py
-df = pd.read_csv(filtered_csv_path)
-df = df[df["label"] == "provision"]
+# Instructions plus the file_search results add roughly this many input tokens
+# to every call on top of the provision itself.
+PROMPT_OVERHEAD_TOKENS = 4000
+# Same for the local matrix excerpt, per matrix entry included (see --top-k)
+EXCERPT_TOKENS_PER_ENTRY = 120
 
-# Upload CSO Matrix to vector store
-print(" Creating vector store...")
-vector_store = client.vector_stores.create(name="CSO_Matrix_Store")
-vector_store_id = vector_store.id
+# The cached classification (as a dict) of a provision, as classify_provision
+# or, with top_k, classifier.classify_provision stored it; None if not cached
+def cached_output(provision_text, top_k=None):
+    if top_k:
+        parts = dict(matrix_version=classifier_matrix_version(), **build_classify_request(provision_text, top_k))
+    else:
+        parts = file_search_cache_parts(provision_text, matrix_path)
+    output = cache.get(make_key(**parts), count_miss=False)
+    return parse_classification(output, matrix_path).to_dict() if output is not None else None
 
-print(" Uploading matrix...")
-with open(matrix_path, "rb") as f:
-    client.vector_stores.file_batches.upload_and_poll(
-        vector_store_id=vector_store_id,
-        files=[f]
-    )
-
-# Provision classifier (using file search only)
+# Provision classifier (using file search only), returns a Classification
 def classify_provision(provision_text, vector_store_id):
-    instructions = (
-        "You are a legal classification assistant trained in civil society organizations (CSO) regulation.\n"
-        "Use the File Search tool to read the uploaded CSO Matrix.\n"
-        "Find the closest matching matrix concept for the following provision.\n\n"
-
-        "Classify the provision as either:\n"
-        "- Restrictive: if it imposes barriers or burdens on CSO activity.\n"
-        "- Permissive: if it enables, supports, or simplifies CSO activity.\n\n"
-
-        "Assign the provision to one of the four CSO Matrix subgroups: Formation, Governance, Operations, Resources.\n"
-        "Once assigned, do not change the category.\n\n"
-
-        "Always return only a structured JSON with these fields:\n"
-        "- provision  (exact provision text) \n"
-        "- matched_matrix_provision (Closest concept from matrix, as it appears in the matrix.)\n"
-        "- subgroup (Formation | Governance | Operations | Resources)\n"
-        "- type (Restrictive | Permissive)\n"
-        "- explanation (Brief legal reasoning and justification based on the matrix)"
-    )
+    return classify_provision_with_file_search(provision_text, matrix_path, vector_store_id)
 
-    start_time = time.time()
-
-    response = client.responses.create(
-        model="gpt-4o",
-        instructions=instructions,
-        input=provision_text,
-        tools=[{
-            "type": "file_search",
-            "vector_store_ids": [vector_store_id]
-        }],
-        temperature=0.2
-    )
+# Classify all provisions concurrently, keeping input order.
+# The limiter replaces the old fixed sleep between calls: requests are spread
+# over the RPM/TPM budgets and 429/5xx errors back off adaptively.
+# With top_k, the matrix is ranked locally and only the top_k closest entries are
+# sent in the prompt, skipping the vector store altogether.
+# With a journal, each result is recorded as soon as it completes and
+# provisions the journal already has as done are not classified again.
+# With pack, provisions are sent `pack` at a time with the full matrix in one
+# request (see classifier.classify_provisions_packed).
+# With a cascade, the matrix goes in the prompt (all of it, or top_k entries)
+# and cheaper models answer first (see classifier.classify_provision_cascade).
+def classify_provisions(provisions, vector_store_id=None, max_workers=8, requests_per_minute=500,
+                        tokens_per_minute=30000, top_k=None, ids=None, journal=None, pack=None, cascade=None):
+    total = len(provisions)
+    overhead = 600 + top_k * EXCERPT_TOKENS_PER_ENTRY if top_k else PROMPT_OVERHEAD_TOKENS
+    ids = list(ids) if ids is not None else list(range(total))
 
-    end_time = time.time()
-    print(f" Classified in {round(end_time - start_time, 2)}s")
-    return response.output_text
-
-# Classify all provisions
-results = []
-for i, row in df.iterrows():
-    provision = row["text"]
-    print(f"\n Classifying provision {i} of {len(df)}")
-    try:
-        output = classify_provision(provision, vector_store_id)
-        results.append({
+    def classify(indexed):
+        i, provision = indexed
+        print(f"\n Classifying provision {i} of {total}")
+        if cascade:
+            output = classify_provision_cascade(provision, cascade, top_k).to_dict()
+        elif top_k:
+            output = classify_with_matrix_excerpt(provision, top_k=top_k).to_dict()
+        else:
+            output = classify_provision(provision, vector_store_id).to_dict()
+        if journal:
+            journal.record(ids[i], DONE, provision=provision, output=output)
+        return {
             "provision": provision,
             "output": output
-        })
-    except Exception as e:
+        }
+
+    def failed(indexed, e):
         print(f" Error: {e}")
-        results.append({
-            "provision": provision,
+        if journal:
+            journal.record(ids[indexed[0]], FAILED, provision=indexed[1], error=str(e))
+        return {
+            "provision": indexed[1],
             "output": f"ERROR: {e}"
-        })
-    time.sleep(1.2)  # safe buffer
+        }
+
+    # Provisions the journal or the result cache already has are filled in
+    # here, so only the ones that need an API call take a share of the RPM/TPM
+    # budget. Packed and cascade results are cached under their own keys and
+    # looked up by classify_provisions_packed and the cascade.
+    results = [None] * total
+    pending = []
+    cached = 0
+    for i, provision in enumerate(provisions):
+        if journal and journal.is_done(ids[i]):
+            results[i] = {"provision": provision, "output": journal.records[ids[i]]["output"]}
+            continue
+        output = cached_output(provision, top_k) if not (pack or cascade) else None
+        if output is None:
+            pending.append((i, provision))
+            continue
+        cached += 1
+        results[i] = {"provision": provision, "output": output}
+        if journal:
+            journal.record(ids[i], DONE, provision=provision, output=output)
+    if journal or cached:
+        print(f" {total - len(pending)} provisions already done ({cached} from the cache), "
+              f"{len(pending)} to classify")
+
+    if pack:
+        def packed_result(n, classification):
+            i, provision = pending[n]
+            output = classification.to_dict()
+            results[i] = {"provision": provision, "output": output}
+            if journal:
+                journal.record(ids[i], DONE, provision=provision, output=output)
+
+        def packed_failed(n, e):
+            # The rest of the run goes on; this pack's provisions are FAILED
+            results[pending[n][0]] = failed(pending[n], e)
+
+        classify_provisions_packed([provision for _, provision in pending], batch_size=pack,
+                                   max_workers=max_workers, on_result=packed_result, on_error=packed_failed,
+                                   requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+        return results
+
+    classified = run_concurrently(
+        classify,
+        pending,
+        max_workers=max_workers,
+        requests_per_minute=requests_per_minute,
+        tokens_per_minute=tokens_per_minute,
+        tokens_for=lambda indexed: estimate_tokens(indexed[1], overhead),
+        on_error=failed,
+        stage="classify"
+    )
+    for (i, _), result in zip(pending, classified):
+        results[i] = result
+    return results
+
+# Same results as classify_provisions, but sent as one Batch API job.
+# Provisions already in the journal or the cache are not submitted.
+def classify_provisions_batch(provisions, vector_store_id=None, top_k=None, ids=None, journal=None,
+                              poll_interval=30):
+    ids = list(ids) if ids is not None else list(range(len(provisions)))
+    results = [None] * len(provisions)
+    requests = {}
+    keys = {}
+
+    for i, provision in enumerate(provisions):
+        if top_k:
+            request = build_classify_request(provision, top_k)
+            parts = dict(matrix_version=classifier_matrix_version(), **request)
+        else:
+            request = build_file_search_request(provision, vector_store_id, matrix_path)
+            parts = file_search_cache_parts(provision, matrix_path)
+
+        if journal and journal.is_done(ids[i]):
+            output = journal.records[ids[i]]["output"]
+        else:
+            output = cache.get(make_key(**parts))
+            output = parse_classification(output).to_dict() if output is not None else None
+        if output is not None:
+            results[i] = {"provision": provision, "output": output}
+        else:
+            requests[str(ids[i])] = request
+            keys[str(ids[i])] = make_key(**parts)
+    print(f" {len(provisions) - len(requests)} provisions already done, {len(requests)} to submit")
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    # Replies that don't parse go back into the next batch attempt
+    outputs, errors = run_batch(get_client(), requests, "outputs/batches", f"classify_{timestamp}",
+                                poll_interval=poll_interval, stage="classify", parse=parse_classification)
+
+    for i, provision in enumerate(provisions):
+        custom_id = str(ids[i])
+        if custom_id in outputs:
+            cache.put(keys[custom_id], dumps(outputs[custom_id]))
+            output = outputs[custom_id].to_dict()
+            if journal:
+                journal.record(ids[i], DONE, provision=provision, output=output)
+            results[i] = {"provision": provision, "output": output}
+        elif custom_id in errors:
+            print(f" Error on provision {ids[i]}: {errors[custom_id]}")
+            if journal:
+                journal.record(ids[i], FAILED, provision=provision, error=errors[custom_id])
+            results[i] = {"provision": provision, "output": f"ERROR: {errors[custom_id]}"}
+    return results
+
+# Classify one provision per cluster of near-duplicates (see near_duplicates.py)
+# with classify(texts, ids) and give every other member the result of its
+# cluster's representative, with their similarity. A representative is
+# classified under the ID of its first member; it can be a provision from an
+# earlier run, in which case the result cache usually has its answer already.
+def classify_clustered(classify, provisions, ids, index, source=None):
+    representatives, assignments = index.group(provisions, source)
+    print(f" {len(provisions)} provisions in {len(representatives)} clusters of near-duplicates")
+    first = {}
+    for position, (rep, _) in enumerate(assignments):
+        first.setdefault(rep, position)
+    classified = classify(representatives, [ids[first[rep]] for rep in range(len(representatives))])
+
+    results = []
+    for provision, (rep, score) in zip(provisions, assignments):
+        result = {"provision": provision, "output": classified[rep]["output"]}
+        if representatives[rep] != provision:
+            result.update(representative=representatives[rep], similarity=score)
+        results.append(result)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify filtered provisions with the CSO Matrix.")
+    parser.add_argument("input_csv", nargs="?", default=filtered_csv_path,
+                        help="CSV produced by provision_filter_llm.py")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum requests in flight")
+    parser.add_argument("--rpm", type=int, default=500, help="Requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=30000, help="Tokens-per-minute budget")
+    parser.add_argument("--top-k", type=int,
+                        help="Send only the K closest matrix entries in the prompt instead of using file search")
+    parser.add_argument("--pack", type=int, metavar="N",
+                        help="Classify N provisions per request, sending the matrix once for all of them")
+    add_cache_arguments(parser)
+    add_resume_arguments(parser)
+    add_batch_arguments(parser)
+    add_near_duplicate_arguments(parser)
+    add_cascade_arguments(parser)
+    add_store_arguments(parser)
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    if args.cascade and (args.batch_api or args.pack):
+        parser.error("--cascade can't be combined with --batch-api or --pack")
+    cascade = Cascade(args.cascade, "Classification cascade") if args.cascade else None
+
+    # Filtered provisions from provision_filter_llm.py
+    df = pd.read_csv(args.input_csv)
+    df = df[df["label"] == "provision"]
+
+    # CSO Matrix vector store, reused across runs while the matrix is unchanged
+    vector_store_id = None
+    if not args.top_k and not args.pack and not cascade:
+        with telemetry.stage("retrieval"):
+            vector_store_id = get_vector_store(get_client(), [matrix_path], "CSO_Matrix_Store")
+
+    # Results go to a journal as they complete; the final JSON is written next to it
+    if args.resume:
+        journal_path = args.resume
+    else:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        journal_path = f"outputs/classified_provisions_{timestamp}.jsonl"
+
+    ids = df["id"].tolist() if "id" in df.columns else df.index.tolist()
+    with RunJournal(journal_path) as journal:
+        if args.batch_api:
+            def classify(texts, ids):
+                return classify_provisions_batch(
+                    texts,
+                    vector_store_id,
+                    top_k=args.top_k,
+                    ids=ids,
+                    journal=journal,
+                    poll_interval=args.poll_interval
+                )
+        else:
+            def classify(texts, ids):
+                return classify_provisions(
+                    texts,
+                    vector_store_id,
+                    max_workers=args.concurrency,
+                    requests_per_minute=args.rpm,
+                    tokens_per_minute=args.tpm,
+                    top_k=args.top_k,
+                    ids=ids,
+                    journal=journal,
+                    pack=args.pack,
+                    cascade=cascade
+                )
+
+        near_duplicates = index_from_args(args)
+        if near_duplicates:
+            results = classify_clustered(classify, df["text"].tolist(), ids, near_duplicates,
+                                         source=os.path.basename(args.input_csv))
+        else:
+            results = classify(df["text"].tolist(), ids)
+
+    # Save results
+    output_path = os.path.splitext(journal_path)[0] + ".json"
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2, ensure_ascii=False)
 
-# Save results
-timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M")
-output_path = f"outputs/classified_provisions_{timestamp}.json"
-with open(output_path, "w", encoding="utf-8") as f:
-    json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"\n Classification complete. Saved to {output_path}")
+    print(f" Journal: {journal.summary()}")
+    # The act is named after the input CSV (filtered_provisions_<act>.csv)
+    store_from_args(args, output_path, act_name(args.input_csv), args.cascade or "gpt-4o")
+    if cascade:
+        cascade.report()
+    cache.report()
+    write_from_args(args, metrics_path_for(journal_path))
 
-print(f"\n Classification complete. Saved to {output_path}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
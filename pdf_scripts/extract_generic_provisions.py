@@ -1,47 +1,79 @@
 import pdfplumber
 import csv
 import os
-from typing import List
+import argparse
+import functools
+from typing import Iterator, List
 
-def extract_provisions_by_spacing(pdf_path: str, output_csv: str, y_threshold: float = 15.0, min_words: int = 5):
+from pdf_scripts.page_pool import iter_pages
+
+# Paragraphs of one page, split where the vertical gap between lines is larger
+# than y_threshold
+def page_paragraphs(page, y_threshold: float = 15.0, min_words: int = 5) -> List[str]:
+    lines = page.extract_words(use_text_flow=True, keep_blank_chars=True)
+    page.flush_cache()
+    if not lines:
+        return []
+
+    # Sort by y position
+    lines = sorted(lines, key=lambda l: l['top'])
+    paragraphs = []
+    paragraph = ""
+    last_y = None
+
+    for line in lines:
+        y = line['top']
+        text = line['text'].strip()
+        if not text:
+            continue
+
+        if last_y is not None and abs(y - last_y) > y_threshold:
+            # Commit current paragraph if valid
+            if len(paragraph.split()) >= min_words:
+                paragraphs.append(paragraph.strip())
+            paragraph = text
+        else:
+            paragraph += " " + text
+
+        last_y = y
+
+    # Final paragraph on page
+    if len(paragraph.split()) >= min_words:
+        paragraphs.append(paragraph.strip())
+
+    return paragraphs
+
+# Worker for page_pool: the paragraphs of pages [start, stop), one list per page
+def paragraphs_in_range(pdf_path: str, start: int, stop: int, y_threshold: float = 15.0,
+                        min_words: int = 5) -> List[List[str]]:
+    with pdfplumber.open(pdf_path, pages=list(range(start + 1, stop + 1))) as pdf:
+        return [page_paragraphs(page, y_threshold, min_words) for page in pdf.pages]
+
+# Yields paragraphs page by page as they are found, skipping exact duplicates,
+# so callers can start working before the whole PDF has been read. With
+# workers > 1 the pages are parsed on a process pool; the order and the output
+# are the same as with one worker.
+def iter_provisions_by_spacing(pdf_path: str, y_threshold: float = 15.0, min_words: int = 5,
+                               workers: int = 1, pages_per_task: int = 8) -> Iterator[str]:
     if not os.path.exists(pdf_path):
         raise FileNotFoundError(f"File not found: {pdf_path}")
 
-    provisions = []
-
     with pdfplumber.open(pdf_path) as pdf:
-        for page_num, page in enumerate(pdf.pages):
-            lines = page.extract_words(use_text_flow=True, keep_blank_chars=True)
-            if not lines:
-                continue
-
-            # Sort by y position
-            lines = sorted(lines, key=lambda l: l['top'])
-            paragraph = ""
-            last_y = None
-
-            for line in lines:
-                y = line['top']
-                text = line['text'].strip()
-                if not text:
-                    continue
-
-                if last_y is not None and abs(y - last_y) > y_threshold:
-                    # Commit current paragraph if valid
-                    if len(paragraph.split()) >= min_words:
-                        provisions.append(paragraph.strip())
-                    paragraph = text
-                else:
-                    paragraph += " " + text
-
-                last_y = y
-
-            # Final paragraph on page
-            if len(paragraph.split()) >= min_words:
-                provisions.append(paragraph.strip())
+        page_count = len(pdf.pages)
+
+    # Paragraphs never span pages here, so merging the shards is just
+    # de-duplicating in page order
+    seen = set()
+    work = functools.partial(paragraphs_in_range, y_threshold=y_threshold, min_words=min_words)
+    for paragraphs in iter_pages(pdf_path, page_count, work, workers, pages_per_task):
+        for paragraph in paragraphs:
+            if paragraph not in seen:
+                seen.add(paragraph)
+                yield paragraph
 
-    # Remove duplicates
-    provisions = list(dict.fromkeys(provisions))
+def extract_provisions_by_spacing(pdf_path: str, output_csv: str, y_threshold: float = 15.0, min_words: int = 5,
+                                  workers: int = 1):
+    provisions = list(iter_provisions_by_spacing(pdf_path, y_threshold, min_words, workers))
 
     # Write to CSV for labeling
     with open(output_csv, "w", encoding="utf-8", newline="") as f:
@@ -54,5 +86,10 @@ def extract_provisions_by_spacing(pdf_path: str, output_csv: str, y_threshold: f
 
 # Example usage
 if __name__ == "__main__":
-    extract_provisions_by_spacing("inputs/KenyaPublicBenefitsOrganisationsAct.pdf", "outputs/provisions_from_spacing_3.csv")
+    parser = argparse.ArgumentParser(description="Split a PDF into paragraphs by vertical spacing.")
+    parser.add_argument("pdf_path", nargs="?", default="inputs/KenyaPublicBenefitsOrganisationsAct.pdf")
+    parser.add_argument("output_csv", nargs="?", default="outputs/provisions_from_spacing_3.csv")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes that parse pages in parallel")
+    args = parser.parse_args()
 
+    extract_provisions_by_spacing(args.pdf_path, args.output_csv, workers=args.workers)
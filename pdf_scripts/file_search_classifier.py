@@ -1,34 +1,29 @@
 import os
-import sys
 import json
-from dotenv import load_dotenv
-from openai import OpenAI
+import time
+import argparse
 
-# Load key from .env file (to keep the API key secure)
-load_dotenv()
-client = OpenAI(api_key=os.getenv("api_key"))
-
-def upload_file_to_vector_store(filepath, vector_store_id):
-    print(f"Uploading and indexing {filepath}...")
-    with open(filepath, "rb") as f:
-        client.vector_stores.file_batches.upload_and_poll(
-            vector_store_id=vector_store_id,
-            files=[f]
-        )
+from vector_store_registry import get_vector_store
+from openai_client import get_client
+from telemetry import telemetry, add_telemetry_arguments, write_from_args, metrics_path_for
+from engine import RateLimiter, run_concurrently, call_with_backoff, estimate_tokens
+from result_cache import cache, add_cache_arguments, configure_from_args
+from result_store import text_hash, add_store_arguments, store_from_args
+from classification import MATRIX_PATH, parse_classification
+from classifier import packed_cache_key, classify_provisions_packed
+from pdf_scripts.segmentation import segment_pdf, section_key, add_profile_arguments
 
 def classify_with_file_search(pdf_path, matrix_path, output_path=None):
-    # Create a new vector store
-    print("Creating vector store...")
-    vector_store = client.vector_stores.create(name="CSO_Classification_Store")
-    vector_store_id = vector_store.id
+    client = get_client()
 
-    # Upload PDF and matrix file to the vector store
-    upload_file_to_vector_store(pdf_path, vector_store_id)
-    upload_file_to_vector_store(matrix_path, vector_store_id)
+    # Vector store with the PDF and matrix file, reused if both are unchanged
+    with telemetry.stage("retrieval"):
+        vector_store_id = get_vector_store(client, [pdf_path, matrix_path], "CSO_Classification_Store")
 
     # Create the classification response using Responses API with vector store
     print("\nSending classification request...")
-    response = client.responses.create(
+    start_time = time.time()
+    response = call_with_backoff(lambda request: client.responses.create(**request), dict(
         model="gpt-4o",
         instructions=(
         "You are a legal classification assistant trained in civil society regulation.\n"
@@ -54,7 +49,8 @@ def classify_with_file_search(pdf_path, matrix_path, output_path=None):
         "}"
         ),
         temperature=0.2
-    )
+    ), stage="classify")
+    telemetry.record_response(response, time.time() - start_time, stage="classify")
 
 
     print("\nResponse received:\n")
@@ -65,13 +61,171 @@ def classify_with_file_search(pdf_path, matrix_path, output_path=None):
             f.write(response.output_text)
         print(f"\nResponse saved to {output_path}")
 
+# Map-reduce mode. The single call above has to extract and classify the
+# whole act in one answer, which gets cut off on long acts, can't be spread
+# over several requests and is lost entirely if it fails. Here the act is
+# split into its numbered sections locally (segmentation.py), the sections
+# are grouped into chunks that end at section boundaries, and
+# each chunk is classified in one packed request (classifier.py) with the
+# matrix in the prompt. Chunks run concurrently with the rate limits and
+# retries of engine.py, and their answers are merged back in document order.
+# Results are cached per provision, so running an act again only sends the
+# chunks that failed.
+
+CHUNK_PROVISIONS = 10     # provisions per request, as batch_classifier.py --pack
+CHUNK_TOKENS = 3000       # provision text per request, so the answer isn't cut off
+
+def section_units(sections):
+    # Runs of consecutive sections with the same number: a section and its
+    # subsections, which stay in the same chunk when they fit
+    units = []
+    for section in sections:
+        if units and section.section and section.section == units[-1][-1].section:
+            units[-1].append(section)
+        else:
+            units.append([section])
+    return units
+
+def chunk_sections(sections, max_provisions=CHUNK_PROVISIONS, max_tokens=CHUNK_TOKENS):
+    # Group sections into chunks of at most max_provisions sections and about
+    # max_tokens of text. A chunk ends at a section boundary; only a section
+    # that is too large on its own is split between its subsections.
+    chunks, current, tokens = [], [], 0
+    for unit in section_units(sections):
+        unit_tokens = sum(estimate_tokens(section.provision) for section in unit)
+        if current and (len(current) + len(unit) > max_provisions or tokens + unit_tokens > max_tokens):
+            chunks.append(current)
+            current, tokens = [], 0
+        for section in unit:
+            section_tokens = estimate_tokens(section.provision)
+            if current and (len(current) >= max_provisions or tokens + section_tokens > max_tokens):
+                chunks.append(current)
+                current, tokens = [], 0
+            current.append(section)
+            tokens += section_tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+def chunk_label(chunk):
+    keys = [section_key(section) for section in chunk if section.section]
+    return f"sections {keys[0]} to {keys[-1]}" if keys else f"{len(chunk)} paragraphs"
+
+def classify_chunk(chunk, limiter=None):
+    # Classifications of a chunk's sections, in order, in one packed request;
+    # a reply that doesn't line up is split and retried
+    texts = [section.provision for section in chunk]
+    return classify_provisions_packed(texts, batch_size=len(texts), max_workers=1, limiter=limiter)
+
+def merge_chunks(sections, classified):
+    # Reduce: one record per section in document order. A section the
+    # segmentation produced twice (same number and text) is kept once; other
+    # repeats of a text share the result of its first occurrence.
+    records, seen = [], set()
+    for section in sorted(sections, key=lambda section: section.start):
+        key = (section_key(section), text_hash(section.provision))
+        if key in seen:
+            continue
+        seen.add(key)
+        output = classified.get(text_hash(section.provision))
+        record = {"section": section_key(section), "provision": section.provision}
+        if isinstance(output, Exception):
+            record["output"] = f"ERROR: {output}"
+        else:
+            record["output"] = output.to_dict()
+        records.append(record)
+    return records
+
+def classify_in_chunks(pdf_path, output_path=None, profile="canada_en", max_provisions=CHUNK_PROVISIONS,
+                       max_tokens=CHUNK_TOKENS, concurrency=4, requests_per_minute=500, tokens_per_minute=30000,
+                       workers=None):
+    sections = list(telemetry.timed_iter("pdf_parse", segment_pdf(pdf_path, profile, workers or os.cpu_count())))
+
+    # Map: each distinct text is classified once, in the chunk of its first
+    # occurrence. Texts already in the result cache are filled in here and
+    # never take a share of the rate limits.
+    classified, unique = {}, []
+    for section in sections:
+        key = text_hash(section.provision)
+        if key in classified:
+            continue
+        cached = cache.get(packed_cache_key(section.provision), count_miss=False)
+        classified[key] = parse_classification(cached) if cached is not None else None
+        if cached is None:
+            unique.append(section)
+    chunks = chunk_sections(unique, max_provisions, max_tokens)
+    print(f" Split {pdf_path} into {len(sections)} sections ({len(classified)} distinct, "
+          f"{len(classified) - len(unique)} cached), {len(chunks)} chunks to classify\n")
+
+    failed = []
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    def classify(chunk):
+        outputs = classify_chunk(chunk, limiter)
+        print(f" Classified {chunk_label(chunk)}")
+        return outputs
+
+    def on_error(chunk, error):
+        # The other chunks go on; this one's sections are saved as errors
+        print(f" Chunk with {chunk_label(chunk)} failed: {error}")
+        failed.append(chunk)
+        return [error] * len(chunk)
+
+    start_time = time.time()
+    # Every pack, its retries and its splits wait on the shared limiter inside
+    # classify_provisions_packed, so a 429 pauses all the chunks and a failed
+    # chunk is not sent again as a whole
+    results = run_concurrently(classify, chunks, max_workers=concurrency, on_error=on_error, max_retries=0)
+    duration = round(time.time() - start_time, 2)
+
+    for chunk, outputs in zip(chunks, results):
+        for section, output in zip(chunk, outputs):
+            classified[text_hash(section.provision)] = output
+    records = merge_chunks(sections, classified)
+
+    print(f"\n Classified {len(records)} provisions, {len(chunks)} chunks sent, in {duration} seconds")
+    if failed:
+        print(f" {len(failed)} chunks failed; run again to retry them (finished chunks come from the cache)")
+
+    if output_path:
+        with open(output_path, "w", encoding="utf-8") as f:
+            json.dump(records, f, indent=4, ensure_ascii=False)
+        print(f" Saved results to {output_path}")
+    return records
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract and classify every numbered section of a PDF act.")
+    parser.add_argument("pdf_path")
+    parser.add_argument("matrix_path", help="CSO Matrix file to search (the chunked mode always uses the matrix's IDs)")
+    parser.add_argument("output_path", nargs="?", help="File for the results")
+    parser.add_argument("--chunks", action="store_true",
+                        help="Split the act locally and classify it chunk by chunk instead of in one call")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_PROVISIONS, help="Most sections per chunk")
+    parser.add_argument("--chunk-tokens", type=int, default=CHUNK_TOKENS, help="Most tokens of section text per chunk")
+    parser.add_argument("--concurrency", type=int, default=4, help="Chunks classified at the same time")
+    parser.add_argument("--rpm", type=int, default=500, help="Requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=30000, help="Tokens-per-minute budget")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes that read pages in parallel")
+    add_profile_arguments(parser)
+    add_cache_arguments(parser)
+    add_store_arguments(parser)
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+
+    if not args.chunks:
+        classify_with_file_search(args.pdf_path, args.matrix_path, args.output_path)
+        write_from_args(args)
+        return
 
+    configure_from_args(args)
+    if os.path.abspath(args.matrix_path) != os.path.abspath(MATRIX_PATH):
+        print(f" Note: chunks are classified against {MATRIX_PATH}, whose entry IDs the answers use")
+    classify_in_chunks(args.pdf_path, args.output_path, args.profile, args.chunk_size, args.chunk_tokens,
+                       args.concurrency, args.rpm, args.tpm, args.workers)
+    if args.output_path:
+        store_from_args(args, args.output_path, os.path.splitext(os.path.basename(args.pdf_path))[0], "gpt-4o")
+    cache.report()
+    write_from_args(args, metrics_path_for(args.output_path) if args.output_path else None)
 
 if __name__ == "__main__":
-    if len(sys.argv) < 3:
-        print("Usage: python file_search_classifier.py path/to/pdf path/to/matrix.txt [output.json]")
-    else:
-        pdf_path = sys.argv[1]
-        matrix_path = sys.argv[2]
-        output_path = sys.argv[3] if len(sys.argv) > 3 else None
-        classify_with_file_search(pdf_path, matrix_path, output_path)
\ No newline at end of file
+    main()
@@ -0,0 +1,229 @@
+import os
+import json
+import difflib
+import datetime
+import argparse
+
+from result_cache import cache, add_cache_arguments, configure_from_args
+from run_journal import RunJournal, DONE, load_journal, add_resume_arguments
+from telemetry import telemetry, add_telemetry_arguments, write_from_args, metrics_path_for
+from result_store import text_hash, add_store_arguments, store_from_args
+from pdf_scripts.segmentation import segment_pdf, section_key, add_profile_arguments
+from pdf_scripts.pipeline import run_pipeline
+
+# Re-classify a new version of an act without redoing the provisions that did
+# not change. The new extraction is aligned against the journal of an earlier
+# run (pipeline.py or this script): provisions whose text is the same keep
+# their label and classification, and only added or changed ones go through
+# the filter and classifier. The result is a full journal for the new version
+# plus a change report.
+#
+# Alignment, in order:
+#   unchanged   same text in the same place (renumbered: same text, new number)
+#   moved       same text somewhere else in the act
+#   changed     same section number with new text, or, without numbers, a
+#               paragraph replaced in place by a similar one
+#   added       anything left in the new version
+#   removed     anything left in the previous run
+#
+# Section numbers come from the --profile; the default "generic" profile splits
+# by layout like pipeline.py, so a pipeline journal can be used as the
+# previous run, but only text and position can then be aligned.
+
+CARRIED = {"unchanged", "renumbered", "moved"}
+# Minimum similarity for an unnumbered paragraph to count as a new version of
+# the one it replaced rather than an unrelated one
+MIN_CHANGED_SIMILARITY = 0.5
+
+def load_previous(path):
+    # Records of the earlier run, in extraction order
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"File not found: {path}")
+    records = sorted(load_journal(path).values(), key=lambda record: record["id"])
+    if not records:
+        raise ValueError(f"No records in {path}")
+    return records
+
+def similarity(old, new):
+    return round(difflib.SequenceMatcher(None, old.split(), new.split(), autojunk=False).ratio(), 3)
+
+def word_diff(old, new):
+    # Changed stretches of words, e.g. [{"removed": "fifty thousand", "added": "one hundred thousand"}]
+    old_words, new_words = old.split(), new.split()
+    matcher = difflib.SequenceMatcher(None, old_words, new_words, autojunk=False)
+    return [{"removed": " ".join(old_words[i1:i2]), "added": " ".join(new_words[j1:j2])}
+            for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
+
+def align(previous, sections):
+    # previous: earlier records; sections: Sections of the new version.
+    # Returns ({new position: (change, previous position or None)}, [removed previous positions])
+    old_hashes = [text_hash(record["provision"]) for record in previous]
+    new_hashes = [text_hash(section.provision) for section in sections]
+    matches = {}
+    replaced = []  # (old positions, new positions) of the blocks that differ
+
+    matcher = difflib.SequenceMatcher(None, old_hashes, new_hashes, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            for i, j in zip(range(i1, i2), range(j1, j2)):
+                renumbered = (previous[i].get("section") or "") != section_key(sections[j])
+                matches[j] = ("renumbered" if renumbered else "unchanged", i)
+        else:
+            replaced.append((list(range(i1, i2)), list(range(j1, j2))))
+
+    unmatched_old = {i for old, _ in replaced for i in old}
+
+    # Same text elsewhere
+    by_hash = {}
+    for i in sorted(unmatched_old):
+        by_hash.setdefault(old_hashes[i], []).append(i)
+    for _, new in replaced:
+        for j in new:
+            if by_hash.get(new_hashes[j]):
+                i = by_hash[new_hashes[j]].pop(0)
+                matches[j] = ("moved", i)
+                unmatched_old.discard(i)
+
+    # Same section number
+    by_number = {}
+    for i in sorted(unmatched_old):
+        if previous[i].get("section"):
+            by_number.setdefault(previous[i]["section"], i)
+    for _, new in replaced:
+        for j in new:
+            i = by_number.get(section_key(sections[j]))
+            if j not in matches and i in unmatched_old:
+                matches[j] = ("changed", i)
+                unmatched_old.discard(i)
+
+    # Replaced in place by a similar paragraph
+    for old, new in replaced:
+        old = [i for i in old if i in unmatched_old]
+        new = [j for j in new if j not in matches]
+        for i, j in zip(old, new):
+            if similarity(previous[i]["provision"], sections[j].provision) >= MIN_CHANGED_SIMILARITY:
+                matches[j] = ("changed", i)
+                unmatched_old.discard(i)
+
+    for j in range(len(sections)):
+        matches.setdefault(j, ("added", None))
+    return matches, sorted(unmatched_old)
+
+def classification_of(record):
+    output = record.get("output")
+    if isinstance(output, dict):
+        return output.get("matrix_entry"), output.get("subgroup"), output.get("type")
+    return None
+
+# workers: threads per LLM stage; extract_workers: processes that read the
+# PDF's pages (segment_pdf), one per CPU by default
+def run_incremental(pdf_path, previous_path, output_path, profile="generic", workers=4, extract_workers=None,
+                    **pipeline_options):
+    previous = load_previous(previous_path)
+    sections = list(telemetry.timed_iter("pdf_parse", segment_pdf(pdf_path, profile,
+                                                                  extract_workers or os.cpu_count())))
+    matches, removed = align(previous, sections)
+
+    # Carry over the results of unchanged provisions; the rest are queued for
+    # the pipeline. Provisions that failed in the earlier run are retried.
+    to_run = []
+    with RunJournal(output_path) as journal:
+        for j, section in enumerate(sections):
+            change, i = matches[j]
+            fields = {"provision": section.provision, "section": section_key(section), "change": change,
+                      "previous_id": previous[i]["id"] if i is not None else None}
+            old = previous[i] if i is not None else None
+            if change in CARRIED and old["status"] == DONE:
+                if not journal.is_done(j):
+                    journal.record(j, DONE, label=old.get("label", ""), explanation=old.get("explanation", ""),
+                                   **({"output": old["output"]} if "output" in old else {}), **fields)
+            else:
+                to_run.append(dict(fields, id=j))
+
+    counts = {}
+    for change, _ in matches.values():
+        counts[change] = counts.get(change, 0) + 1
+    counts["removed"] = len(removed)
+    print(f" {len(sections)} provisions: " + ", ".join(f"{n} {change}" for change, n in counts.items()))
+    print(f" Filtering and classifying {len(to_run)} provisions\n")
+
+    run_pipeline(pdf_path, output_path, workers=workers, records=to_run, **pipeline_options)
+
+    report = change_report(previous, sections, matches, removed, load_journal(output_path))
+    report.update(pdf=pdf_path, previous=previous_path, output=output_path, profile=profile, counts=counts)
+    return report
+
+def change_report(previous, sections, matches, removed, records):
+    # records: the new run's journal records by ID
+    changes = []
+    for j, section in enumerate(sections):
+        change, i = matches[j]
+        if change == "unchanged":
+            continue
+        record = records.get(j, {})
+        entry = {"change": change, "id": j, "section": section_key(section)}
+        if i is not None:
+            old = previous[i]
+            entry.update(previous_id=old["id"], previous_section=old.get("section", ""))
+        if change == "changed":
+            entry.update(similarity=similarity(previous[i]["provision"], section.provision),
+                         diff=word_diff(previous[i]["provision"], section.provision))
+        if change in ("changed", "added"):
+            entry.update(label=record.get("label"), classification=classification_of(record))
+            if change == "changed":
+                entry.update(previous_label=previous[i].get("label"),
+                             previous_classification=classification_of(previous[i]))
+        changes.append(entry)
+    for i in removed:
+        changes.append({"change": "removed", "previous_id": previous[i]["id"],
+                        "previous_section": previous[i].get("section", ""), "provision": previous[i]["provision"]})
+    return {"changes": changes}
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Re-classify only the provisions that changed in a new version of an act.")
+    parser.add_argument("pdf_path", help="New version of the act")
+    parser.add_argument("previous", help="Journal (.jsonl) of the run on the previous version")
+    parser.add_argument("output_path", nargs="?",
+                        help="JSON Lines output (default: outputs/incremental_<pdf name>_<timestamp>.jsonl)")
+    add_profile_arguments(parser, default="generic")
+    parser.add_argument("--workers", type=int, default=4, help="Threads per LLM stage")
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count(),
+                        help="Processes that read pages in parallel")
+    parser.add_argument("--rpm", type=int, default=500, help="Requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=30000, help="Tokens-per-minute budget")
+    parser.add_argument("--top-k", type=int,
+                        help="Send only the K closest matrix entries in the prompt instead of using file search")
+    parser.add_argument("--no-prefilter", action="store_true",
+                        help="Send every paragraph to the LLM filter, even the ones the rules can label")
+    add_cache_arguments(parser)
+    add_resume_arguments(parser)
+    add_store_arguments(parser)
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    output_path = args.resume or args.output_path
+    if not output_path:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        name = os.path.splitext(os.path.basename(args.pdf_path))[0]
+        output_path = f"outputs/incremental_{name}_{timestamp}.jsonl"
+
+    report = run_incremental(args.pdf_path, args.previous, output_path, profile=args.profile, workers=args.workers,
+                             extract_workers=args.extract_workers, requests_per_minute=args.rpm,
+                             tokens_per_minute=args.tpm, top_k=args.top_k, use_prefilter=not args.no_prefilter)
+
+    report_path = os.path.splitext(output_path)[0] + ".changes.json"
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    reclassified = [c for c in report["changes"] if c["change"] == "changed"
+                    and c.get("classification") != c.get("previous_classification")]
+    print(f"\n {len(reclassified)} changed provisions got a different label or classification")
+    print(f" Saved results to {output_path} and the change report to {report_path}")
+    store_from_args(args, output_path, os.path.splitext(os.path.basename(args.pdf_path))[0], "gpt-4o")
+    cache.report()
+    write_from_args(args, metrics_path_for(output_path))
+
+if __name__ == "__main__":
+    main()
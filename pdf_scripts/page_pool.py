@@ -0,0 +1,37 @@
+import os
+import itertools
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+# Runs page-level PDF work on a process pool. The PDF is split into small page
+# ranges, each worker opens the file itself and parses only its range, and the
+# results come back in page order. Only a few ranges are in flight at a time,
+# so memory stays bounded however long the statute is.
+
+def page_ranges(page_count, pages_per_task):
+    return [(start, min(start + pages_per_task, page_count)) for start in range(0, page_count, pages_per_task)]
+
+def iter_pages(pdf_path, page_count, work, workers=None, pages_per_task=8):
+    # work(pdf_path, start, stop) returns a list with one result per page and
+    # must be picklable (a module-level function or a functools.partial of one).
+    # Yields the per-page results in page order as soon as they are ready.
+    ranges = page_ranges(page_count, pages_per_task)
+    workers = min(workers or os.cpu_count() or 1, len(ranges))
+
+    if workers <= 1:
+        for start, stop in ranges:
+            yield from work(pdf_path, start, stop)
+        return
+
+    remaining = iter(ranges)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Two ranges per worker keeps every process busy while the caller
+        # consumes the oldest one
+        in_flight = deque(pool.submit(work, pdf_path, start, stop)
+                          for start, stop in itertools.islice(remaining, 2 * workers))
+        while in_flight:
+            results = in_flight.popleft().result()
+            next_range = next(remaining, None)
+            if next_range:
+                in_flight.append(pool.submit(work, pdf_path, *next_range))
+            yield from results
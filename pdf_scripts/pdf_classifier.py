@@ -1,49 +1,42 @@
-import fitz  # PyMuPDF
-import re
+import os
 import json
-import sys
+import argparse
+from engine import call_with_backoff
 from classifier import classify_provision  # existing classification logic
-
-def extract_provisions_from_pdf(pdf_path):
-    doc = fitz.open(pdf_path)
-    full_text = ""
-    for page in doc:
-        full_text += page.get_text()
-
-    # Extract numbered sections like "3.", "4.", etc.
-    #pattern = r"\n(\d{1,2})\.\s{1,5}(.*?)(?=\n\d{1,2}\.\s+|PART|\Z)" #Kenya
-    pattern=r"\n((\d{1,3}(\s*\(\d{0,2}\))?))\s+(.*?)(?=\n\d{1,3}(\s*\(\d{0,2}\))?\s+|PART\s|\Z)" #Canada
-    matches = re.findall(pattern, full_text, re.DOTALL)
-
-    provisions = []
-    """#Kenya
-    for section_number, text in matches:
-        cleaned = text.strip()
-        if len(cleaned) > 50:
-            provisions.append(cleaned)
-    """
-    #Canada
-    for match in matches:
-        section_number = match[0]  # full number like "3 (1)"
-        text = match[3]            # actual provision text
-        cleaned = " ".join(text.strip().splitlines())
-        if len(cleaned) > 50:
-            provisions.append(f"{section_number}. {cleaned}")
-
-
-    return provisions
-
-def classify_pdf(pdf_path, output_path=None):
-    provisions = extract_provisions_from_pdf(pdf_path)
+from pdf_scripts.segmentation import segment_pdf, add_profile_arguments
+from near_duplicates import add_near_duplicate_arguments, index_from_args
+from telemetry import telemetry, add_telemetry_arguments, write_from_args, metrics_path_for
+
+# Numbered sections of the act, split with the jurisdiction's profile from
+# segmentation.py (canada_en, canada_fr, kenya, or generic)
+def extract_provisions_from_pdf(pdf_path, workers=1, profile="canada_en"):
+    sections = telemetry.timed_iter("pdf_parse", segment_pdf(pdf_path, profile, workers))
+    return [section.provision for section in sections]
+
+# With near_duplicates (a NearDuplicateIndex), a provision close enough to one
+# already classified, in this act or an earlier one, reuses that result
+def classify_pdf(pdf_path, output_path=None, workers=None, profile="canada_en", near_duplicates=None):
+    provisions = extract_provisions_from_pdf(pdf_path, workers or os.cpu_count(), profile)
     print(f" Extracted {len(provisions)} provisions from {pdf_path}\n")
 
     results = []
+    classified = {}  # representative text -> output
     for i, provision in enumerate(provisions, 1):
         print(f"Classifying provision {i} of {len(provisions)}:")
         print(provision[:100].replace("\n", " ") + "...\n")
         try:
-            result = classify_provision(provision)
-            print("Classification Result:\n", result)
+            result = {"provision": provision}
+            representative = provision
+            if near_duplicates:
+                representative, similarity = near_duplicates.assign(provision, os.path.basename(pdf_path))
+                if representative != provision:
+                    print(f"Near-duplicate ({similarity}) of: {representative[:100]}")
+                    result.update(representative=representative, similarity=similarity)
+            if representative not in classified:
+                classified[representative] = call_with_backoff(classify_provision, representative,
+                                                               stage="classify").to_dict()
+            result["output"] = classified[representative]
+            print("Classification Result:\n", result["output"])
             results.append(result)
         except Exception as e:
             print(f" Error on provision {i}: {e}")
@@ -57,9 +50,14 @@ def classify_pdf(pdf_path, output_path=None):
     return results
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python pdf_classifier.py path/to/file.pdf [output.json]")
-    else:
-        pdf_path = sys.argv[1]
-        output_path = sys.argv[2] if len(sys.argv) > 2 else None
-        classify_pdf(pdf_path, output_path)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Split a PDF act into sections and classify each one.")
+    parser.add_argument("pdf_path")
+    parser.add_argument("output_path", nargs="?", help="JSON file for the results")
+    add_profile_arguments(parser)
+    add_near_duplicate_arguments(parser)
+    add_telemetry_arguments(parser)
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes that read pages in parallel")
+    args = parser.parse_args()
+
+    classify_pdf(args.pdf_path, args.output_path, args.workers, args.profile, index_from_args(args))
+    write_from_args(args, metrics_path_for(args.output_path) if args.output_path else None)
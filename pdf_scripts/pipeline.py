@@ -0,0 +1,199 @@
+import os
+import queue
+import datetime
+import argparse
+import threading
+
+from engine import RateLimiter, call_with_backoff, estimate_tokens
+from result_cache import cache, add_cache_arguments, configure_from_args
+from run_journal import RunJournal, DONE, FAILED, add_resume_arguments
+from telemetry import telemetry, add_telemetry_arguments, write_from_args, metrics_path_for
+from result_store import add_store_arguments, store_from_args
+from vector_store_registry import get_vector_store
+from classifier import classify_provision as classify_with_matrix_excerpt
+from pdf_scripts.extract_generic_provisions import iter_provisions_by_spacing
+from pdf_scripts.provision_filter_llm import filter_paragraph
+from pdf_scripts.prefilter import prefilter_text, explanation
+from pdf_scripts.batch_classifier import (
+    matrix_path, classify_provision, PROMPT_OVERHEAD_TOKENS, EXCERPT_TOKENS_PER_ENTRY
+)
+from openai_client import get_client
+
+# Extract -> filter -> classify in one process. Each stage runs on its own
+# threads and hands records to the next through a bounded queue, so the LLM
+# stages start as soon as the first page is parsed and memory stays flat no
+# matter how long the act is.
+
+END = object()  # end-of-stream marker passed down the queues
+
+# Rough prompt size of a filter call (instructions + schema) on top of the paragraph
+FILTER_OVERHEAD_TOKENS = 350
+
+def run_stage(work, inbox, outbox, workers):
+    # Start `workers` threads that apply work(record) to each record from inbox
+    # and put the non-None results on outbox. The last thread to see END
+    # passes it on.
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def loop():
+        while True:
+            record = inbox.get()
+            if record is END:
+                inbox.put(END)  # let sibling threads see it too
+                with lock:
+                    remaining[0] -= 1
+                    if remaining[0] == 0:
+                        outbox.put(END)
+                return
+            try:
+                result = work(record)
+            except Exception as e:
+                print(f" Dropped record {record.get('id')}: {e}")
+                continue
+            if result is not None:
+                outbox.put(result)
+
+    threads = [threading.Thread(target=loop, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+def extract_stage(pdf_path, outbox, y_threshold, min_words, skip=(), records=None):
+    # Paragraph IDs are their position in the extraction, which is
+    # deterministic, so a resumed run can skip the ones already done.
+    # records, if given, are used instead of the PDF's paragraphs.
+    def produce():
+        try:
+            if records is None:
+                paragraphs = telemetry.timed_iter("pdf_parse",
+                                                  iter_provisions_by_spacing(pdf_path, y_threshold, min_words))
+                source = ({"id": i, "provision": text} for i, text in enumerate(paragraphs))
+            else:
+                source = records
+            for record in source:
+                if record["id"] in skip:
+                    continue
+                outbox.put(dict(record))
+        finally:
+            outbox.put(END)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    return thread
+
+def run_pipeline(pdf_path, output_path, workers=4, queue_size=32, requests_per_minute=500,
+                 tokens_per_minute=30000, top_k=None, y_threshold=15.0, min_words=5, use_prefilter=True,
+                 records=None):
+    # output_path is a RunJournal: if it already holds results from an earlier
+    # run, finished paragraphs are skipped and failed ones are retried.
+    # records: {"id", "provision", ...} dicts to filter and classify instead of
+    # extracting the PDF's paragraphs (see incremental.py); other fields are
+    # kept in the output.
+    # Both LLM stages share one account, so they share one limiter
+    limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+
+    vector_store_id = None
+    if not top_k:
+        with telemetry.stage("retrieval"):
+            vector_store_id = get_vector_store(get_client(), [matrix_path], "CSO_Matrix_Store")
+    classify_overhead = 600 + top_k * EXCERPT_TOKENS_PER_ENTRY if top_k else PROMPT_OVERHEAD_TOKENS
+
+    def filter_record(record):
+        if use_prefilter:
+            with telemetry.stage("filter"):
+                label, reason = prefilter_text(record["provision"])
+            if label:
+                return dict(record, status=DONE, label=label, explanation=explanation(reason))
+        try:
+            parsed = call_with_backoff(
+                lambda text: filter_paragraph(text, record["id"], delay=0),
+                record["provision"], limiter, estimate_tokens(record["provision"], FILTER_OVERHEAD_TOKENS),
+                stage="filter"
+            )
+        except Exception as e:
+            print(f" Filter error on paragraph {record['id']}: {e}")
+            return dict(record, status=FAILED, label="", explanation=f"FAILED: {e}")
+        return dict(record, status=DONE, label=parsed.get("label", ""), explanation=parsed.get("explanation", ""))
+
+    def classify_record(record):
+        # Paragraphs that aren't provisions skip the classifier but still reach
+        # the output, so every extracted paragraph is accounted for
+        if record["label"] != "provision":
+            return record
+        print(f" Classifying paragraph {record['id']}")
+        if top_k:
+            classify = lambda text: classify_with_matrix_excerpt(text, top_k=top_k)
+        else:
+            classify = lambda text: classify_provision(text, vector_store_id)
+        try:
+            classification = call_with_backoff(classify, record["provision"], limiter,
+                                               estimate_tokens(record["provision"], classify_overhead),
+                                               stage="classify")
+        except Exception as e:
+            print(f" Error: {e}")
+            return dict(record, status=FAILED, output=f"ERROR: {e}")
+        return dict(record, output=classification.to_dict())
+
+    paragraphs = queue.Queue(maxsize=queue_size)
+    filtered = queue.Queue(maxsize=queue_size)
+    classified = queue.Queue(maxsize=queue_size)
+
+    journal = RunJournal(output_path)
+    extract_stage(pdf_path, paragraphs, y_threshold, min_words, skip=journal.done_ids(), records=records)
+    run_stage(filter_record, paragraphs, filtered, workers)
+    run_stage(classify_record, filtered, classified, workers)
+
+    # Results are journaled as they arrive (JSON Lines), so they are usable while
+    # the run is still going. Order follows completion, use "id" to sort.
+    counts = {"paragraphs": 0, "provisions": 0}
+    with journal:
+        while True:
+            record = classified.get()
+            if record is END:
+                break
+            counts["paragraphs"] += 1
+            if "output" in record:
+                counts["provisions"] += 1
+            journal.record(record.pop("id"), record.pop("status"), **record)
+
+    print(f"\n Processed {counts['paragraphs']} paragraphs, classified {counts['provisions']} provisions.")
+    print(f" Journal: {journal.summary()}")
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract, filter and classify the provisions of a PDF in one pass.")
+    parser.add_argument("pdf_path")
+    parser.add_argument("output_path", nargs="?",
+                        help="JSON Lines output (default: outputs/pipeline_<pdf name>_<timestamp>.jsonl)")
+    parser.add_argument("--workers", type=int, default=4, help="Threads per LLM stage")
+    parser.add_argument("--queue-size", type=int, default=32, help="Records buffered between stages")
+    parser.add_argument("--rpm", type=int, default=500, help="Requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=30000, help="Tokens-per-minute budget")
+    parser.add_argument("--top-k", type=int,
+                        help="Send only the K closest matrix entries in the prompt instead of using file search")
+    parser.add_argument("--no-prefilter", action="store_true",
+                        help="Send every paragraph to the LLM filter, even the ones the rules can label")
+    add_cache_arguments(parser)
+    add_resume_arguments(parser)
+    add_store_arguments(parser)
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    name = os.path.splitext(os.path.basename(args.pdf_path))[0]
+    output_path = args.resume or args.output_path
+    if not output_path:
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        output_path = f"outputs/pipeline_{name}_{timestamp}.jsonl"
+
+    run_pipeline(args.pdf_path, output_path, workers=args.workers, queue_size=args.queue_size,
+                 requests_per_minute=args.rpm, tokens_per_minute=args.tpm, top_k=args.top_k,
+                 use_prefilter=not args.no_prefilter)
+    print(f" Saved results to {output_path}")
+    store_from_args(args, output_path, name, "gpt-4o")
+    cache.report()
+    write_from_args(args, metrics_path_for(output_path))
+
+if __name__ == "__main__":
+    main()
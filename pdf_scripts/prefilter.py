@@ -0,0 +1,138 @@
+import re
+import argparse
+import pandas as pd
+
+# Cheap local pre-filter for provision_filter_llm.py. Gazette headers, PART
+# headings, amendment notes and similar boilerplate make up a large share of
+# the paragraphs that extract_generic_provisions.py produces, and the obvious
+# ones (either way) can be decided with a few regexes. Only the paragraphs the
+# rules are unsure about need to go to the LLM.
+#
+# Labels: "provision", "not_provision", or "" when the LLM should decide.
+
+# Words that make a paragraph a rule: obligations, permissions, prohibitions, sanctions
+DEONTIC = r"\b(?:shall|must|may|is entitled|are entitled|is liable|are liable|commits an offence|guilty of an offence)\b"
+STRONG_DEONTIC = r"\b(?:shall|must|is liable|are liable|commits an offence|guilty of an offence)\b"
+
+# Editorial notes such as "[Act No. 19 of 2014, s. 4.]" or "[Date of assent: ...]"
+BRACKETED_NOTE = r"^\s*\[[^\]]*\]?\s*$"
+PART_HEADING = r"^\s*PART\s+[IVXLC]+\b"
+PUBLICATION = (r"(?i)gazette|government printer|published by|national council for law reporting|"
+               r"law reporting|^\s*\[?rev\.\s*\d{4}\]?|\bCAP\.\s*\d+")
+ARRANGEMENT = r"(?i)^\s*(?:section\s+\d+\.|arrangement of sections)"
+DELETED = r"(?i)^\s*(?:\(\w+\)\s*)?(?:deleted|repealed|spent)\s+by\b"
+# Too ambiguous to call "provision" on the wording alone: definitions, and
+# lead-ins that end before their list ("... shall—")
+DEFINITION = r"^\W*[\"“'‘][^\"”'’]+[\"”'’]\s+(?:means|includes|has the meaning)\b"
+LEAD_IN = r"(?:—|–|-|:)\s*$"
+
+# Compiled once, for pandas and for prefilter_text alike. MATCH rules are
+# anchored at the start of the paragraph, SEARCH rules match anywhere.
+MATCH = {name: re.compile(pattern) for name, pattern in {
+    "note": BRACKETED_NOTE, "part_heading": PART_HEADING, "arrangement": ARRANGEMENT, "deleted": DELETED,
+    "definition": DEFINITION}.items()}
+SEARCH = {name: re.compile(pattern) for name, pattern in {
+    "deontic": DEONTIC, "strong_deontic": STRONG_DEONTIC, "publication": PUBLICATION, "lead_in": LEAD_IN}.items()}
+LETTER = re.compile(r"[A-Za-z]")
+UPPER = re.compile(r"[A-Z]")
+
+def features(texts):
+    texts = texts.fillna("").astype(str)
+    letters = texts.str.count(LETTER)
+    columns = {
+        "words": texts.str.split().str.len(),
+        "upper_ratio": texts.str.count(UPPER) / letters.where(letters > 0, 1),
+    }
+    columns.update({name: texts.str.match(pattern) for name, pattern in MATCH.items()})
+    columns.update({name: texts.str.contains(pattern) for name, pattern in SEARCH.items()})
+    return pd.DataFrame(columns, index=texts.index)
+
+def text_features(text):
+    # features() of a single paragraph, as a dict
+    text = "" if text is None else str(text)
+    letters = len(LETTER.findall(text))
+    f = {"words": len(text.split()), "upper_ratio": len(UPPER.findall(text)) / (letters or 1)}
+    f.update({name: pattern.match(text) is not None for name, pattern in MATCH.items()})
+    f.update({name: pattern.search(text) is not None for name, pattern in SEARCH.items()})
+    return f
+
+def prefilter(texts):
+    # Label a whole column of paragraphs at once. Returns a DataFrame with
+    # "label" and "reason", aligned with `texts`.
+    f = features(texts)
+
+    not_provision = pd.Series("", index=f.index)
+    not_provision[f["deleted"]] = "deleted or repealed note"
+    not_provision[f["note"]] = "editorial note in brackets"
+    not_provision[f["arrangement"]] = "arrangement of sections"
+    not_provision[f["publication"] & ~f["deontic"]] = "publication metadata"
+    not_provision[f["part_heading"] & ~f["deontic"]] = "part heading"
+    not_provision[(f["upper_ratio"] > 0.6) & ~f["deontic"]] = "title in capitals"
+
+    provision = (f["strong_deontic"] & (f["words"] >= 12) & (not_provision == "")
+                 & ~f["part_heading"] & ~f["publication"] & ~f["definition"] & ~f["lead_in"])
+
+    result = pd.DataFrame({"label": "", "reason": ""}, index=f.index)
+    result.loc[not_provision != "", "label"] = "not_provision"
+    result.loc[not_provision != "", "reason"] = not_provision
+    result.loc[provision, "label"] = "provision"
+    result.loc[provision, "reason"] = "binding language"
+    return result
+
+def prefilter_text(text):
+    # Single-paragraph version for streaming callers: the same rules as
+    # prefilter() (the last matching reason wins there, so it is checked
+    # first here) on plain re matches. Returns (label, reason).
+    f = text_features(text)
+    if not f["deontic"]:
+        if f["upper_ratio"] > 0.6:
+            return "not_provision", "title in capitals"
+        if f["part_heading"]:
+            return "not_provision", "part heading"
+        if f["publication"]:
+            return "not_provision", "publication metadata"
+    for name, reason in (("arrangement", "arrangement of sections"), ("note", "editorial note in brackets"),
+                         ("deleted", "deleted or repealed note")):
+        if f[name]:
+            return "not_provision", reason
+    if (f["strong_deontic"] and f["words"] >= 12 and not f["part_heading"] and not f["publication"]
+            and not f["definition"] and not f["lead_in"]):
+        return "provision", "binding language"
+    return "", ""
+
+def explanation(reason):
+    return f"Rule-based pre-filter: {reason}"
+
+def evaluate(labelled_csv):
+    # Compare the rules with the labels of an existing filtered CSV (from
+    # provision_filter_llm.py). Only rows the rules decide count towards
+    # precision; recall is over all rows with that label.
+    df = pd.read_csv(labelled_csv)
+    df = df[df["label"].isin(["provision", "not_provision"])]
+    predicted = prefilter(df["text"])["label"]
+
+    decided = predicted != ""
+    print(f"\n{labelled_csv}: {len(df)} labelled paragraphs, "
+          f"{decided.sum()} decided locally ({round(100 * decided.mean(), 1)}%), "
+          f"{(~decided).sum()} left for the LLM")
+    for label in ["provision", "not_provision"]:
+        chosen = predicted == label
+        correct = chosen & (df["label"] == label)
+        precision = correct.sum() / chosen.sum() if chosen.sum() else 0.0
+        recall = correct.sum() / (df["label"] == label).sum()
+        print(f"  {label:14} precision {precision:.3f}  recall {recall:.3f}  ({chosen.sum()} predicted)")
+    accuracy = (predicted[decided] == df["label"][decided]).mean() if decided.any() else 0.0
+    print(f"  accuracy on decided rows {accuracy:.3f}")
+    return df[decided & (predicted != df["label"])]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check the rule-based pre-filter against labelled CSVs.")
+    parser.add_argument("labelled_csv", nargs="+", help="Filtered CSVs with a label column")
+    parser.add_argument("--show-errors", action="store_true", help="Print the paragraphs the rules got wrong")
+    args = parser.parse_args()
+
+    for path in args.labelled_csv:
+        errors = evaluate(path)
+        if args.show_errors:
+            for _, row in errors.iterrows():
+                print(f"    [{row['label']}] {row['text'][:120]}")
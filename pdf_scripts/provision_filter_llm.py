@@ -1,19 +1,22 @@
 import os
 import time
 import datetime
+import argparse
 import pandas as pd
-from dotenv import load_dotenv
-from openai import OpenAI
 import json
 
-# Load API key
-load_dotenv()
-client = OpenAI(api_key=os.getenv("api_key"))
+from result_cache import cache, make_key, add_cache_arguments, configure_from_args
+from engine import call_with_backoff
+from openai_batch import run_batch, add_batch_arguments
+from run_journal import RunJournal, DONE, FAILED, add_resume_arguments
+from pdf_scripts.prefilter import prefilter, explanation
+from openai_client import get_client
+from prompts import FILTER_INSTRUCTIONS
+from cascade import Cascade, ask_with_confidence, add_cascade_arguments
+from telemetry import telemetry, add_telemetry_arguments, write_from_args, metrics_path_for
+from result_store import act_name, add_store_arguments, store_from_args
 
-# Load extracted provisions
-df = pd.read_csv("outputs/provisions_from_spacing_3.csv")
-df["label"] = ""
-df["explanation"] = ""
+input_csv_path = "outputs/provisions_from_spacing_3.csv"
 
 # Define structured output schema
 schema = {
@@ -31,73 +34,226 @@ schema = {
     "additionalProperties": False
 }
 
-# Instructions for GPT
-instructions = (
-    "You are a legal assistant tasked with identifying whether a paragraph from a legal document "
-    "is a standalone legal provision.\n\n"
+# Instructions for GPT (see prompts.py)
+instructions = FILTER_INSTRUCTIONS
 
-    "Classify each paragraph as:\n"
-    "- \"provision\": if it establishes a legal rule, right, obligation, restriction, or process. "
-    "It must contain enforceable or actionable content.\n"
-    "- \"not_provision\": if it is a title, part heading, metadata, citation, date, or reference to other sections.\n\n"
+# Arguments for client.responses.create(), also used to build Batch API files
+def build_filter_request(text, model="gpt-4o"):
+    return dict(
+        model=model,
+        instructions=instructions,
+        input=text,
+        text={
+            "format": {
+                "type": "json_schema",
+                "name": "provision_filter",
+                "strict": True,
+                "schema": schema
+            }
+        },
+        temperature=0.2
+    )
 
-    "Here are examples:\n"
-    "1. 'PART III – GENERAL PROVISIONS' → not_provision\n"
-    "2. 'Section 3. A person shall not participate in a public assembly without notifying authorities.' → provision\n"
-    "3. '[Date of assent: June 13, 1950]' → not_provision\n\n"
+# Result cache key of the answer to a filter request
+def filter_cache_key(request):
+    return make_key(function="provision_filter", **request)
 
-    "Respond using the structured format."
-)
+# Ask the model whether a paragraph is a provision.
+# Returns a dict with "label" and "explanation". `delay` is a pause after each
+# API call for the serial loop; callers with their own rate limiter pass 0.
+def filter_paragraph(text, i=None, delay=1.2, model="gpt-4o"):
+    request = build_filter_request(text, model)
 
-# Classify each paragraph
-for i, row in df.iterrows():
-    text = row["text"]
-    print(f"Classifying paragraph {i}...")
-
-    try:
-        response = client.responses.create(
-            model="gpt-4o",
-            instructions=instructions,
-            input=text,
-            text={
-                "format": {
-                    "type": "json_schema",
-                    "name": "provision_filter",
-                    "strict": True,
-                    "schema": schema
-                }
-            },
-            temperature=0.2
-        )
+    def call():
+        start_time = time.time()
+        response = get_client().responses.create(**request)
+        telemetry.record_response(response, time.time() - start_time, stage="filter")
         print(f"Raw output at row {i}:\n{response.output}\n")
+        time.sleep(delay)  # Respect rate limits
 
-        
         # Safe parsing
         if response.output and response.output[0].content:
-            raw_text = response.output[0].content[0].text
-            parsed = json.loads(raw_text)
+            return response.output[0].content[0].text
+        raise ValueError("Empty response content")
+
+    with telemetry.stage("filter"):
+        return json.loads(cache.cached(call, function="provision_filter", **request))
 
+# Same, through a model cascade (see cascade.py): the cheaper tiers keep the
+# labels they are confident of, the rest go to the next model
+def filter_paragraph_cascade(text, cascade, i=None, delay=1.2):
+    with telemetry.stage("filter"):
+        return cascade.run(
+            lambda tier: ask_with_confidence(build_filter_request(text, tier.model), ["label"], "filter"),
+            lambda tier: filter_paragraph(text, i, delay, model=tier.model)
+        )
+
+# Label the rows the rule-based pre-filter is sure about and return the mask of
+# rows that still need the LLM
+def apply_prefilter(df, journal=None):
+    rules = prefilter(df["text"])
+    decided = rules["label"] != ""
+    if journal:
+        # Rows finished in an earlier run keep their journaled label
+        row_ids = df["id"] if "id" in df.columns else df.index.to_series()
+        decided &= ~row_ids.isin(journal.done_ids())
+    df.loc[decided, "label"] = rules.loc[decided, "label"]
+    df.loc[decided, "explanation"] = rules.loc[decided, "reason"].map(explanation)
+    if journal:
+        # tolist() gives plain ints, which the journal can serialise
+        for i, row_id in zip(df.index[decided].tolist(), row_ids[decided].tolist()):
+            journal.record(row_id, DONE, text=df.at[i, "text"], label=df.at[i, "label"],
+                           explanation=df.at[i, "explanation"])
+    print(f" Pre-filter labelled {decided.sum()} of {len(df)} paragraphs")
+    return ~decided
+
+# Classify each paragraph
+# With a journal, rows it already has as done are filled in from it and each new
+# result is recorded as soon as it is known. With use_prefilter, obvious
+# headings, notes and binding rules are labelled locally without an API call.
+# `delay` is the pause after each API call (see filter_paragraph). With a
+# cascade, paragraphs go through filter_paragraph_cascade.
+def filter_provisions(df, journal=None, use_prefilter=True, delay=1.2, cascade=None):
+    df["label"] = ""
+    df["explanation"] = ""
+    pending = apply_prefilter(df, journal) if use_prefilter else pd.Series(True, index=df.index)
+
+    for i, row in df[pending].iterrows():
+        text = row["text"]
+        row_id = row["id"] if "id" in df.columns else i
+
+        if journal and journal.is_done(row_id):
+            done = journal.records[row_id]
+            df.at[i, "label"] = done["label"]
+            df.at[i, "explanation"] = done["explanation"]
+            continue
+
+        print(f"Classifying paragraph {i}...")
+
+        try:
+            if cascade:
+                parsed = call_with_backoff(lambda text: filter_paragraph_cascade(text, cascade, i, delay), text,
+                                           stage="filter")
+            else:
+                parsed = call_with_backoff(lambda text: filter_paragraph(text, i, delay), text, stage="filter")
             df.at[i, "label"] = parsed.get("label", "")
             df.at[i, "explanation"] = parsed.get("explanation", "")
+            if journal:
+                journal.record(row_id, DONE, text=text, label=df.at[i, "label"],
+                               explanation=df.at[i, "explanation"])
+
+        except Exception as e:
+            print(f"Error at row {i}: {e}")
+            df.at[i, "label"] = ""
+            df.at[i, "explanation"] = f"FAILED: {e}"
+            if journal:
+                journal.record(row_id, FAILED, text=text, error=str(e))
+
+    return df
+
+# Same as filter_provisions, but sent as one Batch API job. Rows already in
+# the journal or the cache are not submitted.
+def filter_provisions_batch(df, journal=None, poll_interval=30, use_prefilter=True):
+    df["label"] = ""
+    df["explanation"] = ""
+    pending = apply_prefilter(df, journal) if use_prefilter else pd.Series(True, index=df.index)
+    requests = {}
+    keys = {}
+    row_ids = {}
+
+    for i, row in df[pending].iterrows():
+        row_id = row["id"] if "id" in df.columns else i
+        request = build_filter_request(row["text"])
+        key = filter_cache_key(request)
+
+        if journal and journal.is_done(row_id):
+            parsed = journal.records[row_id]
+        else:
+            cached = cache.get(key)
+            parsed = json.loads(cached) if cached is not None else None
+        if parsed is not None:
+            df.at[i, "label"] = parsed["label"]
+            df.at[i, "explanation"] = parsed["explanation"]
+        else:
+            requests[str(row_id)] = request
+            keys[str(row_id)] = key
+            row_ids[str(row_id)] = (i, row_id)
+    print(f" {pending.sum() - len(requests)} paragraphs already done, {len(requests)} to submit")
+
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    outputs, errors = run_batch(get_client(), requests, "outputs/batches", f"filter_{timestamp}",
+                                poll_interval=poll_interval, stage="filter")
+
+    for custom_id, (i, row_id) in row_ids.items():
+        text = df.at[i, "text"]
+        try:
+            if custom_id not in outputs:
+                raise ValueError(errors.get(custom_id, "no result"))
+            parsed = json.loads(outputs[custom_id])
+            cache.put(keys[custom_id], outputs[custom_id])
+        except Exception as e:
+            print(f"Error at row {i}: {e}")
+            df.at[i, "explanation"] = f"FAILED: {e}"
+            if journal:
+                journal.record(row_id, FAILED, text=text, error=str(e))
+            continue
+        df.at[i, "label"] = parsed.get("label", "")
+        df.at[i, "explanation"] = parsed.get("explanation", "")
+        if journal:
+            journal.record(row_id, DONE, text=text, label=df.at[i, "label"], explanation=df.at[i, "explanation"])
+
+    return df
+
+def main():
+    parser = argparse.ArgumentParser(description="Label extracted paragraphs as provision / not_provision.")
+    parser.add_argument("input_csv", nargs="?", default=input_csv_path,
+                        help="CSV produced by extract_generic_provisions.py")
+    add_cache_arguments(parser)
+    add_resume_arguments(parser)
+    add_batch_arguments(parser)
+    parser.add_argument("--no-prefilter", action="store_true",
+                        help="Send every paragraph to the LLM, even the ones the rules can label")
+    add_cascade_arguments(parser)
+    add_store_arguments(parser)
+    add_telemetry_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+    if args.cascade and args.batch_api:
+        parser.error("--cascade can't be combined with --batch-api")
+    cascade = Cascade(args.cascade, "Filter cascade") if args.cascade else None
+
+    # Results go to a journal as they complete; the CSV is written next to it
+    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    journal_path = args.resume or f"outputs/filtered_provisions_{timestamp}.jsonl"
+
+    # Load extracted provisions
+    with RunJournal(journal_path) as journal:
+        if args.batch_api:
+            df = filter_provisions_batch(pd.read_csv(args.input_csv), journal, args.poll_interval,
+                                         use_prefilter=not args.no_prefilter)
         else:
-            raise ValueError("Empty response content")
-        
-    except Exception as e:
-        print(f"Error at row {i}: {e}")
-        df.at[i, "label"] = ""
-        df.at[i, "explanation"] = f"FAILED: {e}"
-
-    time.sleep(1.2)  # Respect rate limits
-
-# Save results to timestamped CSV
-timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-output_path = f"outputs/filtered_provisions_{timestamp}.csv"
-df.to_csv(output_path, index=False)
-print(f"\n Saved filtered provisions to: {output_path}")
-
-# Save retry list for failed rows
-failed = df[df["label"] == ""]
-if not failed.empty:
-    retry_path = f"outputs/retry_failed_provisions_{timestamp}.csv"
-    failed.to_csv(retry_path, index=False)
-    print(f" Saved retry file for {len(failed)} failed rows: {retry_path}")
\ No newline at end of file
+            df = filter_provisions(pd.read_csv(args.input_csv), journal, use_prefilter=not args.no_prefilter,
+                                   cascade=cascade)
+    print(f" Journal: {journal.summary()}")
+
+    # Save results to timestamped CSV
+    output_path = os.path.splitext(journal_path)[0] + ".csv"
+    df.to_csv(output_path, index=False)
+    print(f"\n Saved filtered provisions to: {output_path}")
+
+    # Save retry list for failed rows
+    failed = df[df["label"] == ""]
+    if not failed.empty:
+        retry_path = f"outputs/retry_failed_provisions_{timestamp}.csv"
+        failed.to_csv(retry_path, index=False)
+        print(f" Saved retry file for {len(failed)} failed rows: {retry_path}")
+        print(f" To retry only those rows: --resume {journal_path}")
+
+    store_from_args(args, output_path, act_name(args.input_csv), args.cascade or "gpt-4o")
+    if cascade:
+        cascade.report()
+    cache.report()
+    write_from_args(args, metrics_path_for(journal_path))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import re
+import json
+import argparse
+from dataclasses import dataclass, asdict
+from typing import Iterable, Iterator, Optional
+
+# Splits the text of an act into numbered sections. Each jurisdiction is a
+# profile: a regex for the section markers ("\n20 (1) ", "\n16. ") and one for
+# headings that close a section without opening a new one ("PART 4"). Both are
+# combined into a single token pattern, so the document is scanned once, left
+# to right, and every section runs from its marker to the next token. There is
+# no lazy ".*?" body to backtrack over, so the time stays linear in the length
+# of the act.
+
+@dataclass
+class Profile:
+    name: str
+    description: str
+    marker: str = ""         # regex with named groups number, section and (optional) subsection
+    stop: str = ""           # regex for headings that end the current section
+    format: str = "{number}. {text}"
+    min_length: int = 50     # shorter section texts are dropped
+    source: str = "text"     # "text": segment the PDF text; "spacing": paragraphs by layout
+
+@dataclass
+class Section:
+    number: str              # the marker as printed, e.g. "20 (1)"
+    section: str             # "20"
+    subsection: str          # "1", or "" for a whole section
+    start: int               # character offsets of the text in the document
+    end: int
+    text: str                # section text with line breaks joined
+    provision: str           # text formatted by the profile, as passed to the classifier
+
+    @property
+    def level(self):
+        return 2 if self.subsection else 1
+
+# "20(1)" for a subsection, "20" for a whole section, "" for an unnumbered
+# paragraph; how outputs record where a provision sits in the act
+def section_key(section):
+    if not section.section:
+        return ""
+    return f"{section.section}({section.subsection})" if section.subsection else section.section
+
+PROFILES = {}
+
+def register_profile(profile):
+    PROFILES[profile.name] = profile
+    return profile
+
+def get_profile(name):
+    if name not in PROFILES:
+        raise ValueError(f"Unknown segmentation profile {name!r}, choose from: {', '.join(PROFILES)}")
+    return PROFILES[name]
+
+register_profile(Profile(
+    name="kenya",
+    description="Kenyan acts: '16. (1) ...' sections and '(2) ...' subsections, PART I/II headings",
+    marker=(r"\n(?=\d{1,3}\.\s|\(\d{1,2}[A-Z]?\)\s)"
+            r"(?P<number>(?:(?P<section>\d{1,3})\.)?\s*(?:\((?P<subsection>\d{1,2}[A-Z]?)\))?)\s+"),
+    stop=r"PART\s+[IVXLC]+\b",
+    format="{number} {text}",
+))
+register_profile(Profile(
+    name="canada_en",
+    description="Canadian federal acts (English): '20 (1) ...' sections, PART n headings",
+    marker=r"\n(?P<number>(?P<section>\d{1,3})(?:\s*\((?P<subsection>\d{0,2})\))?)\s+",
+    stop=r"PART\s",
+))
+register_profile(Profile(
+    name="canada_fr",
+    description="Canadian federal acts (French): '20 (1) ...' articles, PARTIE n headings",
+    marker=r"\n(?P<number>(?P<section>\d{1,3})(?:\s*\((?P<subsection>\d{0,2})\))?)\s+",
+    stop=r"PARTIE\s",
+))
+register_profile(Profile(
+    name="generic",
+    description="Any layout: paragraphs split by vertical spacing (extract_generic_provisions.py)",
+    format="{text}",
+    min_length=0,
+    source="spacing",
+))
+
+# A token that the text ends in the middle of ("\n12(3", "PARTI") can still
+# change when the next page is appended, and none of the profiles has a
+# partial marker or heading longer than this. Tokens ending further than this
+# from the end of the text read so far are final.
+BOUNDARY_MARGIN = 16
+
+def token_pattern(profile):
+    parts = [f"(?P<marker>{profile.marker})"]
+    if profile.stop:
+        parts.append(f"(?P<stop>{profile.stop})")
+    return re.compile("|".join(parts))
+
+def make_section(profile, marker, body, start, current_section):
+    # marker: the marker's match, body: text up to the next token, start: its offset
+    stripped = body.strip()
+    text = " ".join(stripped.splitlines())
+    if len(text) <= profile.min_length:
+        return None
+    section = marker.group("section") or current_section or ""
+    subsection = marker.group("subsection") or ""
+    number = marker.group("number").strip()
+    offset = start + len(body) - len(body.lstrip())
+    return Section(number=number, section=section, subsection=subsection, start=offset,
+                   end=offset + len(stripped), text=text,
+                   provision=profile.format.format(number=number, text=text))
+
+def segment_pages(pages: Iterable[str], profile) -> Iterator[Section]:
+    # Streams sections from the page texts of a document, in order. Only the
+    # body of the open section is kept between pages.
+    pattern = token_pattern(profile)
+    window = ""
+    offset = 0               # document offset of window[0]
+    open_marker = None       # marker of the section being read
+    body_start = 0           # where its body starts in window
+    current_section = None   # last section number seen, for "(2)" subsection markers
+
+    def close(tokens):
+        nonlocal open_marker, body_start, current_section
+        for token in tokens:
+            if open_marker:
+                section = make_section(profile, open_marker, window[body_start:token.start()],
+                                       offset + body_start, current_section)
+                if section:
+                    yield section
+                current_section = open_marker.group("section") or current_section
+            open_marker = token if token.lastgroup == "marker" else None
+            body_start = token.end()
+
+    for text in pages:
+        window += text
+        tokens = []
+        for token in pattern.finditer(window):
+            if token.end() > len(window) - BOUNDARY_MARGIN:
+                break
+            tokens.append(token)
+        if not tokens:
+            continue
+        yield from close(tokens)
+
+        # Scanning resumes where the last final token ended, as it would on
+        # the whole document
+        window = window[body_start:]
+        offset += body_start
+        body_start = 0
+
+    # End of document: every remaining token is final and the open section
+    # runs to the end
+    yield from close(list(pattern.finditer(window)))
+    if open_marker:
+        section = make_section(profile, open_marker, window[body_start:], offset + body_start, current_section)
+        if section:
+            yield section
+
+def segment_text(text, profile="canada_en"):
+    profile = get_profile(profile) if isinstance(profile, str) else profile
+    return list(segment_pages([text], profile))
+
+def segment_paragraphs(paragraphs: Iterable[str], profile) -> Iterator[Section]:
+    # Layout-based profile: each paragraph is a section. Offsets refer to the
+    # paragraphs joined by newlines.
+    offset = 0
+    for text in paragraphs:
+        if len(text) > profile.min_length:
+            yield Section(number="", section="", subsection="", start=offset, end=offset + len(text),
+                          text=text, provision=profile.format.format(number="", text=text))
+        offset += len(text) + 1
+
+# Worker for page_pool: the text of pages [start, stop), one string per page
+def page_texts(pdf_path, start, stop):
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        return [doc[i].get_text() for i in range(start, stop)]
+
+def segment_pdf(pdf_path, profile="canada_en", workers: Optional[int] = 1) -> Iterator[Section]:
+    # Imported here so that segmenting plain text needs neither PDF library
+    from pdf_scripts.page_pool import iter_pages
+    profile = get_profile(profile) if isinstance(profile, str) else profile
+
+    if profile.source == "spacing":
+        from pdf_scripts.extract_generic_provisions import iter_provisions_by_spacing
+        yield from segment_paragraphs(iter_provisions_by_spacing(pdf_path, workers=workers), profile)
+        return
+
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        page_count = doc.page_count
+    yield from segment_pages(iter_pages(pdf_path, page_count, page_texts, workers, 16), profile)
+
+def add_profile_arguments(parser, default="canada_en"):
+    parser.add_argument("--profile", choices=sorted(PROFILES), default=default,
+                        help="Section numbering of the act's jurisdiction (generic: split by layout)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Split an act into numbered sections.")
+    parser.add_argument("pdf_path")
+    add_profile_arguments(parser)
+    parser.add_argument("--workers", type=int, default=1, help="Processes that read pages in parallel")
+    parser.add_argument("--json", action="store_true", help="Print one JSON object per section")
+    args = parser.parse_args()
+
+    count = 0
+    for section in segment_pdf(args.pdf_path, args.profile, args.workers):
+        count += 1
+        if args.json:
+            print(json.dumps(dict(asdict(section), level=section.level), ensure_ascii=False))
+        else:
+            print(f"{section.number or '-':10} L{section.level} [{section.start}:{section.end}] {section.text[:80]}")
+    if not args.json:
+        print(f"\n{count} sections ({args.profile})")
@@ -0,0 +1,127 @@
+import sys
+
+from matrix_index import load_matrix_index
+from classification import MATRIX_PATH, ENTRY_ID_INSTRUCTIONS
+
+# Prompt templates for every model call. OpenAI caches prompt prefixes: once a
+# request starts with the same 1024+ tokens as a recent one, that prefix is
+# read from cache (cheaper input tokens and lower latency, reported as
+# usage.input_tokens_details.cached_tokens). Only a byte-identical prefix
+# counts, so every template puts its static content first (instructions, the
+# matrix, examples, the output rules), always rendered the same way, and the
+# provision last. Nothing variable (provision, numbering, retrieved excerpt)
+# may appear before the end of the static part.
+#
+# The `instructions` of a request are sent ahead of its `input`, so the static
+# part goes in `instructions` and the provision in `input`. The prompts that
+# carry the whole matrix are long enough to be cached; they also set a
+# prompt_cache_key, which keeps requests sharing the prefix on the same cache.
+# The filter and file_search instructions are under 1024 tokens, and
+# file_search results are added after the input, so those calls only gain
+# from the stable layout once the instructions grow.
+#
+# With --top-k the matrix excerpt depends on the provision, so it comes after
+# the static instructions, which are too short to be cached on their own: the
+# full matrix (cached) or an excerpt (fewer tokens) is a trade-off to measure
+# on the cached-token ratio telemetry reports.
+
+CLASSIFY_CACHE_KEY = "cso-classify"
+PACKED_CACHE_KEY = "cso-classify-packed"
+
+# The CSO Matrix typology with each entry prefixed by its ID, which is what
+# the classifiers answer with
+def matrix_typology(matrix_path=MATRIX_PATH):
+    index = load_matrix_index(matrix_path)
+    return index.render(index.entries, ids=True)
+
+CLASSIFY_INSTRUCTIONS = (
+    "You are a legal classification assistant trained in civil society regulation. "
+    "Do not speculate beyond the matrix provided.\n\n"
+    "Classify the provision using the CSO Regulatory Regime Matrix. "
+    "Find the closest matching concept. If no exact match exists, choose the conceptually closest category.\n\n"
+    "Classify the provision as either:\n"
+    "- Restrictive: if it imposes barriers or burdens on CSO activity.\n"
+    "- Permissive: if it enables, supports, or simplifies CSO activity.\n\n"
+    "Assign the provision to one of the four CSO Matrix subgroups: Formation, Governance, Operations, Resources.\n"
+    "Once assigned, do not change the category.\n\n"
+    "Answer with the ID of the closest matrix entry (the label before each entry, e.g. GOVERNANCE-R1), "
+    "the subgroup, the type, and a brief legal reasoning and justification based on the matrix."
+)
+
+def classify_prompt(provision_text, excerpt=None, matrix_path=MATRIX_PATH):
+    # (instructions, input) for one provision: the whole matrix in the
+    # instructions, or, with an excerpt, the excerpt at the head of the input
+    if excerpt is None:
+        instructions = f"{CLASSIFY_INSTRUCTIONS}\n\nCSO Regulatory Regime Matrix:\n\n{matrix_typology(matrix_path)}"
+        return instructions, f"Provision:\n{provision_text}"
+    return CLASSIFY_INSTRUCTIONS, (f"CSO Regulatory Regime Matrix (closest entries):\n\n{excerpt}\n\n"
+                                   f"Provision:\n{provision_text}")
+
+PACKED_INSTRUCTIONS = (
+    "You are a legal classification assistant trained in civil society regulation. "
+    "Do not speculate beyond the matrix provided.\n\n"
+    "Classify each numbered provision using the CSO Regulatory Regime Matrix below. "
+    "Find the closest matching concept. If no exact match exists, choose the conceptually closest category.\n\n"
+    "Classify each provision as either:\n"
+    "- Restrictive: if it imposes barriers or burdens on CSO activity.\n"
+    "- Permissive: if it enables, supports, or simplifies CSO activity.\n\n"
+    "Assign each provision to one of the four CSO Matrix subgroups: Formation, Governance, Operations, Resources.\n\n"
+    "Return exactly one classification per provision, in order, with \"index\" set to the provision's number "
+    "and \"matrix_entry\" set to the ID of the closest matrix entry (the label before each entry)."
+)
+
+def packed_prompt(provisions, matrix_path=MATRIX_PATH):
+    # (instructions, input) for several provisions, numbered from 1
+    instructions = f"{PACKED_INSTRUCTIONS}\n\nCSO Regulatory Regime Matrix:\n\n{matrix_typology(matrix_path)}"
+    return instructions, "\n\n".join(f"[{i}] {text}" for i, text in enumerate(provisions, 1))
+
+# Classifier with the matrix in a vector store (classifier.classify_provision_with_file_search,
+# used by main.py and pdf_scripts/batch_classifier.py)
+BATCH_FILE_SEARCH_INSTRUCTIONS = (
+    "You are a legal classification assistant trained in civil society organizations (CSO) regulation.\n"
+    "Use the File Search tool to read the uploaded CSO Matrix.\n"
+    "Find the closest matching matrix concept for the following provision.\n\n"
+
+    "Classify the provision as either:\n"
+    "- Restrictive: if it imposes barriers or burdens on CSO activity.\n"
+    "- Permissive: if it enables, supports, or simplifies CSO activity.\n\n"
+
+    "Assign the provision to one of the four CSO Matrix subgroups: Formation, Governance, Operations, Resources.\n"
+    "Once assigned, do not change the category.\n\n"
+
+    + ENTRY_ID_INSTRUCTIONS + "\n"
+    "Explain your choice with brief legal reasoning and justification based on the matrix."
+)
+
+# Provision filter (pdf_scripts/provision_filter_llm.py); the paragraph is the whole input
+FILTER_INSTRUCTIONS = (
+    "You are a legal assistant tasked with identifying whether a paragraph from a legal document "
+    "is a standalone legal provision.\n\n"
+
+    "Classify each paragraph as:\n"
+    "- \"provision\": if it establishes a legal rule, right, obligation, restriction, or process. "
+    "It must contain enforceable or actionable content.\n"
+    "- \"not_provision\": if it is a title, part heading, metadata, citation, date, or reference to other sections.\n\n"
+
+    "Here are examples:\n"
+    "1. 'PART III – GENERAL PROVISIONS' → not_provision\n"
+    "2. 'Section 3. A person shall not participate in a public assembly without notifying authorities.' → provision\n"
+    "3. '[Date of assent: June 13, 1950]' → not_provision\n\n"
+
+    "Respond using the structured format."
+)
+
+if __name__ == "__main__":
+    # Print a template's static prefix, e.g. to check it doesn't change between runs
+    from engine import estimate_tokens
+    prefixes = {
+        "classify": classify_prompt("")[0],
+        "packed": packed_prompt([])[0],
+        "batch_file_search": BATCH_FILE_SEARCH_INSTRUCTIONS,
+        "filter": FILTER_INSTRUCTIONS,
+    }
+    if len(sys.argv) > 1:
+        print(prefixes[sys.argv[1]])
+    else:
+        for name, prefix in prefixes.items():
+            print(f"{name:18} ~{estimate_tokens(prefix)} tokens of static prefix")
@@ -0,0 +1,175 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import argparse
+import functools
+import threading
+
+# On-disk cache of model outputs, keyed by a hash of everything that can change
+# the answer (model, instructions, matrix version, temperature, input text).
+# Re-running a pipeline therefore only pays for provisions it hasn't seen.
+DEFAULT_PATH = ".cache/llm_results.sqlite"
+DEFAULT_MAX_ENTRIES = 200000
+DEFAULT_MAX_AGE_DAYS = 180
+
+@functools.lru_cache(maxsize=None)
+def file_version(path):
+    # Content hash of a file, e.g. the CSO matrix, so edits invalidate entries
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:16]
+
+def make_key(**parts):
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+class ResultCache:
+    def __init__(self, path=DEFAULT_PATH, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_age_days=DEFAULT_MAX_AGE_DAYS, enabled=True, refresh=False):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.enabled = enabled
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(self.path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                " key TEXT PRIMARY KEY,"
+                " value TEXT NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+            self._evict()
+        return self.conn
+
+    def get(self, key, count_miss=True):
+        # count_miss=False for a look-ahead whose misses go on to cached(),
+        # which counts them
+        if not self.enabled or self.refresh:
+            return None
+        with self.lock:
+            conn = self._connect()
+            row = conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += count_miss
+                return None
+            self.hits += 1
+            conn.execute("UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.commit()
+            return row[0]
+
+    def put(self, key, value):
+        if not self.enabled:
+            return
+        now = time.time()
+        with self.lock:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, created_at, last_used) VALUES (?, ?, ?, ?)",
+                (key, value, now, now)
+            )
+            conn.commit()
+            self.writes += 1
+            if self.writes % 1000 == 0:
+                self._evict()
+
+    def cached(self, compute, **parts):
+        # Return the stored value for `parts`, or call compute() and store it
+        key = make_key(**parts)
+        value = self.get(key)
+        if value is None:
+            if self.enabled and self.refresh:
+                self.misses += 1
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def _evict(self):
+        # Drop entries past the age limit, then the least recently used ones
+        # beyond the size limit. Callers hold the lock.
+        if self.max_age_days:
+            cutoff = time.time() - self.max_age_days * 86400
+            self.conn.execute("DELETE FROM results WHERE last_used < ?", (cutoff,))
+        if self.max_entries:
+            self.conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                " SELECT key FROM results ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        self.conn.commit()
+
+    def evict(self):
+        with self.lock:
+            self._connect()
+            self._evict()
+
+    def clear(self):
+        with self.lock:
+            conn = self._connect()
+            conn.execute("DELETE FROM results")
+            conn.commit()
+
+    def stats(self):
+        with self.lock:
+            conn = self._connect()
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(LENGTH(value)), 0) FROM results").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def report(self):
+        if not self.enabled:
+            return
+        s = self.stats()
+        print(f" Cache: {s['hits']} hits, {s['misses']} misses ({round(s['hit_rate'] * 100, 1)}% hit rate), "
+              f"{s['entries']} entries in {self.path}")
+
+# Shared cache used by the classifier scripts. The SQLite file is only opened
+# on first use.
+cache = ResultCache()
+
+def add_cache_arguments(parser):
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the result cache")
+    parser.add_argument("--refresh", action="store_true",
+                        help="Ignore cached results but store the fresh ones")
+
+def configure_from_args(args):
+    cache.enabled = not args.no_cache
+    cache.refresh = args.refresh
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect or maintain the LLM result cache.")
+    parser.add_argument("command", choices=["stats", "evict", "clear"])
+    parser.add_argument("--path", default=DEFAULT_PATH)
+    parser.add_argument("--max-entries", type=int, default=DEFAULT_MAX_ENTRIES)
+    parser.add_argument("--max-age-days", type=float, default=DEFAULT_MAX_AGE_DAYS)
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"No cache found at {args.path}")
+        sys.exit(0)
+
+    store = ResultCache(args.path, args.max_entries, args.max_age_days)
+    if args.command == "evict":
+        store.evict()
+    elif args.command == "clear":
+        store.clear()
+    print(json.dumps(store.stats(), indent=2))
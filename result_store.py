@@ -0,0 +1,379 @@
+import os
+import re
+import sys
+import json
+import glob
+import time
+import sqlite3
+import hashlib
+import argparse
+
+# Consolidated store of every classified provision, across acts and runs, in
+# one indexed SQLite file. The scripts still write their own JSON/JSONL/CSV
+# outputs; those are imported here once (python result_store.py import, or
+# --store on the scripts), parsed into columns, and from then on cross-act
+# questions are a single indexed query instead of re-reading and re-parsing
+# every file in outputs/.
+#
+#   python result_store.py import outputs/
+#   python result_store.py summary                     restrictive/permissive by subgroup, per act
+#   python result_store.py entries --act KenyaPBO      most matched matrix entries
+#   python result_store.py find --subgroup Resources --type Restrictive
+#   python result_store.py sql "SELECT act, COUNT(*) FROM current GROUP BY act"
+#
+# Each row is one provision of one run, keyed by act, section number and a
+# hash of the provision text (the same hash incremental.py aligns with). The
+# `current` table keeps, for each (act, section, hash), the classification from
+# the most recent run, so re-running an act does not count its provisions
+# twice; identical unnumbered paragraphs of one act count once. It is rebuilt
+# for an act on import, so queries never pay for picking the latest run.
+# Queries use `current` unless --all-runs is given.
+#
+# Importing a file again replaces its rows. Outputs from before structured
+# classification (fenced JSON with the matrix entry's text) are parsed too, and
+# the entry's ID is recovered from its text (matrix_index.find_by_text).
+
+DEFAULT_PATH = "outputs/results.sqlite"
+MATRIX_PATH = "data/cso-matrix.txt"
+# Parts of output file names that are not the act's name
+NAME_PREFIXES = ("classified_provisions_", "filtered_provisions_", "provisions_from_spacing_", "pipeline_",
+                 "incremental_")
+TIMESTAMP = re.compile(r"_?\d{8}_\d{6}$")
+JSON_OBJECT = re.compile(r"\{.*\}", re.DOTALL)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,     -- output file name without extension
+    act TEXT NOT NULL,
+    source TEXT NOT NULL,        -- path of the imported file
+    kind TEXT NOT NULL,          -- journal | classified | filtered
+    model TEXT,
+    created_at REAL NOT NULL,    -- when the run wrote the file
+    imported_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS provisions (
+    run_id TEXT NOT NULL REFERENCES runs (run_id),
+    position INTEGER NOT NULL,   -- ID of the provision within its run
+    act TEXT NOT NULL,
+    section TEXT NOT NULL DEFAULT '',
+    provision_hash TEXT NOT NULL,
+    provision TEXT NOT NULL,
+    status TEXT,                 -- done | failed
+    label TEXT,                  -- provision | not_provision, from the filter
+    matrix_entry TEXT,           -- e.g. GOVERNANCE-R1
+    subgroup TEXT,
+    type TEXT,
+    explanation TEXT,
+    model TEXT,
+    PRIMARY KEY (run_id, position)
+);
+CREATE INDEX IF NOT EXISTS provisions_act ON provisions (act, section, provision_hash);
+CREATE INDEX IF NOT EXISTS provisions_hash ON provisions (provision_hash);
+CREATE INDEX IF NOT EXISTS provisions_classification ON provisions (act, subgroup, type);
+CREATE INDEX IF NOT EXISTS provisions_entry ON provisions (matrix_entry);
+-- Latest classification of each (act, section, provision_hash), rebuilt for
+-- an act whenever one of its runs is imported
+CREATE TABLE IF NOT EXISTS current AS SELECT * FROM provisions WHERE 0;
+CREATE INDEX IF NOT EXISTS current_classification ON current (act, subgroup, type);
+CREATE INDEX IF NOT EXISTS current_entry ON current (matrix_entry);
+CREATE INDEX IF NOT EXISTS current_section ON current (act, section);
+"""
+
+COLUMNS = ("run_id, position, act, section, provision_hash, provision, status, label, matrix_entry, subgroup, "
+           "type, explanation, model")
+
+REFRESH_CURRENT = f"""
+    INSERT INTO current SELECT {COLUMNS} FROM (
+        SELECT p.*, ROW_NUMBER() OVER (
+            PARTITION BY p.section, p.provision_hash ORDER BY r.created_at DESC, p.run_id DESC) AS latest
+        FROM provisions p JOIN runs r USING (run_id)
+        WHERE p.act = ? AND p.subgroup IS NOT NULL
+    ) WHERE latest = 1"""
+
+def text_hash(text):
+    # Whitespace differences between extractions don't count as changes
+    return hashlib.sha256(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+def act_name(path):
+    # "outputs/pipeline_KenyaPBO_20250610_120000.jsonl" -> "KenyaPBO". Files
+    # named by timestamp only (batch_classifier.py, provision_filter_llm.py)
+    # don't say; import those with --act, or run the scripts with --store.
+    name = os.path.splitext(os.path.basename(path))[0]
+    for prefix in NAME_PREFIXES:
+        if name.startswith(prefix):
+            name = name[len(prefix):]
+            break
+    return TIMESTAMP.sub("", name) or "unknown"
+
+def parse_output(output, matrix_path=MATRIX_PATH):
+    # (matrix_entry, subgroup, type, explanation) of a classifier output: a
+    # Classification dict, or the fenced JSON text of older runs. None for
+    # errors and unparseable text.
+    if isinstance(output, str):
+        match = JSON_OBJECT.search(output)
+        try:
+            output = json.loads(match.group(0)) if match else None
+        except json.JSONDecodeError:
+            output = None
+    if not isinstance(output, dict) or not output.get("subgroup"):
+        return None
+    entry = output.get("matrix_entry")
+    if not entry and output.get("matched_matrix_provision"):
+        from matrix_index import load_matrix_index
+        found = load_matrix_index(matrix_path).find_by_text(output["matched_matrix_provision"])
+        entry = found.id if found else None
+    return entry, output.get("subgroup"), output.get("type"), output.get("explanation")
+
+def read_records(path):
+    # (kind, [record dicts]) from any output file the scripts write, or None
+    # for files that hold no provisions (metrics, change reports, batch files)
+    if path.endswith(".jsonl"):
+        from run_journal import load_journal
+        return "journal", sorted(load_journal(path).values(), key=lambda record: record["id"])
+    if path.endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if not isinstance(data, list) or not all(isinstance(item, dict) and "provision" in item for item in data):
+            return None
+        return "classified", [dict(item, id=i) for i, item in enumerate(data)]
+    if path.endswith(".csv"):
+        import pandas as pd
+        df = pd.read_csv(path, dtype=str, keep_default_na=False)
+        if "label" not in df.columns or "text" not in df.columns or not df["label"].str.strip().any():
+            return None  # extracted paragraphs the filter hasn't labelled yet
+        if "id" not in df.columns:
+            df["id"] = range(len(df))
+        return "filtered", df.to_dict("records")
+    return None
+
+class ResultStore:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.conn = None
+
+    def _connect(self):
+        if self.conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self.conn = sqlite3.connect(self.path)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.executescript(SCHEMA)
+        return self.conn
+
+    def import_file(self, path, act=None, model=None, run_id=None):
+        # Returns the number of provisions stored, or None for files that hold none
+        read = read_records(path)
+        if read is None:
+            return None
+        kind, records = read
+        act = act or act_name(path)
+        run_id = run_id or os.path.splitext(os.path.basename(path))[0]
+
+        rows = []
+        for record in records:
+            text = record.get("provision") or record.get("text") or ""
+            if not text:
+                continue
+            classification = parse_output(record["output"]) if "output" in record else None
+            entry, subgroup, type_, explanation = classification or (None, None, None, record.get("explanation"))
+            rows.append((run_id, int(record["id"]), act, str(record.get("section") or ""), text_hash(text), text,
+                         record.get("status"), record.get("label") or None, entry, subgroup, type_,
+                         explanation or None, model))
+
+        conn = self._connect()
+        with conn:
+            # A run imported again under another act name leaves the old act too
+            previous = conn.execute("SELECT act FROM runs WHERE run_id = ?", (run_id,)).fetchone()
+            conn.execute("DELETE FROM provisions WHERE run_id = ?", (run_id,))
+            conn.execute("INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?, ?, ?)",
+                         (run_id, act, path, kind, model, os.path.getmtime(path), time.time()))
+            conn.executemany("INSERT OR REPLACE INTO provisions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            for name in {act, previous[0] if previous else act}:
+                self._refresh_current(conn, name)
+        return len(rows)
+
+    def _refresh_current(self, conn, act):
+        conn.execute("DELETE FROM current WHERE act = ?", (act,))
+        conn.execute(REFRESH_CURRENT, (act,))
+
+    def refresh_current(self):
+        # Rebuild `current` for every act, e.g. after editing rows by hand
+        conn = self._connect()
+        with conn:
+            for (act,) in conn.execute("SELECT DISTINCT act FROM provisions").fetchall():
+                self._refresh_current(conn, act)
+
+    def import_paths(self, paths, act=None, model=None):
+        # Files and directories (their top-level output files). A run's final
+        # .json or .csv is preferred over its journal: the classifier's journal
+        # lacks reused near-duplicates.
+        files = []
+        for path in paths:
+            if os.path.isdir(path):
+                files += sorted(glob.glob(os.path.join(path, "*.json*")) + glob.glob(os.path.join(path, "*.csv")))
+            else:
+                files.append(path)
+        stems = {os.path.splitext(f)[0] for f in files if f.endswith((".json", ".csv"))}
+        imported = {}
+        for path in files:
+            if path.endswith(".jsonl") and os.path.splitext(path)[0] in stems:
+                continue
+            count = self.import_file(path, act, model)
+            if count is not None:
+                imported[path] = count
+        return imported
+
+    def query(self, sql, params=()):
+        # (column names, rows)
+        cursor = self._connect().execute(sql, params)
+        return [column[0] for column in cursor.description or []], cursor.fetchall()
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+# Queries for the CLI; {table} is `current` or `provisions` (--all-runs)
+
+def summary_query(table, where):
+    return f"""
+        SELECT act, subgroup,
+               SUM(type = 'Restrictive') AS restrictive,
+               SUM(type = 'Permissive') AS permissive,
+               COUNT(*) AS total
+        FROM {table} WHERE subgroup IS NOT NULL{where}
+        GROUP BY act, subgroup ORDER BY act, subgroup"""
+
+def entries_query(table, where, limit):
+    return f"""
+        SELECT matrix_entry, COUNT(*) AS provisions, COUNT(DISTINCT act) AS acts
+        FROM {table} WHERE matrix_entry IS NOT NULL{where}
+        GROUP BY matrix_entry ORDER BY provisions DESC, matrix_entry LIMIT {int(limit)}"""
+
+def find_query(table, where, limit):
+    return f"""
+        SELECT act, section, run_id, position, matrix_entry, subgroup, type, substr(provision, 1, 100) AS provision
+        FROM {table} WHERE 1 = 1{where}
+        ORDER BY act, run_id, position LIMIT {int(limit)}"""
+
+ACTS_QUERY = """
+    WITH stored AS (SELECT act, COUNT(*) AS n FROM provisions GROUP BY act),
+         classified AS (SELECT act, COUNT(*) AS n FROM current GROUP BY act)
+    SELECT r.act, COUNT(*) AS runs, COALESCE(stored.n, 0) AS stored, COALESCE(classified.n, 0) AS classified,
+           datetime(MAX(r.created_at), 'unixepoch', 'localtime') AS last_run
+    FROM runs r LEFT JOIN stored USING (act) LEFT JOIN classified USING (act)
+    GROUP BY r.act ORDER BY r.act"""
+
+def filters(args):
+    # WHERE clauses and parameters for the --act/--subgroup/... options
+    clauses, params = [], []
+    for column, value in (("act", args.act), ("subgroup", args.subgroup), ("type", args.type),
+                          ("matrix_entry", args.entry), ("section", args.section)):
+        if value:
+            clauses.append(f" AND {column} = ?")
+            params.append(value)
+    if args.text:
+        clauses.append(" AND provision LIKE ?")
+        params.append(f"%{args.text}%")
+    return "".join(clauses), params
+
+def print_table(columns, rows):
+    if not rows:
+        print("No results")
+        return
+    widths = [max(len(str(column)), *(len(str(row[i])) for row in rows)) for i, column in enumerate(columns)]
+    print("  ".join(str(column).ljust(width) for column, width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(("" if value is None else str(value)).ljust(width) for value, width in zip(row, widths)))
+
+def add_store_arguments(parser):
+    parser.add_argument("--store", nargs="?", const=DEFAULT_PATH, metavar="PATH",
+                        help=f"Also add the results to the result store (default {DEFAULT_PATH})")
+
+def store_from_args(args, path, act, model=None):
+    # Import a script's finished output into the store given by --store
+    if not args.store:
+        return
+    store = ResultStore(args.store)
+    count = store.import_file(path, act=act, model=model)
+    store.close()
+    if count is None:
+        print(f" {path} holds no provisions, nothing added to {args.store}")
+    else:
+        print(f" Added {count} provisions of {act} to {args.store}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Import classifier outputs into one store and query them.")
+    parser.add_argument("--path", default=DEFAULT_PATH, help="Store file")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    importer = commands.add_parser("import", help="Import output files (JSON, JSONL journals, filter CSVs)")
+    importer.add_argument("paths", nargs="*", default=["outputs"], help="Files or directories (default: outputs)")
+    importer.add_argument("--act", help="Act name (default: from each file name)")
+    importer.add_argument("--model", help="Model that produced the results, if known")
+
+    commands.add_parser("acts", help="Acts in the store, with their runs and provision counts")
+    for name, help_text in (("summary", "Restrictive and permissive provisions by subgroup, per act"),
+                            ("entries", "Most matched matrix entries"),
+                            ("find", "List provisions")):
+        command = commands.add_parser(name, help=help_text)
+        command.add_argument("--act")
+        command.add_argument("--subgroup", choices=["Formation", "Governance", "Operations", "Resources"])
+        command.add_argument("--type", choices=["Restrictive", "Permissive"])
+        command.add_argument("--entry", help="Matrix entry ID, e.g. GOVERNANCE-R1")
+        command.add_argument("--section", help="Section number, e.g. 5(2)")
+        command.add_argument("--text", help="Only provisions containing this text")
+        command.add_argument("--limit", type=int, default=50)
+        command.add_argument("--all-runs", action="store_true",
+                             help="Count every run's rows, not only the latest classification of each provision")
+    sql = commands.add_parser("sql", help="Run a read-only SQL query (tables: runs, provisions, current)")
+    sql.add_argument("query")
+    for command in commands.choices.values():
+        command.add_argument("--json", action="store_true", help="Print the rows as JSON")
+    args = parser.parse_args()
+
+    if args.command != "import" and not os.path.exists(args.path):
+        print(f"No store found at {args.path}; run `python result_store.py import` first")
+        return 1
+    store = ResultStore(args.path)
+
+    if args.command == "import":
+        start = time.perf_counter()
+        imported = store.import_paths(args.paths, args.act, args.model)
+        for path, count in imported.items():
+            print(f" {count:6} provisions from {path}")
+        print(f" Imported {sum(imported.values())} provisions from {len(imported)} files into {args.path} "
+              f"in {time.perf_counter() - start:.2f}s")
+        return 0
+
+    if args.command == "acts":
+        sql_text, params = ACTS_QUERY, []
+    elif args.command == "sql":
+        # Opened read-only, so an ad-hoc query can't change the store
+        store.conn = sqlite3.connect(f"file:{args.path}?mode=ro", uri=True)
+        sql_text, params = args.query, []
+    else:
+        table = "provisions" if args.all_runs else "current"
+        where, params = filters(args)
+        if args.command == "summary":
+            sql_text = summary_query(table, where)
+        elif args.command == "entries":
+            sql_text = entries_query(table, where, args.limit)
+        else:
+            sql_text = find_query(table, where, args.limit)
+
+    start = time.perf_counter()
+    try:
+        columns, rows = store.query(sql_text, params)
+    except sqlite3.Error as e:
+        print(f"Query failed: {e}")
+        return 1
+    elapsed = (time.perf_counter() - start) * 1000
+    if args.json:
+        print(json.dumps([dict(zip(columns, row)) for row in rows], indent=2, ensure_ascii=False))
+    else:
+        print_table(columns, rows)
+        print(f"\n {len(rows)} rows in {elapsed:.1f} ms")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+import os
+import json
+import time
+import threading
+
+# Append-only JSON Lines journal of a batch run. Every provision gets one line
+# with its ID, a status ("done" or "failed") and its result, so a crashed or
+# interrupted run can be resumed: completed IDs are skipped, failed and missing
+# ones are run again. Lines are buffered and written in batches, then fsync'ed,
+# so the journal costs one disk write per batch rather than per provision.
+
+DONE = "done"
+FAILED = "failed"
+
+def load_journal(path):
+    # Latest record per ID, without opening the journal for writing. A line
+    # cut short by a crash is ignored.
+    records = {}
+    if not os.path.exists(path):
+        return records
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if "id" in record and "status" in record:
+                records[record["id"]] = record
+    return records
+
+class RunJournal:
+    def __init__(self, path, flush_every=50, flush_interval=5.0):
+        self.path = path
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self.records = load_journal(path)
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+        if self._ends_mid_line():
+            # Finish a line left half-written by a crash so new records start clean
+            self.file.write("\n")
+
+    def _ends_mid_line(self):
+        if not os.path.getsize(self.path):
+            return False
+        with open(self.path, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b"\n"
+
+    def is_done(self, record_id):
+        record = self.records.get(record_id)
+        return record is not None and record["status"] == DONE
+
+    def done_ids(self):
+        return {record_id for record_id, record in self.records.items() if record["status"] == DONE}
+
+    def failed_ids(self):
+        return {record_id for record_id, record in self.records.items() if record["status"] == FAILED}
+
+    def record(self, record_id, status, **fields):
+        record = {"id": record_id, "status": status, **fields}
+        with self.lock:
+            self.records[record_id] = record
+            self.buffer.append(json.dumps(record, ensure_ascii=False))
+            if len(self.buffer) >= self.flush_every or time.monotonic() - self.last_flush >= self.flush_interval:
+                self._flush()
+        return record
+
+    def _flush(self):
+        if self.buffer:
+            self.file.write("\n".join(self.buffer) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.buffer = []
+        self.last_flush = time.monotonic()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # Also runs on Ctrl-C, so buffered results are never lost
+        self.close()
+
+    def summary(self):
+        done = len(self.done_ids())
+        failed = len(self.failed_ids())
+        return f"{done} done, {failed} failed ({self.path})"
+
+def add_resume_arguments(parser):
+    parser.add_argument("--resume", metavar="JOURNAL",
+                        help="Continue the run recorded in JOURNAL: skip finished provisions, retry the rest")
@@ -0,0 +1,363 @@
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from engine import RateLimiter, call_with_backoff, estimate_tokens
+from result_cache import cache, add_cache_arguments, configure_from_args
+from telemetry import telemetry
+
+# Long-running local classification service, for tools that would otherwise
+# launch main.py once per provision. The OpenAI client, the matrix and the
+# prompts are loaded once at start-up and shared by every request, and the
+# result cache answers anything classified before.
+#
+#   python service.py --port 8080
+#   curl -s localhost:8080/classify -d '{"provision": "Every society shall keep a register of members."}'
+#   curl -s localhost:8080/filter -d '{"text": "PART III – GENERAL PROVISIONS"}'
+#
+# Endpoints:
+#   POST /classify  {"provision": "..."} or {"provisions": [...]}, optional "top_k"
+#   POST /filter    {"text": "..."} or {"texts": [...]}
+#   GET  /health    status, uptime, matrix version, requests waiting
+#   GET  /metrics   run telemetry and service counters in Prometheus text format
+#                   (/metrics?format=json for JSON)
+#
+# Classification requests that arrive within --window of each other are
+# coalesced into one packed call (classifier.classify_provisions_packed), up to
+# --max-batch provisions: the matrix is sent once for the whole batch instead
+# of once per caller. With top_k the prompt depends on the provision, so those
+# are classified one at a time. Identical texts already waiting share one
+# answer. The classifier functions are blocking, so requests are served on
+# threads (like benchmarks/fake_llm.py) and the API calls share one rate limiter.
+
+DEFAULT_PORT = 8080
+DEFAULT_WINDOW = 0.05   # seconds to wait for more requests to join a batch
+DEFAULT_MAX_BATCH = 10
+MAX_BODY_BYTES = 1 << 20
+MAX_TEXTS = 100         # provisions or paragraphs per request
+REQUEST_TIMEOUT = 600   # seconds a request waits for its answer
+
+class BadRequest(ValueError):
+    pass
+
+class Coalescer:
+    # Collects submitted items and hands them to handle(items) -> results in
+    # batches: a batch closes `window` seconds after its first item or when it
+    # has max_batch items. Batches run on `workers` threads.
+    def __init__(self, handle, window=DEFAULT_WINDOW, max_batch=DEFAULT_MAX_BATCH, workers=4, name="batch"):
+        self.handle = handle
+        self.window = window
+        self.max_batch = max_batch
+        self.name = name
+        self.condition = threading.Condition()
+        self.queue = []      # items waiting for a batch, in arrival order
+        self.waiting = {}    # item -> Future, for items queued or in a running batch
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self.stats = {"submitted": 0, "shared": 0, "batches": 0, "batched_items": 0, "largest_batch": 0}
+        threading.Thread(target=self._collect, daemon=True).start()
+
+    def submit(self, item):
+        with self.condition:
+            self.stats["submitted"] += 1
+            future = self.waiting.get(item)
+            if future is not None:
+                self.stats["shared"] += 1
+                return future
+            future = self.waiting[item] = Future()
+            self.queue.append(item)
+            self.condition.notify()
+            return future
+
+    def pending(self):
+        with self.condition:
+            return len(self.waiting)
+
+    def _collect(self):
+        while True:
+            with self.condition:
+                while not self.queue:
+                    self.condition.wait()
+                deadline = time.monotonic() + self.window
+                while len(self.queue) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+                batch = self.queue[:self.max_batch]
+                del self.queue[:self.max_batch]
+                self.stats["batches"] += 1
+                self.stats["batched_items"] += len(batch)
+                self.stats["largest_batch"] = max(self.stats["largest_batch"], len(batch))
+            self.pool.submit(self._run, batch)
+
+    def _run(self, batch):
+        try:
+            results = self.handle(batch)
+        except Exception as e:
+            results = None
+            error = e
+        with self.condition:
+            futures = [self.waiting.pop(item) for item in batch]
+        for future, item, result in zip(futures, batch, results or [None] * len(batch)):
+            if results is None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    def summary(self):
+        with self.condition:
+            stats = dict(self.stats, waiting=len(self.waiting))
+        stats["mean_batch"] = round(stats["batched_items"] / stats["batches"], 2) if stats["batches"] else None
+        return stats
+
+def answered(result):
+    # A Future that already holds its result
+    future = Future()
+    future.set_result(result)
+    return future
+
+class ClassificationService:
+    def __init__(self, window=DEFAULT_WINDOW, max_batch=DEFAULT_MAX_BATCH, workers=4, requests_per_minute=500,
+                 tokens_per_minute=200000, top_k=None, use_prefilter=True):
+        self.top_k = top_k
+        self.use_prefilter = use_prefilter
+        self.started = time.time()
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.lock = threading.Lock()
+        self.counts = {}     # (endpoint, status) -> responses
+        self.packed = Coalescer(self._classify_packed, window, max_batch, workers, "classify")
+        self.single = Coalescer(self._classify_single, 0, 1, workers, "classify_top_k")
+        self.filters = Coalescer(self._filter, 0, 1, workers, "filter")
+
+    def warm_up(self):
+        # Everything a first request would otherwise pay for
+        from openai_client import get_client
+        from matrix_index import load_matrix_index
+        from prompts import packed_prompt
+        import classifier
+        import pdf_scripts.provision_filter_llm
+
+        get_client()
+        load_matrix_index(classifier.MATRIX_PATH)
+        packed_prompt([])
+        classifier.matrix_version()
+
+    # Every model call, retry and 429 pause goes through the service's shared
+    # limiter, which settles each reservation with the tokens really used:
+    # packs inside classify_provisions_packed, the rest through call_with_backoff
+
+    def _classify_packed(self, texts):
+        from classifier import classify_provisions_packed
+        # Retries and splitting of failed packs happen inside
+        return [c.to_dict() for c in classify_provisions_packed(texts, batch_size=len(texts), max_workers=1,
+                                                                limiter=self.limiter)]
+
+    def _classify_single(self, items):
+        from classifier import classify_provision
+        ((text, top_k),) = items
+        classify = lambda text: [classify_provision(text, top_k=top_k).to_dict()]
+        return call_with_backoff(classify, text, self.limiter, estimate_tokens(text, 600 + 120 * top_k),
+                                 stage="classify")
+
+    def _filter(self, texts):
+        from pdf_scripts.provision_filter_llm import filter_paragraph
+        (text,) = texts
+        return call_with_backoff(lambda text: [filter_paragraph(text, delay=0)], text, self.limiter,
+                                 estimate_tokens(text, 400), stage="filter")
+
+    # Answers known without a model call (the cache, the pre-filter rules) are
+    # returned before a request waits for a batch or takes from the limiter.
+    # A miss is counted by the handler that then looks the same key up.
+
+    def classify(self, texts, top_k=None):
+        from classifier import packed_cache_key, build_classify_request, classify_cache_key
+        from classification import parse_classification
+        top_k = top_k or self.top_k
+        futures = []
+        for text in texts:
+            if top_k:
+                cached = cache.get(classify_cache_key(build_classify_request(text, top_k)), count_miss=False)
+            else:
+                cached = cache.get(packed_cache_key(text), count_miss=False)
+            if cached is not None:
+                futures.append(answered(parse_classification(cached).to_dict()))
+            elif top_k:
+                futures.append(self.single.submit((text, top_k)))
+            else:
+                futures.append(self.packed.submit(text))
+        return [future.result(REQUEST_TIMEOUT) for future in futures]
+
+    def filter(self, texts):
+        from pdf_scripts.provision_filter_llm import build_filter_request, filter_cache_key
+        from pdf_scripts.prefilter import prefilter_text, explanation
+        futures = []
+        for text in texts:
+            label, reason = prefilter_text(text) if self.use_prefilter else (None, None)
+            cached = None if label else cache.get(filter_cache_key(build_filter_request(text)), count_miss=False)
+            if label:
+                futures.append(answered({"label": label, "explanation": explanation(reason)}))
+            elif cached is not None:
+                futures.append(answered(json.loads(cached)))
+            else:
+                futures.append(self.filters.submit(text))
+        return [future.result(REQUEST_TIMEOUT) for future in futures]
+
+    def count(self, endpoint, status):
+        with self.lock:
+            self.counts[(endpoint, status)] = self.counts.get((endpoint, status), 0) + 1
+
+    def health(self):
+        from classifier import matrix_version
+        return {
+            "status": "ok",
+            "uptime_seconds": round(time.time() - self.started, 1),
+            "matrix_version": matrix_version(),
+            "waiting": self.packed.pending() + self.single.pending() + self.filters.pending(),
+        }
+
+    def summary(self):
+        with self.lock:
+            responses = [{"endpoint": endpoint, "status": status, "count": n}
+                         for (endpoint, status), n in sorted(self.counts.items())]
+        return {
+            "responses": responses,
+            "coalescers": {c.name: c.summary() for c in (self.packed, self.single, self.filters)},
+            "cache": cache.stats() if cache.enabled else None,
+            "telemetry": telemetry.summary(),
+        }
+
+    def prometheus(self, prefix="cso"):
+        summary = self.summary()
+        lines = [f"# HELP {prefix}_service_responses_total Responses sent per endpoint and status",
+                 f"# TYPE {prefix}_service_responses_total counter"]
+        for r in summary["responses"]:
+            lines.append(f'{prefix}_service_responses_total{{endpoint="{r["endpoint"]}",status="{r["status"]}"}} '
+                         f'{r["count"]}')
+        for key, kind, help_text in (("submitted", "counter", "Items submitted for a model call"),
+                                     ("shared", "counter", "Items answered by an identical item already waiting"),
+                                     ("batches", "counter", "Model calls (or packs) made for the submitted items"),
+                                     ("batched_items", "counter", "Items sent in those batches"),
+                                     ("waiting", "gauge", "Items waiting for an answer")):
+            metric = f"{prefix}_service_{key}" + ("_total" if kind == "counter" else "")
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            for name, stats in summary["coalescers"].items():
+                lines.append(f'{metric}{{queue="{name}"}} {stats[key]}')
+        if summary["cache"]:
+            lines.append(f"# HELP {prefix}_service_cache_hit_rate Share of result cache lookups that hit")
+            lines.append(f"# TYPE {prefix}_service_cache_hit_rate gauge")
+            lines.append(f"{prefix}_service_cache_hit_rate {summary['cache']['hit_rate']}")
+        return "\n".join(lines) + "\n" + telemetry.prometheus(prefix)
+
+def texts_from(body, one, many):
+    # The text(s) of a request body: {"provision": "..."} or {"provisions": [...]}
+    if isinstance(body.get(one), str) and body[one].strip():
+        return [body[one]], True
+    texts = body.get(many)
+    if isinstance(texts, list) and texts and all(isinstance(t, str) and t.strip() for t in texts):
+        if len(texts) > MAX_TEXTS:
+            raise BadRequest(f"at most {MAX_TEXTS} {many} per request")
+        return texts, False
+    raise BadRequest(f'expected {{"{one}": "..."}} or {{"{many}": ["...", ...]}}')
+
+def make_handler(service):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def send(self, obj, status=200, content_type="application/json"):
+            body = obj.encode("utf-8") if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("content-type", content_type)
+            self.send_header("content-length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            service.count(self.path.split("?")[0], status)
+
+        def do_GET(self):
+            path, _, query = self.path.partition("?")
+            if path == "/health":
+                return self.send(service.health())
+            if path == "/metrics":
+                if "format=json" in query:
+                    return self.send(service.summary())
+                return self.send(service.prometheus(), content_type="text/plain; version=0.0.4")
+            self.send({"error": f"not found: {path}"}, 404)
+
+        def do_POST(self):
+            path = self.path.split("?")[0].rstrip("/")
+            if path not in ("/classify", "/filter"):
+                return self.send({"error": f"not found: {path}"}, 404)
+            try:
+                length = int(self.headers.get("content-length", 0))
+                if length > MAX_BODY_BYTES:
+                    raise BadRequest("request body too large")
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except json.JSONDecodeError as e:
+                    raise BadRequest(f"invalid JSON: {e}") from None
+                if not isinstance(body, dict):
+                    raise BadRequest("expected a JSON object")
+
+                if path == "/classify":
+                    texts, single = texts_from(body, "provision", "provisions")
+                    top_k = body.get("top_k")
+                    if top_k is not None and (not isinstance(top_k, int) or top_k < 1):
+                        raise BadRequest("top_k must be a positive integer")
+                    results = service.classify(texts, top_k)
+                    return self.send({"classification": results[0]} if single else {"classifications": results})
+
+                texts, single = texts_from(body, "text", "texts")
+                results = service.filter(texts)
+                return self.send(results[0] if single else {"results": results})
+            except BadRequest as e:
+                self.send({"error": str(e)}, 400)
+            except Exception as e:
+                print(f" Error on {path}: {e}")
+                self.send({"error": str(e)}, 502)
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the classifier and provision filter over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--window", type=float, default=DEFAULT_WINDOW,
+                        help="Seconds to wait for concurrent classify requests to join one packed call")
+    parser.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help="Provisions per packed call")
+    parser.add_argument("--workers", type=int, default=4, help="Model calls in flight per endpoint")
+    parser.add_argument("--rpm", type=int, default=500, help="Requests-per-minute budget")
+    parser.add_argument("--tpm", type=int, default=200000, help="Tokens-per-minute budget")
+    parser.add_argument("--top-k", type=int,
+                        help="Classify one provision at a time with the K closest matrix entries instead of "
+                             "packing requests with the whole matrix")
+    parser.add_argument("--no-prefilter", action="store_true",
+                        help="Send every paragraph to the LLM filter, even the ones the rules can label")
+    add_cache_arguments(parser)
+    args = parser.parse_args()
+    configure_from_args(args)
+
+    service = ClassificationService(args.window, args.max_batch, args.workers, args.rpm, args.tpm, args.top_k,
+                                    use_prefilter=not args.no_prefilter)
+    print("Loading the client and the matrix...")
+    service.warm_up()
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    server.daemon_threads = True
+    print(f"Serving on http://{args.host}:{server.server_address[1]} (/classify, /filter, /health, /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        print()
+        cache.report()
+        telemetry.report()
+        return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
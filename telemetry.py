@@ -0,0 +1,298 @@
+import os
+import json
+import time
+import datetime
+import threading
+import contextlib
+
+# Run metrics shared by every script: latency, rate-limiter wait, retries and
+# token usage of each API call, the estimated cost per model, and the time
+# spent in each stage (pdf_parse, filter, retrieval, classify). At the end of
+# a run they are written as a JSON summary and, optionally, in Prometheus text
+# format, to see where the time and money go on each act.
+#
+# Input tokens the API read from its prompt cache (prompts.py keeps the static
+# prefix of each prompt identical for this) are counted per stage and model,
+# and call latencies are split by whether the call hit the cache, so the
+# saving shows up in both cost and latency.
+
+# USD per million tokens: (input, cached input, output)
+PRICES = {
+    "gpt-4o": (2.50, 1.25, 10.00),
+    "gpt-4o-mini": (0.15, 0.075, 0.60),
+    "gpt-4.1": (2.00, 0.50, 8.00),
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+}
+FILE_SEARCH_PRICE = 2.50 / 1000  # USD per file_search tool call
+BATCH_DISCOUNT = 0.5             # Batch API requests cost half
+
+def price_of(model):
+    # Dated snapshots ("gpt-4o-2024-08-06") are priced like their base model
+    for name in sorted(PRICES, key=len, reverse=True):
+        if model == name or model.startswith(name + "-"):
+            return PRICES[name]
+    return None
+
+def field(obj, name, default=None):
+    # Read a field from an SDK object or from a plain dict (Batch API results)
+    if obj is None:
+        return default
+    if isinstance(obj, dict):
+        return obj.get(name, default)
+    return getattr(obj, name, default)
+
+def percentile(values, share):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+def cached_ratio(totals):
+    # Share of input tokens read from the prompt cache
+    if not totals["input_tokens"]:
+        return None
+    return round(totals["cached_tokens"] / totals["input_tokens"], 3)
+
+class Telemetry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.time()
+            self.stages = {}  # name -> {"count", "seconds", "latencies", "queue_wait", "retries", ...}
+            self.models = {}  # name -> {"calls", "input_tokens", "cached_tokens", "output_tokens", ...}
+
+    # Stages are tracked per thread: whatever runs inside `with telemetry.stage("filter")`
+    # is attributed to "filter", including the waits and retries in engine.py.
+    def current_stage(self):
+        stack = getattr(self.local, "stages", None)
+        return stack[-1] if stack else "other"
+
+    def _stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = {"count": 0, "seconds": 0.0, "calls": 0, "latencies": [], "queue_wait": 0.0,
+                                 "retries": 0, "errors": 0, "input_tokens": 0, "cached_tokens": 0,
+                                 "cached_latencies": [], "uncached_latencies": []}
+        return self.stages[name]
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        stack = self.local.__dict__.setdefault("stages", [])
+        if name in stack:
+            # Already inside this stage further up the call stack; timing it
+            # again would count the same seconds twice
+            yield
+            return
+        stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            stack.pop()
+            with self.lock:
+                entry = self._stage(name)
+                entry["count"] += 1
+                entry["seconds"] += duration
+
+    def timed_iter(self, name, iterable):
+        # Time spent producing each item (e.g. parsing PDF pages) counts
+        # towards `name`; time the consumer spends on it doesn't
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    # Tokens of the replies recorded on this thread so far. engine.py reads it
+    # before and after a call to settle the call's TPM reservation with what
+    # it really used (nothing for a cache hit).
+    def thread_tokens(self):
+        return getattr(self.local, "tokens", 0)
+
+    def record_response(self, response, latency=None, stage=None, batch=False):
+        # Token usage, file_search calls and cost of one Responses API reply
+        usage = field(response, "usage")
+        model = field(response, "model") or "unknown"
+        input_tokens = field(usage, "input_tokens", 0) or 0
+        output_tokens = field(usage, "output_tokens", 0) or 0
+        cached_tokens = field(field(usage, "input_tokens_details"), "cached_tokens", 0) or 0
+        searches = sum(1 for item in field(response, "output", []) or [] if field(item, "type") == "file_search_call")
+
+        cost = None
+        prices = price_of(model)
+        if prices:
+            input_price, cached_price, output_price = prices
+            cost = ((input_tokens - cached_tokens) * input_price + cached_tokens * cached_price
+                    + output_tokens * output_price) / 1e6
+            if batch:
+                cost *= BATCH_DISCOUNT
+            cost += searches * FILE_SEARCH_PRICE
+
+        self.local.tokens = self.thread_tokens() + input_tokens + output_tokens
+        with self.lock:
+            entry = self._stage(stage or self.current_stage())
+            entry["calls"] += 1
+            entry["input_tokens"] += input_tokens
+            entry["cached_tokens"] += cached_tokens
+            if latency is not None:
+                entry["latencies"].append(latency)
+                entry["cached_latencies" if cached_tokens else "uncached_latencies"].append(latency)
+            totals = self.models.setdefault(model, {"calls": 0, "batch_calls": 0, "input_tokens": 0,
+                                                    "cached_tokens": 0, "output_tokens": 0,
+                                                    "file_search_calls": 0, "cost_usd": 0.0, "priced": True})
+            totals["calls"] += 1
+            totals["batch_calls"] += batch
+            totals["input_tokens"] += input_tokens
+            totals["cached_tokens"] += cached_tokens
+            totals["output_tokens"] += output_tokens
+            totals["file_search_calls"] += searches
+            if cost is None:
+                totals["priced"] = False
+            else:
+                totals["cost_usd"] += cost
+
+    def record_wait(self, seconds):
+        # Time a call spent waiting for the rate limiter before it was sent
+        with self.lock:
+            self._stage(self.current_stage())["queue_wait"] += seconds
+
+    def record_retry(self):
+        with self.lock:
+            self._stage(self.current_stage())["retries"] += 1
+
+    def record_error(self):
+        with self.lock:
+            self._stage(self.current_stage())["errors"] += 1
+
+    def summary(self):
+        with self.lock:
+            stages = {}
+            for name, entry in self.stages.items():
+                latencies = entry["latencies"]
+                cached, uncached = entry["cached_latencies"], entry["uncached_latencies"]
+                stages[name] = {
+                    "count": entry["count"],
+                    "seconds": round(entry["seconds"], 3),
+                    "calls": entry["calls"],
+                    "latency_p50": round(percentile(latencies, 0.50), 3) if latencies else None,
+                    "latency_p95": round(percentile(latencies, 0.95), 3) if latencies else None,
+                    "latency_total": round(sum(latencies), 3),
+                    "queue_wait": round(entry["queue_wait"], 3),
+                    "retries": entry["retries"],
+                    "errors": entry["errors"],
+                    "input_tokens": entry["input_tokens"],
+                    "cached_tokens": entry["cached_tokens"],
+                    "cached_ratio": cached_ratio(entry),
+                    "cached_calls": len(cached),
+                    "latency_p50_cached": round(percentile(cached, 0.50), 3) if cached else None,
+                    "latency_p50_uncached": round(percentile(uncached, 0.50), 3) if uncached else None,
+                }
+            models = {name: dict(totals, cost_usd=round(totals["cost_usd"], 6), cached_ratio=cached_ratio(totals))
+                      for name, totals in self.models.items()}
+            return {
+                "started": self.started,
+                "wall_seconds": round(time.time() - self.started, 3),
+                "stages": stages,
+                "models": models,
+                "total_cost_usd": round(sum(totals["cost_usd"] for totals in self.models.values()), 6),
+            }
+
+    def prometheus(self, prefix="cso"):
+        summary = self.summary()
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{key}="{val}"' for key, val in labels.items())
+                lines.append(f"{prefix}_{name}{{{label_text}}} {value}")
+
+        stages = summary["stages"].items()
+        models = summary["models"].items()
+        metric("stage_seconds_total", "counter", "Time spent in each stage",
+               [({"stage": name}, s["seconds"]) for name, s in stages])
+        metric("stage_calls_total", "counter", "API calls made in each stage",
+               [({"stage": name}, s["calls"]) for name, s in stages])
+        metric("stage_queue_wait_seconds_total", "counter", "Time calls waited for the rate limiter",
+               [({"stage": name}, s["queue_wait"]) for name, s in stages])
+        metric("stage_retries_total", "counter", "Calls retried after a rate-limit or server error",
+               [({"stage": name}, s["retries"]) for name, s in stages])
+        metric("stage_errors_total", "counter", "Calls that failed after all retries",
+               [({"stage": name}, s["errors"]) for name, s in stages])
+        metric("call_latency_seconds", "summary", "API call latency",
+               [({"stage": name, "quantile": q}, s[key]) for name, s in stages
+                for q, key in (("0.5", "latency_p50"), ("0.95", "latency_p95")) if s[key] is not None])
+        metric("stage_tokens_total", "counter", "Input tokens sent in each stage, and how many were read from cache",
+               [({"stage": name, "kind": kind}, s[f"{kind}_tokens"]) for name, s in stages
+                for kind in ("input", "cached")])
+        metric("tokens_total", "counter", "Tokens used per model",
+               [({"model": name, "kind": kind}, m[f"{kind}_tokens"]) for name, m in models
+                for kind in ("input", "cached", "output")])
+        metric("cost_usd_total", "counter", "Estimated cost per model",
+               [({"model": name}, m["cost_usd"]) for name, m in models])
+        return "\n".join(lines) + "\n"
+
+    def write(self, path, prometheus_path=None):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+        if prometheus_path:
+            os.makedirs(os.path.dirname(prometheus_path) or ".", exist_ok=True)
+            with open(prometheus_path, "w", encoding="utf-8") as f:
+                f.write(self.prometheus())
+
+    def report(self):
+        summary = self.summary()
+        print(f"\n Run metrics ({summary['wall_seconds']}s wall time; stage times are summed over threads):")
+        for name, s in sorted(summary["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            line = f"   {name:10} {s['seconds']:>9.2f}s"
+            if s["calls"]:
+                line += f"  {s['calls']} calls"
+                if s["latency_p50"] is not None:
+                    line += f", p50 {s['latency_p50']}s, p95 {s['latency_p95']}s"
+                line += f", {s['queue_wait']:.2f}s waiting, {s['retries']} retries, {s['errors']} errors"
+                if s["cached_tokens"]:
+                    line += f", {s['cached_ratio']:.0%} of input tokens cached"
+                    if s["latency_p50_cached"] is not None and s["latency_p50_uncached"] is not None:
+                        line += (f" (p50 {s['latency_p50_cached']}s with a cache hit, "
+                                 f"{s['latency_p50_uncached']}s without)")
+            print(line)
+        for name, m in summary["models"].items():
+            cost = f"${m['cost_usd']:.4f}" if m["priced"] else "cost unknown"
+            cached = f", {m['cached_ratio']:.0%}" if m["cached_tokens"] else ""
+            print(f"   {name}: {m['calls']} calls, {m['input_tokens']} input ({m['cached_tokens']} cached{cached}), "
+                  f"{m['output_tokens']} output tokens, {cost}")
+        print(f"   Estimated total cost: ${summary['total_cost_usd']:.4f}")
+
+telemetry = Telemetry()
+
+def add_telemetry_arguments(parser):
+    parser.add_argument("--metrics", metavar="PATH", help="Write the run's metrics summary (JSON) to PATH")
+    parser.add_argument("--prometheus", metavar="PATH", help="Also write the metrics in Prometheus text format")
+
+def metrics_path_for(output_path):
+    # "<output>.metrics.json" next to a run's output; a resumed run gets its own file
+    path = os.path.splitext(output_path)[0] + ".metrics.json"
+    if os.path.exists(path):
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.splitext(output_path)[0] + f".metrics_{timestamp}.json"
+    return path
+
+def write_from_args(args, default_path=None):
+    # Print the run metrics and save them where the arguments (or the script) say
+    telemetry.report()
+    path = args.metrics or default_path
+    if path:
+        telemetry.write(path, args.prometheus)
+        print(f" Metrics saved to {path}" + (f" and {args.prometheus}" if args.prometheus else ""))
+    elif args.prometheus:
+        with open(args.prometheus, "w", encoding="utf-8") as f:
+            f.write(telemetry.prometheus())
@@ -0,0 +1,144 @@
+import os
+import json
+import time
+import argparse
+import threading
+
+from result_cache import file_version
+from engine import call_with_backoff
+
+# Remembers which OpenAI vector store holds which files, keyed by the files'
+# content hashes. The classifiers reuse a store while the files are unchanged
+# instead of creating and uploading a new one on every call.
+REGISTRY_PATH = ".cache/vector_stores.json"
+
+# Names the scripts have used for their stores, so cleanup can find orphans
+# created before the registry existed
+KNOWN_STORE_NAMES = {"CSO_Matrix_Vector_Store", "CSO_Matrix_Store", "CSO_Classification_Store"}
+
+_lock = threading.Lock()
+_verified = {}  # fingerprint -> store ID already checked in this process
+
+def fingerprint(paths):
+    return "-".join(file_version(path) for path in paths)
+
+def load_registry(path=REGISTRY_PATH):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def save_registry(registry, path=REGISTRY_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(registry, f, indent=2)
+    os.replace(tmp_path, path)
+
+def is_usable(client, vector_store_id):
+    import openai
+    try:
+        store = call_with_backoff(client.vector_stores.retrieve, vector_store_id)
+    except openai.NotFoundError:
+        return False
+    return store.status != "expired"
+
+def create_vector_store(client, paths, name):
+    print(f" Creating vector store {name}...")
+    vector_store = call_with_backoff(lambda name: client.vector_stores.create(name=name), name)
+
+    def upload(paths):
+        # Opened on every attempt, a failed one may have read them already
+        files = [open(path, "rb") for path in paths]
+        try:
+            client.vector_stores.file_batches.upload_and_poll(
+                vector_store_id=vector_store.id,
+                files=files
+            )
+        finally:
+            for f in files:
+                f.close()
+
+    print(f" Uploading {', '.join(paths)}...")
+    call_with_backoff(upload, paths)
+    return vector_store.id
+
+def get_vector_store(client, paths, name):
+    # Return the ID of a vector store holding exactly these files, creating it
+    # only when the files changed or the stored one is gone
+    key = fingerprint(paths)
+    with _lock:
+        if key in _verified:
+            return _verified[key]
+
+        registry = load_registry()
+        entry = registry.get(key)
+        if entry and is_usable(client, entry["id"]):
+            vector_store_id = entry["id"]
+            print(f" Reusing vector store {vector_store_id}")
+        else:
+            vector_store_id = create_vector_store(client, paths, name)
+            registry[key] = {
+                "id": vector_store_id,
+                "name": name,
+                "files": {path: file_version(path) for path in paths},
+                "created_at": time.time()
+            }
+            save_registry(registry)
+
+        _verified[key] = vector_store_id
+        return vector_store_id
+
+def is_stale(entry):
+    # A store is stale once any of its files changed or disappeared
+    for path, version in entry["files"].items():
+        if not os.path.exists(path):
+            return True
+        # Bypass the per-process memo: the file may have changed since
+        if file_version.__wrapped__(path) != version:
+            return True
+    return False
+
+def delete_vector_store(client, vector_store_id):
+    import openai
+    try:
+        call_with_backoff(client.vector_stores.delete, vector_store_id)
+        print(f" Deleted vector store {vector_store_id}")
+    except openai.NotFoundError:
+        print(f" Vector store {vector_store_id} was already gone")
+
+def cleanup(client, remove_all=False, orphans=False):
+    registry = load_registry()
+    for key, entry in list(registry.items()):
+        if remove_all or is_stale(entry):
+            delete_vector_store(client, entry["id"])
+            del registry[key]
+    save_registry(registry)
+
+    if orphans:
+        # Stores created by these scripts that the registry doesn't track
+        tracked = {entry["id"] for entry in registry.values()}
+        # The list is paged; every page is fetched inside the retried call
+        stores = call_with_backoff(lambda client: list(client.vector_stores.list()), client)
+        for store in stores:
+            if store.name in KNOWN_STORE_NAMES and store.id not in tracked:
+                delete_vector_store(client, store.id)
+
+if __name__ == "__main__":
+    from openai_client import get_client
+
+    parser = argparse.ArgumentParser(description="List or clean up the vector stores used by the classifiers.")
+    parser.add_argument("command", choices=["list", "cleanup"])
+    parser.add_argument("--all", action="store_true", help="Delete every registered store, not only stale ones")
+    parser.add_argument("--orphans", action="store_true",
+                        help="Also delete unregistered stores created by these scripts")
+    args = parser.parse_args()
+
+    client = get_client()
+
+    if args.command == "list":
+        for key, entry in load_registry().items():
+            status = "stale" if is_stale(entry) else "current"
+            print(f"{entry['id']}  {entry['name']}  {status}  {', '.join(entry['files'])}")
+    else:
+        cleanup(client, remove_all=args.all, orphans=args.orphans)